@@ -22,48 +22,117 @@
 # 3. Requires Python package colorama: https://pypi.python.org/pypi/colorama
 # 4. Requires Python package blessings: https://pypi.python.org/pypi/blessings
 # 5. Requires Python 3+.
+# 6. tcpflow is not needed when using pcap mode, any libpcap/pcapng capture will do (tcpdump, dumpcap, etc).
+# 7. ftlv.py archetypes requires Python package NumPy: https://pypi.python.org/pypi/numpy
 
 # === NOTES:
 # 1. Must be run before the game client logs in.
-# 2. Will create/overwrite faeriatrack_net.log in the current directory.
-# 3. Will create/overwrite faeriatrack_commands.log in the current directory.
+# 2. Will archive the raw capture (tcpflow mode) in archive/net_*.log.xz, indexed by archive/net.idx. See note 15.
+# 3. Will archive the commands seen in archive/commands_*.log.xz, indexed by archive/commands.idx.
 # 4. Will create/append to logs/faeriatrack_gamelog_YYYYMMDD.log - directory must exist.
+# 5. pcap mode reads captures from stdin or the files given after the mode and does not archive the raw capture.
+# 6. Several clients can be tracked from one capture (e.g. on a gateway). The board shows the first client seen,
+#    or the one given with --client IP; the others get faeriatrack_commands_IP.log and still write to the gamelog.
+# 7. replay mode feeds saved net/commands logs through the tracker without drawing, optionally writing games to --gamelog.
+# 8. rebuild mode re-derives games from archives (their .idx) or saved net/commands .log files (one client per file)
+#    in parallel and merges them into logs/faeriatrack_gamelog_YYYYMMDD.log, replacing games with the same stamp/opponent/deck.
+# 9. Will create/update cards.csv.idx (compiled cards.csv) next to cards.csv, delete it any time.
+# 10. --headless (tcpflow/pcap) tracks and logs games without drawing the board or loading colorama/blessings.
+# 11. Will create/update logs/faeriatrack_games.db, the indexed game history ftlv queries. rebuild updates it too.
+#     Games logged before it existed can be added with: python3 ftlv.py import logs/faeriatrack_gamelog_*.log
+# 12. tcpflow mode and pcap mode reading stdin save faeriatrack_state.json every turn. A tracker restarted within
+#     two hours resumes from it, so a crash or restart mid game only loses the turn in progress.
+# 13. --stats (tcpflow/pcap/replay) counts commands (also per name) and bytes and times handlers, board updates and the lag
+#     from data coming in to it being drawn.
+#     Written to faeriatrack_stats.log every minute and on exit. kill -USR1 starts/stops a cProfile session, saved as
+#     faeriatrack_profile_STAMP.prof with a summary in faeriatrack_stats.log.
+# 14. --serve [PORT] (tcpflow/pcap) serves the board state on localhost, port 8321 by default: GET /state for JSON,
+#     or a WebSocket on /ws for the full state followed by merge patch (RFC 7396) updates. See ftserve.py.
+# 15. Archives are rotated into compressed segments of about 64MB of log and the oldest segments deleted past 4GB
+#     (archivesegsize/archivemax). List the games in one with: python3 ftarchive.py archive/net.idx
+#     Extract game N with: python3 ftarchive.py archive/net.idx N, or replay it with: replay --game N archive/net.idx
+# 16. --timelines (tcpflow/pcap) records every game's timeline in logs/faeriatrack_timelines_YYYYMMDD.log, replay takes
+#     --timelines FILE. ftimeline.Timeline.stateAt(turn = N) or (event = N) rebuilds the game at that point.
+# 17. multi mode tracks many tcpflow streams at once, headless: sockets remote captures stream into (tcp:PORT on
+#     localhost, unix:PATH, one stream per connection), FIFOs and files still being written. Each stream gets its own
+#     trackers, archive/LABEL/ and logs/LABEL/ (gamelog, checkpoint, timelines); the game db is shared. A remote
+#     capture: sudo tcpflow ... | nc -N HOST 9000 (over an ssh tunnel, it only listens on localhost). See ftingest.py.
+#     Followed files carry on where they were left off (logs/faeriatrack_offsets.json), --from-start reads them again.
 
 # === KNOWN ISSUES:
-# 1. Does not work with resuming games.
+# 1. Does not work with resuming games the tracker did not see the start of (see note 12 for restarting the tracker).
 # 2. Does not work with decks created while the tracker is running. Workaround: Edit and save the deck after creating it.
 # 3. Does not respect terminal width/height so make sure the window is big enough.
 
 
-import colorama
-colorama.init()
-
-import copy
+import functools
+import hashlib
+import io
+import itertools
+import mmap
 import collections
+import collections.abc
 import subprocess
-import blessings
 import time
 import sys
 import re
-import binascii
 import json
+import signal
 import os.path
+import queue
+import struct
+import threading
 
-term = blessings.Terminal()
+import ftimeline
+import ftodds
+import ftpredict
+import ftstats
+# ftarchive (lzma), ftdb (sqlite3), ftpcap and concurrent.futures are imported where they are used,
+# together they would double the startup time of runs that need none of them.
 
 version = '0.0.8a'
 
+# Upper limit on board redraws per second.
+renderfps = 10
+
+# Rows of predicted opponent cards shown under their deck.
+predictrows = 8
+
+# Draw odds are shown for this many draws ahead, e.g. (1, 2, 3) shows the next three turns.
+drawhorizons = (1, 2, 3)
+
+# Net and commands logs are archived here (see ftarchive.py), in segments of about archivesegsize
+# characters of log. The oldest segments are deleted to keep each archive under archivemax bytes.
+archivedir = 'archive'
+archivesegsize = 64 << 20
+archivemax = 4 << 30
+
 
-def tg(x, y):
-  sys.stdout.write(term.move(x, y))
+terminal = None
+def getTerminal():
+  '''Returns the blessings Terminal. colorama and blessings are only imported (and colorama
+     initialised) the first time something is drawn, headless use never pays for them.'''
+  global terminal
+  if terminal is None:
+    import colorama
+    colorama.init()
+    import blessings
+    terminal = blessings.Terminal()
+  return terminal
 
 
-def tc():
-  sys.stdout.write(term.clear())
+termwidth = None
+def terminalWidth():
+  '''term.width asks the terminal every time, the answer only changes on SIGWINCH.'''
+  global termwidth
+  if termwidth is None:
+    termwidth = getTerminal().width or 80
+  return termwidth
 
 
-def p(*args):
-  print(*args, end = '')
+def resized(signum, frame):
+  global termwidth
+  termwidth = None
 
 
 def percent(amount, total):
@@ -72,7 +141,153 @@ def percent(amount, total):
   return (float(amount) / float(total)) * 100.0
 
 
+@functools.lru_cache(maxsize = 4096)
+def shortName(cardname, maxlen):
+  if ',' in cardname:
+    prefix,rest = cardname.split(',', 1)
+    rest = rest.strip()
+    abbrevrest = ''.join(w.strip()[:1] for w in rest.split(None))
+    cardname = ', '.join((prefix, abbrevrest))
+  return cardname[:maxlen]
+
+
+re_escape = re.compile(r'\x1b(?:\[[0-9;?]*[A-Za-z]|\([A-Z0-9])')
+def visibleLen(s):
+  return len(re_escape.sub('', s))
+
+
+class Frame(object):
+  '''One screen worth of output: (row, col) -> string with embedded escapes.
+     key identifies what is being shown, a new key forces a full repaint. Frames with
+     a lower seq than the last one drawn are older and not drawn. received is the
+     monotonic time the oldest data new in this frame came in, for --stats.'''
+  def __init__(self, key, width, seq = 0):
+    self.key = key
+    self.width = width
+    self.seq = seq
+    self.received = None
+    self.cells = {}
+    self.cursor = (0, 0)
+
+  def put(self, row, col, s):
+    self.cells[(row, col)] = s
+
+
+class Renderer(object):
+  '''Draws Frames by only rewriting cells that changed since the last one drawn.
+     Drawing happens on its own thread, at most maxfps frames per second, so a slow
+     terminal never holds up tracking. request(build) asks for a frame: build() is
+     only called once the next one is due, so any number of requests in between cost
+     one frame. maxfps 0 builds and draws every frame right away in the requesting thread.'''
+  def __init__(self, out = None, maxfps = None):
+    # None means whatever sys.stdout is when drawing (colorama may have wrapped it by then).
+    self.out = out
+    maxfps = renderfps if maxfps is None else maxfps
+    self.interval = 1.0 / maxfps if maxfps > 0 else 0.0
+    # lock guards pending, drawlock is held for the whole of a draw.
+    self.lock = threading.Lock()
+    self.wake = threading.Condition(self.lock)
+    self.drawlock = threading.Lock()
+    self.last = None
+    self.lastkey = None
+    self.lastwidth = None
+    self.lastseq = 0
+    self.lasttime = 0.0
+    # The build function of the frame asked for.
+    self.pending = None
+    self.thread = None
+    if hasattr(signal, 'SIGWINCH') and threading.current_thread() is threading.main_thread():
+      signal.signal(signal.SIGWINCH, resized)
+
+  def request(self, build):
+    '''build() returns the Frame to draw (or None), it is called on the drawing thread.'''
+    if self.interval == 0.0:
+      self.pending = build
+      self.drawPending()
+      return
+    with self.lock:
+      self.pending = build
+      if self.thread is None:
+        self.thread = threading.Thread(target = self.run, name = 'Renderer')
+        self.thread.daemon = True
+        self.thread.start()
+      self.wake.notify()
+
+  def run(self):
+    while True:
+      with self.lock:
+        while self.pending is None:
+          self.wake.wait()
+      wait = self.lasttime + self.interval - time.monotonic()
+      if wait > 0:
+        time.sleep(wait)
+      self.drawPending()
+
+  def drawPending(self):
+    with self.lock:
+      build = self.pending
+      self.pending = None
+    if build is None:
+      return
+    # Built outside drawlock: build() may wait for the tracker, which may be waiting in flush().
+    frame = build()
+    if frame is None:
+      return
+    with self.drawlock:
+      # A newer frame was built and drawn by flush() meanwhile.
+      if frame.seq < self.lastseq:
+        return
+      self.draw(frame)
+
+  def flush(self):
+    '''Draws the waiting frame, if any, before returning.'''
+    self.drawPending()
+
+  def invalidate(self):
+    with self.drawlock:
+      self.last = None
+
+  def draw(self, frame):
+    term = getTerminal()
+    out = []
+    cells = frame.cells
+    if self.last is None or frame.key != self.lastkey or frame.width != self.lastwidth:
+      out.append(term.clear())
+      old = {}
+    else:
+      old = self.last
+    move = term.move
+    for pos,s in cells.items():
+      olds = old.get(pos)
+      if olds == s:
+        continue
+      out.append(move(*pos))
+      out.append(s)
+      if olds is not None:
+        pad = visibleLen(olds) - visibleLen(s)
+        if pad > 0:
+          out.append(' ' * pad)
+    for pos,olds in old.items():
+      if pos not in cells:
+        out.append(move(*pos))
+        out.append(' ' * visibleLen(olds))
+    out.append(move(*frame.cursor))
+    fp = self.out if self.out is not None else sys.stdout
+    fp.write(''.join(out))
+    fp.flush()
+    self.last = cells
+    self.lastkey = frame.key
+    self.lastwidth = frame.width
+    self.lastseq = frame.seq
+    self.lasttime = time.monotonic()
+    if frame.received is not None:
+      stats = ftstats.current
+      if stats is not None:
+        stats.observe('lag receive to board', self.lasttime - frame.received)
+
+
 class Card(object):
+  __slots__ = ('cardid', 'name', 'text')
   def __init__(self, cardid, name = None, text = None):
     self.cardid = cardid
     self.name = name
@@ -83,22 +298,31 @@ class Card(object):
 
 
 class DeckCard(object):
+    __slots__ = ('card', 'quantity', 'hquantity', 'generated')
     def __init__(self, card, quantity):
         self.card = card
         self.quantity = quantity
         self.hquantity = 0
         self.generated = False
 
+    def copy(self):
+        dc = DeckCard(self.card, self.quantity)
+        dc.hquantity = self.hquantity
+        dc.generated = self.generated
+        return dc
+
     def __repr__(self):
         card = self.card
         return '<DeckCard({0}): name={1}, quantity={2}>'.format(card.cardid, card.name, self.quantity)
 
 
 class Deck(object):
+  __slots__ = ('deckid', 'name', 'cards', 'frozen')
   def __init__(self, deckid, name = None):
     self.deckid = deckid
     self.name = name
     self.cards = collections.OrderedDict()
+    self.frozen = None
 
   def cardcount(self):
     result = 0
@@ -106,16 +330,95 @@ class Deck(object):
         result += dc.quantity
     return result
 
+  def freeze(self):
+    '''Returns a snapshot of the deck for games to share. Kept until changed() is called.'''
+    frozen = self.frozen
+    if frozen is None:
+      frozen = FrozenDeck(self.deckid, self.name,
+                          collections.OrderedDict((cardid, DeckCard(dc.card, dc.quantity)) for cardid,dc in self.cards.items()))
+      self.frozen = frozen
+    return frozen
+
+  def changed(self):
+    self.frozen = None
+
   def __repr__(self):
     return ('<Deck({0}): name={1}, cards={2}>').format(self.deckid, self.name, self.cards)
 
 
+class FrozenDeck(object):
+  '''Deck contents at some point in time. Never modified, so any number of games can share it.'''
+  __slots__ = ('deckid', 'name', 'cards')
+  def __init__(self, deckid, name, cards):
+    self.deckid = deckid
+    self.name = name
+    self.cards = cards
+
+
+class OverlayCards(object):
+  '''Copy on write view of a FrozenDeck's cards. get() hands out a private copy of a DeckCard
+     the first time it is asked for one, untouched cards are read straight from the frozen deck.'''
+  __slots__ = ('base', 'own', 'extra')
+  def __init__(self, base):
+    self.base = base
+    self.own = {}
+    self.extra = []
+
+  def get(self, cardid, default = None):
+    dc = self.own.get(cardid)
+    if dc is None:
+      bdc = self.base.get(cardid)
+      if bdc is None:
+        return default
+      dc = bdc.copy()
+      self.own[cardid] = dc
+    return dc
+
+  def __setitem__(self, cardid, dc):
+    if cardid not in self.base and cardid not in self.own:
+      self.extra.append(cardid)
+    self.own[cardid] = dc
+
+  def __contains__(self, cardid):
+    return cardid in self.own or cardid in self.base
+
+  def __len__(self):
+    return len(self.base) + len(self.extra)
+
+  def values(self):
+    own = self.own
+    for cardid,dc in self.base.items():
+      yield own.get(cardid, dc)
+    for cardid in self.extra:
+      yield own[cardid]
+
+
+class GameDeck(object):
+  '''A player's deck during one game, sharing cards with the FrozenDeck it started from.'''
+  __slots__ = ('deckid', 'name', 'cards')
+  def __init__(self, frozen):
+    self.deckid = frozen.deckid
+    self.name = frozen.name
+    self.cards = OverlayCards(frozen.cards)
+
+  def cardcount(self):
+    result = 0
+    for dc in self.cards.values():
+        result += dc.quantity
+    return result
+
+  def __repr__(self):
+    return ('<GameDeck({0}): name={1}, cards={2}>').format(self.deckid, self.name, list(self.cards.values()))
+
+
 
 class Game(object):
+  __slots__ = ('mypnum', 'oname', 'inideck', 'players', 'gamecards', 'turn', 'currpnum',
+               'selfmode', 'oppmode', 'opprank', 'oppgrank', 'oppname', 'odds', 'prediction', 'timeline')
   def __init__(self, deck):
     self.mypnum = None
     self.oname = None
-    self.inideck = copy.deepcopy(deck)
+    self.inideck = deck.freeze()
     self.players = {}
     self.gamecards = {}
     self.turn = 0
@@ -125,8 +428,14 @@ class Game(object):
     self.opprank = '?'
     self.oppgrank = '?'
     self.oppname = None
+    self.odds = ftodds.DrawOdds(drawhorizons)
+    # ftpredict.Prediction for the opponent's deck, if there is history to predict from.
+    self.prediction = None
+    # ftimeline.Timeline of the game, if the tracker records them.
+    self.timeline = None
 
 class Lands(object):
+  __slots__ = ('human', 'red', 'blue', 'green', 'yellow')
   def __init__(self):
     self.human = 0
     self.red = 0
@@ -140,6 +449,7 @@ class Lands(object):
 
 
 class Player(object):
+  __slots__ = ('pnum', 'name', 'health', 'handcards', 'deckcards', 'faeria', 'harvested', 'deck', 'lands')
   def __init__(self, pnum, name, deck):
     self.pnum = pnum
     self.name = name
@@ -153,12 +463,100 @@ class Player(object):
 
 
 
+class Args(object):
+  '''Handler args for commands without a fixed layout, split only when indexed.
+     get(key) finds a key:value arg without parsing the rest, like toArgDict the last one wins.'''
+  __slots__ = ('rest', 'parts', 'values')
+
+  def __init__(self, rest):
+    self.rest = rest
+    self.parts = None
+    self.values = None
+
+  def split(self):
+    parts = self.parts
+    if parts is None:
+      parts = self.rest.split('|') if self.rest else []
+      self.parts = parts
+    return parts
+
+  def __len__(self):
+    return len(self.split())
+
+  def __getitem__(self, idx):
+    return self.split()[idx]
+
+  def __iter__(self):
+    return iter(self.split())
+
+  def get(self, key, default = None):
+    values = self.values
+    if values is None:
+      values = self.values = {}
+    elif key in values:
+      value = values[key]
+      return default if value is None else value
+    rest = self.rest
+    needle = key + ':'
+    pos = rest.rfind('|' + needle)
+    if pos >= 0:
+      pos += 1
+    elif rest.startswith(needle):
+      pos = 0
+    else:
+      values[key] = None
+      return default
+    pos += len(needle)
+    end = rest.find('|', pos)
+    value = rest[pos:] if end < 0 else rest[pos:end]
+    values[key] = value
+    return value
+
+  def __repr__(self):
+    return '<Args: {0}>'.format(self.rest)
+
+
+checkpointversion = 1
+
+def encodeDeckCards(dcs):
+  return [[dc.card.cardid, dc.quantity, dc.hquantity, dc.generated] for dc in dcs]
+
+def decodeDeckCards(cards, encoded, into):
+  for cardid,quantity,hquantity,generated in encoded:
+    dc = DeckCard(cards[cardid], quantity)
+    dc.hquantity = hquantity
+    dc.generated = generated
+    into[cardid] = dc
+
 
 class Tracker(object):
   handlers = {}
-  def __init__(self, cards, logfp):
+  argtypes = {}
+  def __init__(self, cards, logfp = None, renderer = None, sink = None, gamedb = None, checkpointfn = None, deckindex = None):
     self.cards = cards
+    # Finished games are written here as JSON lines, if set.
     self.logfp = logfp
+    # And added to this ftdb.GameDB, if set.
+    self.gamedb = gamedb
+    # No renderer means headless. Status messages go to sink(msg), or nowhere if not set.
+    self.renderer = renderer
+    self.sink = sink
+    # Held while the tracker is fed and while a frame of it is built.
+    self.lock = threading.RLock()
+    self.frameseq = 0
+    # Monotonic time the oldest data not yet on the board came in, only kept with --stats.
+    self.received = None
+    # Capture time (epoch seconds) of what is being fed, None for live.
+    self.now = None
+    # State is saved here at the start of every turn and at the end of a game, if set.
+    self.checkpointfn = checkpointfn
+    self.checkpointer = None
+    # ftpredict.DeckIndex of past opponent decks, if set the opponent's deck is predicted from it.
+    self.deckindex = deckindex
+    # Called as onevent(name, info) at a session reset ('session'), game start ('start') and end ('end'), if set.
+    self.onevent = None
+    # Where finished game timelines go, see recordTimelines().
+    self.timelinefp = None
     self.reset()
 
   def reset(self):
@@ -167,17 +565,300 @@ class Tracker(object):
     self.name = None
     self.game = None
     self.dirty = False
+    # The game came from a checkpoint, its end may have happened while we were not running.
+    self.resumed = False
+
+  def instrument(self, stats):
+    '''Times every handler call and board update into stats (an ftstats.Stats), and counts
+       every command fed by name, handled or not.'''
+    self.handlers = dict((cmd, stats.timed('handler ' + cmd, handler)) for cmd,handler in self.handlers.items())
+    feed = self.feed
+    count = stats.count
+    def counted(line):
+      parts = line.split('|', 2)
+      count('command ' + (parts[1].rstrip() if len(parts) > 1 else '?'))
+      feed(line)
+    self.feed = counted
+    self.buildFrame = stats.timed('buildFrame', self.buildFrame)
+    if self.renderer is not None:
+      self.renderer.draw = stats.timed('render draw', self.renderer.draw)
+
+  def recordTimelines(self, fp = None, keyevery = 4):
+    '''Records a timeline (game.timeline) of every game from here on, with a keyframe every keyevery
+       turns. Finished games are written to fp as JSON lines, if set.'''
+    self.timelinefp = fp
+    self.keyevery = keyevery
+    handlers = dict(self.handlers)
+    for cmd in Tracker.timelinecmds:
+      handlers[cmd] = self.recorded(handlers[cmd])
+    self.handlers = handlers
+
+  @staticmethod
+  def recorded(handler):
+    def wrapper(self, seqnum, cmd, args):
+      handler(self, seqnum, cmd, args)
+      game = self.game
+      if game is not None and game.currpnum is not None:
+        self.recordEvent(game, cmd, args)
+    return wrapper
+
+  # Commands that can change a game once both players are known.
+  timelinecmds = ('~iam', '~newTurn', '#ZoneMove', '~playerState', '#FaeriaGain', '#PayFaeria', '#HarvestFaeria',
+                  '#CreateTokenLand', '*createGameCard', '$victory')
+
+  def recordEvent(self, game, cmd, args):
+    timeline = game.timeline
+    if timeline is None:
+      # At ~iam, or the first command of a resumed game.
+      game.timeline = timeline = ftimeline.Timeline(self.keyevery)
+      self.timelineKeyframe(game)
+      return
+    last = timeline.last
+    changes = []
+    if cmd == '#ZoneMove':
+      gc = game.gamecards.get(args[1])
+      if gc is not None:
+        cardid = gc[2].cardid
+        for pnum,player in game.players.items():
+          cards = player.deck.cards
+          # Not get(), that makes an own copy of untouched cards in a GameDeck.
+          dc = cards.own.get(cardid) if isinstance(cards, OverlayCards) else cards.get(cardid)
+          if dc is None:
+            continue
+          key = (pnum, cardid)
+          value = (dc.quantity, dc.hquantity, dc.generated)
+          if last.get(key) != value:
+            last[key] = value
+            changes.append(['c', pnum, cardid, dc.quantity, dc.hquantity, dc.generated])
+    elif cmd == '*createGameCard':
+      gcid = int(args[0])
+      gc = game.gamecards.get(gcid)
+      if gc is not None:
+        changes.append(['g', gcid, gc[0], gc[1], gc[2].cardid])
+    elif cmd == '~newTurn':
+      timeline.event(cmd, [['t', game.turn, game.currpnum]])
+      if game.turn % timeline.keyevery == 0:
+        self.timelineKeyframe(game)
+      return
+    elif cmd == '$victory':
+      if self.timelinefp is not None:
+        record = { 'stamp': time.strftime('%Y%m%dT%H%M%S', time.localtime(self.now)), 'opponent': game.oppname,
+                   'timeline': timeline.todict() }
+        self.timelinefp.write(json.dumps(record, separators = (',', ':')))
+        self.timelinefp.write('\n')
+        self.timelinefp.flush()
+      return
+    else:
+      for pnum,player in game.players.items():
+        lands = player.lands
+        value = (player.health, player.handcards, player.deckcards, player.faeria, player.harvested,
+                 (lands.human, lands.red, lands.blue, lands.green, lands.yellow))
+        old = last.get(pnum) or (None,) * 6
+        if old != value:
+          last[pnum] = value
+          # Fields 2-7 of a checkpoint player.
+          for field,(a,b) in enumerate(zip(old, value), 2):
+            if a != b:
+              changes.append(['p', pnum, field, list(b) if field == 7 else b])
+    if changes:
+      timeline.event(cmd, changes)
+
+  def timelineKeyframe(self, game):
+    state = self.checkpoint()
+    state['decks'] = []
+    game.timeline.keyframe(state)
+    last = game.timeline.last
+    for pnum,player in game.players.items():
+      lands = player.lands
+      last[pnum] = (player.health, player.handcards, player.deckcards, player.faeria, player.harvested,
+                    (lands.human, lands.red, lands.blue, lands.green, lands.yellow))
+
+  def checkpoint(self):
+    '''Returns the tracker state as JSON safe lists and dicts. Cards are kept by id only.'''
+    state = {
+      'version': checkpointversion,
+      'name': self.name,
+      'currdeckid': self.currdeckid,
+      'decks': [[d.deckid, d.name, encodeDeckCards(d.cards.values())] for d in self.decks.values()],
+      'game': None,
+      }
+    game = self.game
+    if game is not None:
+      players = []
+      for p in game.players.values():
+        deck = p.deck
+        if isinstance(deck, GameDeck):
+          dstate = ['game', encodeDeckCards(deck.cards.own.values()), list(deck.cards.extra)]
+        else:
+          dstate = ['deck', deck.deckid, deck.name, encodeDeckCards(deck.cards.values())]
+        lands = p.lands
+        players.append([p.pnum, p.name, p.health, p.handcards, p.deckcards, p.faeria, p.harvested,
+                        [lands.human, lands.red, lands.blue, lands.green, lands.yellow], dstate])
+      inideck = game.inideck
+      state['game'] = {
+        'inideck': [inideck.deckid, inideck.name, encodeDeckCards(inideck.cards.values())],
+        'gamecards': [[gcid, pnum, typ, card.cardid] for gcid,(pnum,typ,card) in game.gamecards.items()],
+        'players': players,
+        'attrs': dict((k, getattr(game, k)) for k in ('mypnum', 'oname', 'turn', 'currpnum', 'selfmode', 'oppmode', 'opprank', 'oppgrank', 'oppname')),
+        }
+    return state
+
+  def restore(self, state):
+    '''Replaces the tracker state with one from checkpoint().'''
+    if state.get('version') != checkpointversion:
+      raise ValueError('Tracker:restore: Unsupported checkpoint version {0}'.format(state.get('version')))
+    cards = self.cards
+    self.reset()
+    self.name = state['name']
+    self.currdeckid = state['currdeckid']
+    for deckid,name,dcards in state['decks']:
+      deck = Deck(deckid, name)
+      decodeDeckCards(cards, dcards, deck.cards)
+      self.decks[deckid] = deck
+    gstate = state['game']
+    if gstate is None:
+      return
+    deckid,name,dcards = gstate['inideck']
+    inideck = Deck(deckid, name)
+    decodeDeckCards(cards, dcards, inideck.cards)
+    game = Game(inideck)
+    for k,v in gstate['attrs'].items():
+      setattr(game, k, v)
+    for gcid,pnum,typ,cardid in gstate['gamecards']:
+      game.gamecards[gcid] = (pnum, typ, cards[cardid])
+    for pnum,name,health,handcards,deckcards,faeria,harvested,lands,dstate in gstate['players']:
+      if dstate[0] == 'game':
+        deck = GameDeck(game.inideck)
+        decodeDeckCards(cards, dstate[1], deck.cards.own)
+        deck.cards.extra = dstate[2]
+      else:
+        deck = Deck(dstate[1], dstate[2])
+        decodeDeckCards(cards, dstate[3], deck.cards)
+      player = Player(pnum, name, deck)
+      player.health = health
+      player.handcards = handcards
+      player.deckcards = deckcards
+      player.faeria = faeria
+      player.harvested = harvested
+      plands = player.lands
+      plands.human,plands.red,plands.blue,plands.green,plands.yellow = lands
+      game.players[pnum] = player
+    if self.deckindex is not None and game.mypnum is not None:
+      game.prediction = prediction = ftpredict.Prediction(self.deckindex)
+      for dc in game.players[1 - game.mypnum].deck.cards.values():
+        prediction.reveal(dc.card.cardid)
+    self.game = game
+    self.resumed = True
+    self.dirty = True
+
+  def saveCheckpoint(self):
+    # Serialised here, while the state is consistent. The disk is left to the CheckpointWriter's thread.
+    if self.checkpointer is None:
+      self.checkpointer = CheckpointWriter(self.checkpointfn)
+    self.checkpointer.save(json.dumps(self.checkpoint(), separators = (',', ':')))
+
+  def close(self):
+    '''Waits for the last checkpoint to be written.'''
+    if self.checkpointer is not None:
+      self.checkpointer.close()
+      self.checkpointer = None
+
+  def view(self):
+    '''Returns what the board shows as JSON safe dicts, for ftserve. Built fresh on every call,
+       safe to call from another thread than the one feeding the tracker.'''
+    with self.lock:
+      return self.buildView()
+
+  def buildView(self):
+    deck = self.decks.get(self.currdeckid)
+    state = { 'name': self.name, 'deck': deck.name if deck is not None else None, 'game': None }
+    game = self.game
+    if game is None or game.currpnum is None:
+      return state
+    odds = game.odds
+    players = {}
+    for pnum,player in game.players.items():
+      mine = pnum == game.mypnum
+      pdeck = player.deck
+      cards = {}
+      # Copies left in the deck of each card listed, for the odds of drawing any of them.
+      known = []
+      for dc in (pdeck.cards.values() if pdeck is not None else ()):
+        if mine:
+          copies = dc.quantity
+        elif dc.quantity > 3:
+          copies = None
+        else:
+          copies = 3 - dc.quantity
+        chances = None
+        if copies is not None:
+          chances = odds.cardChances(player.deckcards, copies)
+          known.append(copies)
+        cards[str(dc.card.cardid)] = {
+          'name': dc.card.name, 'deck': dc.quantity, 'hand': dc.hquantity, 'generated': dc.generated,
+          'odds': [round(c, 3) for c in chances] if chances is not None else None }
+      unknown = player.deckcards - pdeck.cardcount() if mine and pdeck is not None else player.deckcards
+      players[str(pnum)] = {
+        'name': player.name, 'health': player.health, 'faeria': player.faeria, 'eco': player.harvested,
+        'deckcards': player.deckcards, 'handcards': player.handcards, 'lands': player.lands.todict(),
+        'unknown': unknown, 'cards': cards,
+        'groupodds': {
+          'known': [round(c, 3) for c in odds.groupChances(player.deckcards, known)],
+          'unknown': [round(c, 3) for c in odds.groupChances(player.deckcards, (max(0, unknown),))] } }
+    likely = None
+    prediction = game.prediction
+    if prediction is not None and prediction.count():
+      likely = { 'decks': prediction.count(), 'cards': [] }
+      for cardid,share in prediction.likely(predictrows):
+        card = self.cards.get(cardid)
+        likely['cards'].append([cardid, card.name if card is not None else str(cardid), round(share, 3)])
+    state['game'] = {
+      'turn': game.turn, 'current': game.currpnum, 'me': game.mypnum, 'horizons': list(odds.horizons),
+      'selfmode': game.selfmode, 'oppmode': game.oppmode, 'opprank': game.opprank, 'oppgrank': game.oppgrank,
+      'oppname': game.oppname, 'players': players, 'likely': likely }
+    return state
 
   def feed(self, line):
-    parts = line.strip().split('|')
-    if len(parts) == 1:
-      return
-    seqnum = parts[0]
-    cmd = parts[1]
-    args = parts[2:]
-    handler = self.handlers.get(cmd)
-    if handler:
-      handler(self, seqnum, cmd, args)
+    # seqnum|cmd|args - only split off cmd, most commands have no handler.
+    parts = line.split('|', 2)
+    if len(parts) == 3:
+      handler = self.handlers.get(parts[1])
+      if handler is None:
+        return
+      seqnum,cmd,rest = parts
+      rest = rest.rstrip()
+    elif len(parts) == 2:
+      seqnum,cmd = parts
+      cmd = cmd.rstrip()
+      rest = ''
+      handler = self.handlers.get(cmd)
+      if handler is None:
+        return
+    else:
+      return
+    types = self.argtypes.get(cmd)
+    if types is None:
+      args = Args(rest)
+    else:
+      args = rest.split('|')
+      if len(args) != len(types):
+        raise ValueError('Tracker:feed: {0} expects {1} args, got {2}'.format(cmd, len(types), len(args)))
+      args = [t(a) for t,a in zip(types, args)]
+    handler(self, seqnum.strip(), cmd, args)
+
+
+  def say(self, msg):
+    sink = self.sink
+    if sink is None:
+      return
+    renderer = self.renderer
+    if renderer is None:
+      sink(msg)
+      return
+    # Get the board out first so the message lands below it, then repaint from scratch.
+    renderer.flush()
+    sink(msg)
+    renderer.invalidate()
 
 
   def toArgDict(self, args):
@@ -186,104 +867,123 @@ class Tracker(object):
 
   modetranslate = { 'COMPETITIVE': 'R', 'CASUAL': 'C' }
   def showStatus(self):
+    '''Asks for the board to be redrawn, the frame is built when the renderer gets to it.'''
     self.dirty = False
+    if self.renderer is not None:
+      self.renderer.request(self.buildFrame)
+
+  def buildFrame(self):
+    # On the renderer's thread, while the tracker is being fed on another.
+    with self.lock:
+      self.frameseq += 1
+      frame = Frame(None, terminalWidth(), self.frameseq)
+      frame.received,self.received = self.received,None
+      return self.drawBoard(frame)
+
+  def drawBoard(self, frame):
     if not self.game:
-      return
+      return None
     game = self.game
     if game.currpnum is None:
-      return
+      return None
     currplayer = game.players[game.currpnum]
-    tc()
+    term = getTerminal()
+    width = frame.width
+    frame.key = id(game)
+    put = frame.put
     smode = Tracker.modetranslate.get(game.selfmode, game.selfmode)
     omode = Tracker.modetranslate.get(game.oppmode, game.oppmode)
-    p('#{bold}{turn:d}{norm} - Playing({selfmode}v{oppmode}): {bold}{currname}{norm}'
+    bold = term.bold
+    norm = term.normal
+    put(0, 0, '#{bold}{turn:d}{norm} - Playing({selfmode}v{oppmode}): {bold}{currname}{norm}'
       .format(turn = game.turn, currname = currplayer.name,
-              bold = term.bold, norm = term.normal, oppmode = omode, selfmode = smode))
+              bold = bold, norm = norm, oppmode = omode, selfmode = smode))
     maxdlen = 0
-    halfwidth = term.width / 2
-    maxnamelen = int(halfwidth - 10)
+    halfwidth = width / 2
+    odds = game.odds
+    oddswidth = odds.width()
+    maxnamelen = int(halfwidth - 8 - oddswidth)
     for pnum in range(0,2):
       player = game.players[pnum]
-      if pnum == game.mypnum:
+      mine = pnum == game.mypnum
+      if mine:
           unknown = player.deckcards - player.deck.cardcount()
       else:
           unknown = player.deckcards
       y = (int(halfwidth) + 2) * pnum
-      tg(1, y)
       if pnum == game.currpnum:
-          p(term.bold_reverse)
-      p('{0}'.format(player.name))
-      p(term.normal)
-      tg(2, y)
-      p('HP:{bold}{hp: <2d}{norm} / MP:{bold}{mp: <2d}{norm} / Eco:{bold}{eco: <3d}{norm}{pos}D:{bold}{deck: <2d}{norm} / H:{bold}{hand: <2d}{norm} / L:{lands}'.format(
+        put(1, y, '{0}{1}{2}'.format(term.bold_reverse, player.name, norm))
+      else:
+        put(1, y, '{0}{1}'.format(player.name, norm))
+      put(2, y, 'HP:{bold}{hp: <2d}{norm} / MP:{bold}{mp: <2d}{norm} / Eco:{bold}{eco: <3d}{norm}'.format(
           hp = player.health,
           mp = player.faeria,
           eco = player.harvested,
+          bold = bold,
+          norm = norm))
+      put(3, y, 'D:{bold}{deck: <2d}{norm} / H:{bold}{hand: <2d}{norm} / L:{lands}'.format(
           deck = player.deckcards,
           hand = player.handcards,
-          bold = term.bold,
-          norm = term.normal,
-          pos = term.move(3, y),
-          lands = player.lands.pretty()
-      ))
+          bold = bold,
+          norm = norm,
+          lands = player.lands.pretty()))
       pdeck = player.deck
       if pdeck == None:
           continue
-      maxdlen = max(len(pdeck.cards), maxdlen)
       cnum = 0
       for dc in player.deck.cards.values():
-        if pnum == game.mypnum:
-          percdraw = int(percent(dc.quantity, player.deckcards))
-          if percdraw >= 100:
-            percdraw = 'NX'
-          else:
-            percdraw = '{0: >2d}'.format(percdraw)
+        if mine:
+          percdraw = odds.cardText((pnum, dc.card.cardid), player.deckcards, dc.quantity)
+        elif dc.quantity > 3:
+          percdraw = '??'.rjust(oddswidth)
         else:
-            if dc.quantity > 3:
-              percdraw = '??'
-            else:
-              percdraw = int(percent(3 - dc.quantity, player.deckcards))
-              if percdraw >= 100:
-                percdraw = 'NX'
-              else:
-                percdraw = '{0: >2d}'.format(percdraw)
-        tg(4 + cnum, y)
+          percdraw = odds.cardText((pnum, dc.card.cardid), player.deckcards, 3 - dc.quantity)
         if dc.quantity > 0:
-          p(term.bold)
+          qstyle = bold
         elif not dc.generated:
-          p(term.bright_red_underline)
-        p('{0: >2d}'.format(dc.quantity + dc.hquantity))
-        p(term.normal)
-        p('x')
-        p('{percdraw}{bold}%{norm} '.format(percdraw = percdraw, bold = term.bold, norm = term.normal))
+          qstyle = term.bright_red_underline
+        else:
+          qstyle = ''
+        nstyle = ''
         if dc.hquantity > 0:
-          p(term.reverse)
+          nstyle = term.reverse
         if dc.generated:
-          p(term.underline)
-        cardname = dc.card.name
-        if ',' in cardname:
-          prefix,rest = cardname.split(',', 1)
-          rest = rest.strip()
-          abbrevrest = ''.join(w.strip()[:1] for w in rest.split(None))
-          cardname = ', '.join((prefix, abbrevrest))
-        p('{0}'.format(cardname[:maxnamelen]))
-        p(term.normal)
+          nstyle += term.underline
+        put(4 + cnum, y, '{qstyle}{quantity: >2d}{norm}x{percdraw}{bold}%{norm} {nstyle}{name}{norm}'.format(
+            qstyle = qstyle, quantity = dc.quantity + dc.hquantity, percdraw = percdraw,
+            nstyle = nstyle, name = shortName(dc.card.name, maxnamelen), bold = bold, norm = norm))
         cnum += 1
       if unknown > 0:
-        tg(4 + cnum, y)
-        p('{bold}{quantity: >2d}{norm}:     <{ita}Unknown{norm}>'
-          .format(quantity = unknown, bold = term.bold, norm = term.normal, ita = term.italic))
-    tg(6 + maxdlen, 0)
-    sys.stdout.flush()
+        # Any of our cards not seen yet. Everything of the opponent's is unseen, no point in odds there.
+        if mine:
+          percdraw = odds.groupText((pnum, 'unknown'), player.deckcards, (unknown,))
+          unknowntext = '{bold}{quantity: >2d}{norm}x{percdraw}{bold}%{norm} <{ita}Unknown{norm}>'
+        else:
+          percdraw = ''
+          unknowntext = '{bold}{quantity: >2d}{norm}:{pad}<{ita}Unknown{norm}>'
+        put(4 + cnum, y, unknowntext.format(quantity = unknown, percdraw = percdraw, bold = bold, norm = norm,
+                                            ita = term.italic, pad = ' ' * (oddswidth + 3)))
+        cnum += 1
+      prediction = game.prediction
+      if not mine and prediction is not None:
+        likely = prediction.likely(predictrows)
+        if likely:
+          ndecks = prediction.count()
+          put(4 + cnum, y, '{ita}Likely from {0} past deck{1}:{norm}'.format(
+            ndecks, 's' if ndecks != 1 else '', ita = term.italic, norm = norm))
+          cnum += 1
+          for cardid,share in likely:
+            card = self.cards.get(cardid)
+            put(4 + cnum, y, '{share: >3d}% {name}'.format(
+              share = int(share * 100.0), name = shortName(card.name if card is not None else str(cardid), maxnamelen)))
+            cnum += 1
+      maxdlen = max(cnum, maxdlen)
+    frame.cursor = (5 + maxdlen, 0)
+    return frame
 
 
   def handler_playerstate(self, seqnum, cmd, args):
     pnum,health,faeria,handcards,deckcards,wut = args
-    pnum = int(pnum)
-    health = int(health)
-    faeria = int(faeria)
-    handcards = int(handcards)
-    deckcards = int(deckcards)
     if not self.game:
       return
     player = self.game.players[pnum]
@@ -295,8 +995,7 @@ class Tracker(object):
 
 
   def handler_clearroom(self, seqnum, cmd, args):
-    argdict = self.toArgDict(args)
-    dr = argdict.get('dr')
+    dr = args.get('dr')
     if not dr:
       return
     if dr[:4] != 'deck':
@@ -306,21 +1005,21 @@ class Tracker(object):
     if not deck:
       raise ValueError('Tracker:clearroom: Attempt to clear cards for unknown deckid {0}'.format(deckid))
     deck.cards = collections.OrderedDict()
+    deck.changed()
 
 
   def handler_set(self, seqnum, cmd, args):
-    argdict = self.toArgDict(args)
-    t = argdict.get('t')
-    dr = argdict.get('dr')
+    t = args.get('t')
+    dr = args.get('dr')
     if t == 'ACCOUNT':
-      pickeddeckid = argdict.get('pickedDeckId')
+      pickeddeckid = args.get('pickedDeckId')
       if pickeddeckid:
         self.currdeckid = int(pickeddeckid)
         # print('Set deckid: ', pickeddeckid)
       return
     elif t == 'DECK':
-      name = argdict.get('name')
-      did = argdict.get('id')
+      name = args.get('name')
+      did = args.get('id')
       if name is None or did is None:
         return
       deckid = int(did)
@@ -328,16 +1027,13 @@ class Tracker(object):
       if deck is None:
         raise ValueError('Tracker:clearroom: Attempt to rename unknown deckid {0} to {1}'.format(deckid, name))
       deck.name = name
+      deck.changed()
       return
-    dr = argdict.get('dr')
+    dr = args.get('dr')
 
 
   def handler_harvestfaeria(self, seqnum, cmd, args):
     gcid,posid,amount,pnum = args
-    gcid = int(gcid)
-    posid = int(posid)
-    amount = int(amount)
-    pnum = int(pnum)
     if not self.game:
       return
     player = self.game.players[pnum]
@@ -356,7 +1052,7 @@ class Tracker(object):
       opnum = 0
     else:
       raise ValueError('Tracker:iam: Unexpected player number {0}'.format(pnum))
-    game.players[pnum] = Player(pnum, self.name, copy.deepcopy(game.inideck))
+    game.players[pnum] = Player(pnum, self.name, GameDeck(game.inideck))
     if game.opprank == '0' and game.oppgrank == '0':
       otype = 'CPU'
     elif game.oppgrank != '0':
@@ -367,6 +1063,8 @@ class Tracker(object):
       otype = '?'
     oname = '{0}({1})'.format(self.game.oppname, otype)
     game.players[opnum] = Player(opnum, oname, Deck(0, 'Opponent'))
+    if self.deckindex is not None:
+      game.prediction = ftpredict.Prediction(self.deckindex)
     if pnum == 0:
       game.currpnum = 0
     else:
@@ -376,8 +1074,6 @@ class Tracker(object):
 
   def handler_comeintoplay(self, seqnum, cmd, args):
     wut,gcid,pnum = args
-    gcid = int(gcid)
-    pnum = int(pnum)
     if not self.game:
       return
     gcards = self.game.gamecards
@@ -392,8 +1088,6 @@ class Tracker(object):
 
   def handler_payfaeria(self, seqnum, cmd, args):
     wut,pnum,amount = args
-    pnum = int(pnum)
-    amount = int(amount)
     if amount == 0:
       return
     if not self.game:
@@ -407,8 +1101,6 @@ class Tracker(object):
 
   def handler_faeriagain(self, seqnum, cmd, args):
     wut,pnum,amount = args
-    pnum = int(pnum)
-    amount = int(amount)
     if amount == 0:
       return
     if not self.game:
@@ -421,13 +1113,13 @@ class Tracker(object):
 
   def handler_newturn(self, seqnum, cmd, args):
     pnum,tnum = args
-    pnum = int(pnum)
-    tnum = int(tnum)
     if not self.game:
       return
     self.game.turn = tnum
     self.game.currpnum = pnum
     self.dirty = True
+    if self.checkpointfn is not None:
+      self.saveCheckpoint()
 
 
   def handler_zonemove(self, seqnum, cmd, args):
@@ -436,9 +1128,6 @@ class Tracker(object):
     game = self.game
     gcards = game.gamecards
     wut1,gcid,fromn,fromp,ton,top = args
-    fromp = int(fromp)
-    top = int(top)
-    gcid = int(gcid)
     gc = gcards.get(gcid)
     if not gc:
       return
@@ -483,6 +1172,8 @@ class Tracker(object):
         dc = fplayer.deck.cards.get(gcc.cardid)
         if not dc:
           fplayer.deck.cards[gcc.cardid] = DeckCard(gcc, 1)
+          if game.prediction is not None:
+            game.prediction.reveal(gcc.cardid)
         else:
           dc.quantity += 1
     self.dirty = True
@@ -504,26 +1195,29 @@ class Tracker(object):
 
 
   def handler_startgame(self, seqnum, cmd, args):
-    print('StartGame')
+    self.say('StartGame')
 
 
   def handler_stopgame(self, seqnum, cmd, args):
     self.game = None
-    print('StopGame')
+    self.resumed = False
+    self.say('StopGame')
+    if self.checkpointfn is not None:
+      self.saveCheckpoint()
 
 
   def handler_setquantity(self, seqnum, cmd, args):
-    argdict = self.toArgDict(args)
-    dr = argdict.get('dr')
+    dr = args.get('dr')
     if not dr:
       return
-    if dr[:4] != 'deck' or argdict.get('t') not in('CARD', 'GOLD_CARD'):
+    if dr[:4] != 'deck' or args.get('t') not in('CARD', 'GOLD_CARD'):
       return
     deckid = int(dr[4:])
     deck = self.decks.get(deckid)
     if not deck:
       raise ValueError('Tracker:setquantity: Attempt to set cards for unknown deckid {0}'.format(deckid))
     dcards = deck.cards
+    deck.changed()
     for cdef in args[2:]:
       cardid,quantity = cdef.split(':')
       cardid = int(cardid)
@@ -542,27 +1236,30 @@ class Tracker(object):
 
 
   def handler_sset(self, seqnum, cmd, args):
-    argdict = self.toArgDict(args)
-    dr = argdict.get('dr')
+    dr = args.get('dr')
     if not dr:
       return
     if dr == 'you':
-      deckid = argdict.get('pickedDeckId')
+      deckid = args.get('pickedDeckId')
       if deckid:
         #print('sset: deckid: ', deckid)
         self.currdeckid = int(deckid)
-      name = argdict.get('userName')
+      name = args.get('userName')
       if name:
         self.name = name
-    elif dr == 'decks' and argdict.get('t') == 'DECK':
-      dname = argdict.get('name')
-      did = argdict.get('id')
+    elif dr == 'decks' and args.get('t') == 'DECK':
+      dname = args.get('name')
+      did = args.get('id')
       if not dname or not did:
         raise ValueError('Tracker:sset: Expected name and id')
       did = int(did)
       deck = Deck(did, dname)
       self.decks[did] = deck
     elif dr == 'gameMembers':
+      if self.game and self.resumed:
+        # The game we resumed ended while the tracker was down.
+        self.game = None
+        self.resumed = False
       if self.game:
         raise ValueError('Tracker:startgame: Got new game while game already in progress!')
       if not self.currdeckid:
@@ -572,29 +1269,31 @@ class Tracker(object):
         raise ValueError('Tracker:startgame: Got new game but could not find currdeckid {0} in our decks!'.format(self.currdeckid))
       self.game = Game(gamedeck)
       game = self.game
-      game.opprank = argdict.get('constructedRank') or '?'
-      game.oppgrank = argdict.get('constructedGodRank') or '?'
-      game.oppname = argdict.get('userName') or '*Opponent'
-    #print('SSET: ', self.game, argdict)
+      game.opprank = args.get('constructedRank') or '?'
+      game.oppgrank = args.get('constructedGodRank') or '?'
+      game.oppname = args.get('userName') or '*Opponent'
+      if self.onevent is not None:
+        self.onevent('start', { 'opponent': game.oppname })
+    #print('SSET: ', self.game, args)
 
 
   def handler_welcome(self, seqnum, cmd, args):
-    argdict = self.toArgDict(args)
-    source = argdict.get('source')
+    source = args.get('source')
     if source is None:
       return
     if source == 'WorldServer':
-      print('* Reset!')
+      self.say('* Reset!')
       self.reset()
+      if self.onevent is not None:
+        self.onevent('session', {})
 
 
   def handler_setrankedmode(self, seqnum, cmd, args):
-    argdict = self.toArgDict(args)
     if self.game is None:
       raise ValueError('setrankedmode: Game not set.')
     game = self.game
-    game.oppmode = argdict.get('him')
-    game.selfmode = argdict.get('me')
+    game.oppmode = args.get('him')
+    game.selfmode = args.get('me')
 
 
   def handler_victory(self, seqnum, cmd, args):
@@ -602,15 +1301,17 @@ class Tracker(object):
       raise ValueError('victory: Game not set.')
     game = self.game
     wnum,reason = args
-    winrar = int(wnum) == (game.mypnum + 1)
-    print('Game outcome vs {2}: {0} - Reason: {1}'.format('Won' if winrar else 'Loss', reason, game.oppname))
+    winrar = wnum == (game.mypnum + 1)
+    self.say('Game outcome vs {2}: {0} - Reason: {1}'.format('Won' if winrar else 'Loss', reason, game.oppname))
     onum = 1 if game.mypnum == 0 else 0
     opp = game.players[onum]
     ocards = list((c.quantity, c.card.cardid, c.card.name) for c in opp.deck.cards.values() if not c.generated)
     me = game.players[game.mypnum]
     mcards = list((c.quantity, c.card.cardid, c.card.name) for c in me.deck.cards.values() if not c.generated)
+    if self.deckindex is not None:
+      self.deckindex.add(ocards)
     outcome = {
-      'stamp': time.strftime('%Y%m%dT%H%M%S'),
+      'stamp': time.strftime('%Y%m%dT%H%M%S', time.localtime(self.now)),
       'first': game.mypnum == 0,
       'victory': winrar,
       'endreason': reason,
@@ -635,16 +1336,22 @@ class Tracker(object):
         'deckcards': me.deckcards,
         'faeria': me.faeria,
         'eco': me.harvested,
+        'name': self.name,
         'deckname': me.deck.name,
         'deck': mcards,
         'lands': me.lands.todict()
         },
       }
-    j = json.dumps(outcome)
     logfp = self.logfp
-    logfp.write(j)
-    logfp.write('\n')
-    logfp.flush()
+    if logfp is not None:
+      j = json.dumps(outcome)
+      logfp.write(j)
+      logfp.write('\n')
+      logfp.flush()
+    if self.gamedb is not None:
+      self.gamedb.add(outcome)
+    if self.onevent is not None:
+      self.onevent('end', { 'stamp': outcome['stamp'], 'opponent': game.oppname, 'victory': winrar, 'deck': me.deck.name })
 
 
   def handler_createtokenland(self, seqnum, cmd, args):
@@ -655,6 +1362,17 @@ class Tracker(object):
     currval = getattr(lands, ltype)
     setattr(lands, ltype, currval + 1)
 
+  # Commands with a fixed number of args get them converted up front.
+  argtypes['~playerState'] = (int, int, int, int, int, str)
+  argtypes['#HarvestFaeria'] = (int, int, int, int)
+  argtypes['#ComeIntoPlay'] = (str, int, int)
+  argtypes['#PayFaeria'] = (str, int, int)
+  argtypes['#FaeriaGain'] = (str, int, int)
+  argtypes['~newTurn'] = (int, int)
+  argtypes['#ZoneMove'] = (str, int, str, int, str, int)
+  argtypes['$victory'] = (int, str)
+  argtypes['#CreateTokenLand'] = (str, str, str, str)
+
   handlers['$sset'] = handler_sset
   handlers['$setQuantity'] = handler_setquantity
   handlers['$startGame'] = handler_startgame
@@ -679,7 +1397,7 @@ class Tracker(object):
 
 
 
-def loadCards(fn):
+def parseCards(fn):
   result = {}
   with open(fn, 'r') as fp:
     for line in fp:
@@ -696,89 +1414,1347 @@ def loadCards(fn):
       elif deftype == 'text':
         card.text = val
       else:
-        raise ValueError('Unknown card def type: {1}'.format(deftype))
+        raise ValueError('Unknown card def type: {0}'.format(deftype))
   return result
 
 
+class LazyCard(Card):
+  '''Card from a CardTable, the text is only decoded when something asks for it.'''
+  __slots__ = ('table', 'textref')
+  def __init__(self, table, cardid, name, textref):
+    self.table = table
+    self.cardid = cardid
+    self.name = name
+    self.textref = textref
+
+  @property
+  def text(self):
+    textref = self.textref
+    if isinstance(textref, tuple):
+      textref = self.table.string(*textref)
+      self.textref = textref
+    return textref
+
+  @text.setter
+  def text(self, value):
+    self.textref = value
+
+
+# cards.csv.idx layout (little endian):
+#   header: magic, csv mtime_ns, csv size, csv sha1, table size (max card id + 1)
+#   table: per card id, name offset/length and text offset/length into the string area (length -1 = absent)
+#   strings: UTF-8 names and texts
+cardidx_magic = b'FTCARDS1'
+cardidx_header = struct.Struct('<8sqq20sI')
+cardidx_entry = struct.Struct('<IiIi')
+# Ids above this are not worth a dense table, fall back to parsing.
+cardidx_maxid = 1 << 20
+
+
+class CardTable(collections.abc.Mapping):
+  '''Read only card dict backed by an mmapped cards.csv.idx. Lookups index a dense table by
+     card id, Card objects are built on first use.'''
+  def __init__(self, csvfn, idxfn):
+    self.csvfn = csvfn
+    with open(idxfn, 'rb') as fp:
+      self.mm = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+    magic,mtime,size,digest,tsize = cardidx_header.unpack_from(self.mm, 0)
+    if magic != cardidx_magic:
+      raise ValueError('CardTable: {0} is not a card index'.format(idxfn))
+    self.mtime = mtime
+    self.size = size
+    self.digest = digest
+    self.tablepos = cardidx_header.size
+    self.strpos = self.tablepos + tsize * cardidx_entry.size
+    self.cache = [None] * tsize
+    count = 0
+    for cardid in range(tsize):
+      if cardidx_entry.unpack_from(self.mm, self.tablepos + cardid * cardidx_entry.size)[1] >= 0:
+        count += 1
+    self.count = count
+
+  def string(self, offset, length):
+    pos = self.strpos + offset
+    return self.mm[pos:pos + length].decode('utf-8')
+
+  def get(self, cardid, default = None):
+    cache = self.cache
+    if cardid < 0 or cardid >= len(cache):
+      return default
+    card = cache[cardid]
+    if card is None:
+      noff,nlen,toff,tlen = cardidx_entry.unpack_from(self.mm, self.tablepos + cardid * cardidx_entry.size)
+      if nlen < 0:
+        return default
+      card = LazyCard(self, cardid, self.string(noff, nlen) if nlen > 0 else None, (toff, tlen) if tlen >= 0 else None)
+      cache[cardid] = card
+    return card
+
+  def __getitem__(self, cardid):
+    card = self.get(cardid)
+    if card is None:
+      raise KeyError(cardid)
+    return card
+
+  def __contains__(self, cardid):
+    return self.get(cardid) is not None
+
+  def __iter__(self):
+    for cardid in range(len(self.cache)):
+      if self.get(cardid) is not None:
+        yield cardid
+
+  def __len__(self):
+    return self.count
+
+  def __reduce__(self):
+    # Process pool workers reopen the index instead of pickling the cards.
+    return (loadCards, (self.csvfn,))
+
+
+def compileCards(fn, idxfn, cards, st, digest):
+  maxid = max(cards) if cards else -1
+  if maxid >= cardidx_maxid or (cards and min(cards) < 0):
+    return False
+  strings = bytearray()
+  table = bytearray(cardidx_entry.size * (maxid + 1))
+  for cardid in range(maxid + 1):
+    card = cards.get(cardid)
+    if card is None:
+      cardidx_entry.pack_into(table, cardid * cardidx_entry.size, 0, -1, 0, -1)
+      continue
+    name = (card.name or '').encode('utf-8')
+    noff = len(strings)
+    strings += name
+    if card.text is None:
+      toff,tlen = 0, -1
+    else:
+      text = card.text.encode('utf-8')
+      toff,tlen = len(strings), len(text)
+      strings += text
+    cardidx_entry.pack_into(table, cardid * cardidx_entry.size, noff, len(name), toff, tlen)
+  tmpfn = idxfn + '.tmp'
+  with open(tmpfn, 'wb') as fp:
+    fp.write(cardidx_header.pack(cardidx_magic, st.st_mtime_ns, st.st_size, digest, maxid + 1))
+    fp.write(table)
+    fp.write(strings)
+  os.replace(tmpfn, idxfn)
+  return True
+
+
+def loadCards(fn):
+  '''Loads cards.csv through its compiled index (fn + .idx), (re)building the index when the CSV
+     changed. The index is trusted if mtime and size match, otherwise the CSV hash decides.
+     Falls back to parsing the CSV if the index cannot be used or written.'''
+  idxfn = fn + '.idx'
+  st = os.stat(fn)
+  digest = None
+  try:
+    table = CardTable(fn, idxfn)
+    if table.mtime == st.st_mtime_ns and table.size == st.st_size:
+      return table
+    with open(fn, 'rb') as fp:
+      digest = hashlib.sha1(fp.read()).digest()
+    if table.digest == digest:
+      # Only touched, remember the new mtime so the next start skips the hash.
+      try:
+        with open(idxfn, 'r+b') as fp:
+          fp.write(cardidx_header.pack(cardidx_magic, st.st_mtime_ns, st.st_size, digest, len(table.cache)))
+      except OSError:
+        pass
+      return table
+  except (OSError, ValueError, struct.error):
+    pass
+  if digest is None:
+    with open(fn, 'rb') as fp:
+      digest = hashlib.sha1(fp.read()).digest()
+  cards = parseCards(fn)
+  try:
+    if compileCards(fn, idxfn, cards, st, digest):
+      return CardTable(fn, idxfn)
+  except OSError:
+    pass
+  return cards
+
+
 def dumpCards(cards):
   for cardid in cards:
     print(cards[cardid])
 
 
-re_tf_initial = re.compile(r'^(\d+)T(\d+\.\d+\.\d+\.\d+)\.(\d+)-(\d+\.\d+\.\d+\.\d+)\.(\d+):\s*$')
-re_tf_data = re.compile(r'^[0-9a-f]+: ((?:[0-9a-f]{2,4} )+).*$')
-def runTCPFlow(cards, fp):
-  glogfp = open(os.path.join('logs', 'faeriatrack_gamelog_{0}.log'.format(time.strftime('%Y%m%d'))), 'a')
-  logfp = open('faeriatrack_net.log', 'w')
-  clogfp = open('faeriatrack_commands.log', 'w')
-  tracker = Tracker(cards, glogfp)
-  delay = None if fp is sys.stdin else 0.3
-  dbuffer = { 'I': [], 'O': [] }
-  for line in fp:
-    logfp.write(line)
-    logfp.flush()
-    line = line.strip()
-    result = re_tf_initial.match(line)
-    if result is None:
-      raise ValueError('Fail: Could not parse initial part.')
-    stamp,srcip,srcport,dstip,dstport = result.groups()
-    direction = 'I' if srcport in ('02201','02202') else 'O'
-    if direction == 'I':
-      stype = 'W' if srcport == '02201' else 'G'
-    else:
-      stype = '?'
-    dline = None
-    data = dbuffer[direction]
+class LogWriter(object):
+  '''File-like wrapper that does the actual writes from a background thread.
+     Writes are grouped and flushed once flushsize bytes are pending or the oldest
+     pending write is flushinterval seconds old. write() only blocks if maxqueue
+     writes are already waiting on the disk. close() always flushes everything.
+     sync() flushes what was written before it and then calls fp.sync() if fp has one.'''
+  SYNC = object()
+
+  def __init__(self, fp, maxqueue = 65536, flushsize = 65536, flushinterval = 0.5):
+    self.fp = fp
+    self.queue = queue.Queue(maxqueue)
+    self.flushsize = flushsize
+    self.flushinterval = flushinterval
+    self.error = None
+    self.thread = threading.Thread(target = self.run, name = 'LogWriter({0})'.format(getattr(fp, 'name', '?')))
+    self.thread.daemon = True
+    self.thread.start()
+
+  def write(self, s):
+    if self.error is not None:
+      raise self.error
+    self.queue.put(s)
+
+  def flush(self):
+    pass
+
+  def sync(self):
+    if self.error is not None:
+      raise self.error
+    self.queue.put(self.SYNC)
+
+  def close(self):
+    if self.thread is None:
+      return
+    self.queue.put(None)
+    self.thread.join()
+    self.thread = None
+    self.fp.close()
+    if self.error is not None:
+      raise self.error
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def run(self):
+    fp = self.fp
+    q = self.queue
+    pending = []
+    size = 0
+    deadline = None
+    done = False
+    sync = False
+    while not done:
+      try:
+        if deadline is None:
+          item = q.get()
+        else:
+          item = q.get(timeout = max(0, deadline - time.monotonic()))
+      except queue.Empty:
+        item = ''
+      # Grab whatever else is already queued while we are awake.
+      while item is not None:
+        if item is self.SYNC:
+          sync = True
+          break
+        if item:
+          if deadline is None:
+            deadline = time.monotonic() + self.flushinterval
+          pending.append(item)
+          size += len(item)
+          if size >= self.flushsize:
+            break
+        try:
+          item = q.get_nowait()
+        except queue.Empty:
+          break
+      if item is None:
+        done = True
+      if pending and (done or sync or size >= self.flushsize or time.monotonic() >= deadline):
+        try:
+          fp.write(''.join(pending))
+          fp.flush()
+        except Exception as e:
+          # Keep draining so writers never hang, write() reports the error.
+          self.error = e
+        pending = []
+        size = 0
+        deadline = None
+      if sync:
+        sync = False
+        if hasattr(fp, 'sync'):
+          try:
+            fp.sync()
+          except Exception as e:
+            self.error = e
+
+
+class CheckpointWriter(object):
+  '''Replaces fn atomically with the text given to save(), from a background thread. Saves coming in
+     faster than the disk takes them are coalesced, only the newest gets written. close() writes
+     whatever is still pending.'''
+  def __init__(self, fn):
+    self.fn = fn
+    self.pending = None
+    self.closing = False
+    self.error = None
+    self.cond = threading.Condition()
+    self.thread = threading.Thread(target = self.run, name = 'CheckpointWriter({0})'.format(fn))
+    self.thread.daemon = True
+    self.thread.start()
+
+  def save(self, data):
+    if self.error is not None:
+      raise self.error
+    with self.cond:
+      self.pending = data
+      self.cond.notify()
+
+  def close(self):
+    if self.thread is None:
+      return
+    with self.cond:
+      self.closing = True
+      self.cond.notify()
+    self.thread.join()
+    self.thread = None
+    if self.error is not None:
+      raise self.error
+
+  def run(self):
+    fn = self.fn
+    tmpfn = fn + '.tmp'
     while True:
-      dline = fp.readline()
-      logfp.write(dline)
-      logfp.flush()
-      dline = dline.strip()
-      if dline is None or dline == '':
+      with self.cond:
+        while self.pending is None and not self.closing:
+          self.cond.wait()
+        data,self.pending = self.pending,None
+      if data is None:
+        return
+      try:
+        with open(tmpfn, 'w') as fp:
+          fp.write(data)
+        os.replace(tmpfn, fn)
+      except Exception as e:
+        # save() reports it.
+        self.error = e
+
+
+class PipeReader(object):
+  '''Reads fp (a pipe from tcpflow or tcpdump) from a background thread into a bounded
+     queue of chunks, so the capture tool can always write while we are busy tracking.
+     read() and readline()/iteration hand the data out in order, readline() decodes
+     with encoding if one is given.'''
+  def __init__(self, fp, encoding = None, chunksize = 65536, maxqueue = 4096):
+    self.fp = fp
+    self.encoding = encoding
+    self.chunksize = chunksize
+    self.queue = queue.Queue(maxqueue)
+    self.buf = b''
+    self.pos = 0
+    self.eof = False
+    self.thread = threading.Thread(target = self.run, name = 'PipeReader({0})'.format(getattr(fp, 'name', '?')))
+    self.thread.daemon = True
+    self.thread.start()
+
+  def run(self):
+    q = self.queue
+    # read1 returns whatever is there instead of waiting for a full chunk.
+    read = getattr(self.fp, 'read1', self.fp.read)
+    try:
+      while True:
+        chunk = read(self.chunksize)
+        if not chunk:
+          break
+        q.put(chunk)
+      q.put(None)
+    except Exception as e:
+      q.put(e)
+
+  def fill(self):
+    '''Appends the next chunk to the buffer. Returns False at the end of the input.'''
+    if self.eof:
+      return False
+    item = self.queue.get()
+    if item is None or isinstance(item, Exception):
+      self.eof = True
+      if item is not None:
+        raise item
+      return False
+    self.buf = self.buf[self.pos:] + item
+    self.pos = 0
+    return True
+
+  def read(self, size):
+    while len(self.buf) - self.pos < size and self.fill():
+      pass
+    result = self.buf[self.pos:self.pos + size]
+    self.pos += len(result)
+    return result
+
+  def readline(self):
+    while True:
+      end = self.buf.find(b'\n', self.pos)
+      if end >= 0:
         break
-      result = re_tf_data.match(dline)
-      if result is None:
-        raise ValueError('Fail: Could not parse data part.')
-      hexd = ''.join(c for c in result.groups()[0] if c != ' ')
-      data.append(binascii.unhexlify(hexd).decode('ascii'))
-    if data[-1][-1] != '\n':
-      continue
-    dbuffer[direction] = []
-    if direction != 'I':
+      if not self.fill():
+        end = len(self.buf) - 1
+        break
+    line = self.buf[self.pos:end + 1]
+    self.pos = end + 1
+    if self.encoding is not None:
+      return line.decode(self.encoding, 'replace')
+    return line
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    line = self.readline()
+    if not line:
+      raise StopIteration
+    return line
+
+
+def feedCommands(tracker, clogfp, stype, commands):
+  for command in commands:
+    if command == '':
       continue
-    data = ''.join(data)
-    commands = data.split('\n')
-    for command in commands:
-      if command == '':
-        continue
-      clogfp.write(stype + ': ')
-      clogfp.write(command)
-      clogfp.write('\n')
-      clogfp.flush()
-      tracker.feed(command)
+    clogfp.write(stype + ': ' + command + '\n')
+    tracker.feed(command)
+
+
+class CommandFramer(object):
+  '''Splits a byte stream into complete newline terminated commands, carrying partial ones over.
+     A partial command longer than maxbuffer bytes is dropped rather than held forever.'''
+  def __init__(self, maxbuffer = 1 << 20):
+    self.buf = bytearray()
+    self.resyncing = False
+    self.maxbuffer = maxbuffer
+
+  def feed(self, data):
+    buf = self.buf
+    start = len(buf)
+    buf += data
+    end = buf.rfind(b'\n', start)
+    if end < 0:
+      if len(buf) > self.maxbuffer:
+        self.resync()
+      return ()
+    begin = 0
+    if self.resyncing:
+      # Throw away the tail of whatever command we lost the start of.
+      begin = buf.find(b'\n') + 1
+      self.resyncing = False
+    commands = buf[begin:end].decode('ascii').split('\n')
+    del buf[:end + 1]
+    return commands
+
+  def resync(self):
+    self.buf = bytearray()
+    self.resyncing = True
+
+
+re_tf_initial = re.compile(r'^(\d+)T(\d+\.\d+\.\d+\.\d+)\.(\d+)-(\d+\.\d+\.\d+\.\d+)\.(\d+):\s*$')
+def tfHex(dline):
+  # 0000: 317c 2477 656c 636f  1|$welco
+  colon = dline.find(': ')
+  if colon < 0:
+    raise ValueError('Fail: Could not parse data part.')
+  colon += 2
+  end = dline.find('  ', colon)
+  return dline[colon:end] if end >= 0 else dline[colon:]
+
+
+class Client(object):
+  '''One game client seen on the wire: its Tracker and where its commands are logged.'''
+  def __init__(self, addr, tracker, clogfp, ownlog = False, server = None, archives = ()):
+    self.addr = addr
+    self.tracker = tracker
+    self.clogfp = clogfp
+    self.ownlog = ownlog
+    # ftserve.StateServer the tracker's state is published to, if set.
+    self.server = server
+    # ftarchive.ArchiveWriters this client's sessions and games are marked in.
+    self.archives = archives
+    self.events = []
+    # Where the block being fed starts in each archive. The net log has the first block in it before
+    # the client exists, anything before it in the segment is as good a start.
+    self.blockpos = [0] * len(archives)
+    # Archives due for rotation while a command was split across blocks.
+    self.rotating = [False] * len(archives)
+    # stype -> whether that connection's framer holds the start of a command, set by FlowDemux.
+    self.partial = {}
+    if archives:
+      tracker.onevent = self.event
+    self.lastseen = None
+
+  def event(self, name, info):
+    self.events.append((name, info))
+
+  def feed(self, stype, commands):
+    tracker = self.tracker
+    with tracker.lock:
+      feedCommands(tracker, self.clogfp, stype, commands)
+    if self.archives:
+      self.archive()
     if tracker.dirty:
       tracker.showStatus()
-      if delay is not None:
-        time.sleep(delay)
+      if self.server is not None:
+        self.server.publish(tracker.view)
+    stats = ftstats.current
+    if stats is not None:
+      # Empty commands are not fed, so this is the sum of the per command counts.
+      stats.count('commands ' + stype, sum(1 for command in commands if command))
+
+  def archive(self):
+    '''Marks the events of the block just fed in the archives and rotates those that are due.
+       Sessions and games start where the block did and end where it did, the block is whole
+       in the archive by now.'''
+    events = self.events
+    state = None
+    # A segment starting with the rest of a split command could not be replayed from its checkpoint.
+    split = any(self.partial.values())
+    for n,archive in enumerate(self.archives):
+      blockpos = self.blockpos[n]
+      due = self.rotating[n] or archive.due()
+      for name,info in events:
+        archive.mark(name, archive.tell() if name == 'end' else blockpos, info)
+        due = due or archive.due(name)
+      self.rotating[n] = due and split
+      if due and not split:
+        if state is None:
+          state = self.tracker.checkpoint()
+        archive.rotate(state)
+      self.blockpos[n] = archive.tell()
+    del events[:]
+
+  def close(self):
+    if self.tracker.renderer is not None:
+      self.tracker.renderer.flush()
+    self.tracker.close()
+    if self.ownlog:
+      self.clogfp.close()
+
+
+def loadCheckpoint(fn, maxage = 2 * 3600):
+  '''Returns the state saved in fn, or None if there is none or it is older than maxage seconds.'''
+  try:
+    if time.time() - os.path.getmtime(fn) > maxage:
+      return None
+    with open(fn, 'r') as fp:
+      return json.load(fp)
+  except (OSError, ValueError):
+    return None
+
+
+def clientFactory(cards, glogfp, clogfp, focus = None, headless = False, gamedb = None, checkpointfn = None, server = None, archives = (),
+                  timelinefp = None, sink = print, logdir = ''):
+  '''Returns newclient(addr) for FlowDemux. The focused client (or the first one seen) gets
+     the board (unless headless), status messages and clogfp, others are tracked silently
+     with their own command log. With checkpointfn the focused client's state is checkpointed
+     there and resumed from it if recent. Opponent decks are predicted from the games in gamedb.
+     The focused client's state is published to server and its games are marked in archives.
+     With timelinefp every client records game timelines and writes them there. Status messages
+     go to sink, the other clients' command logs to logdir.'''
+  state = { 'focus': focus }
+  # Shared by all clients, every finished game adds to it.
+  deckindex = ftpredict.DeckIndex.loadGameDB(gamedb) if gamedb is not None else None
+  def newclient(addr):
+    if state['focus'] is None:
+      state['focus'] = addr
+    if addr == state['focus']:
+      tracker = Tracker(cards, glogfp, None if headless else Renderer(), sink, gamedb, checkpointfn, deckindex)
+      if timelinefp is not None:
+        tracker.recordTimelines(timelinefp)
+      if ftstats.current is not None:
+        tracker.instrument(ftstats.current)
+      saved = loadCheckpoint(checkpointfn) if checkpointfn is not None else None
+      if saved is not None:
+        started = time.time()
+        try:
+          tracker.restore(saved)
+        except (ValueError, LookupError, TypeError) as e:
+          # Another version's, or cards.csv changed since. Start over rather than die on it.
+          tracker.reset()
+          saved = None
+          tracker.say('! Ignoring {0}, could not resume from it: {1!r}'.format(checkpointfn, e))
+          try:
+            os.remove(checkpointfn)
+          except OSError:
+            pass
+      if saved is not None:
+        tracker.say('Resumed from {0} in {1:.1f}ms'.format(checkpointfn, (time.time() - started) * 1e3))
+        for archive in archives:
+          archive.setState(saved)
+      if server is not None:
+        server.publish(tracker.view)
+      return Client(addr, tracker, clogfp, server = server, archives = archives)
+    cfp = LogWriter(open(os.path.join(logdir, 'faeriatrack_commands_{0}.log'.format(addr.replace(':', '_'))), 'w'))
+    tracker = Tracker(cards, glogfp, gamedb = gamedb, deckindex = deckindex)
+    if timelinefp is not None:
+      tracker.recordTimelines(timelinefp)
+    if ftstats.current is not None:
+      tracker.instrument(ftstats.current)
+    return Client(addr, tracker, cfp, ownlog = True)
+  return newclient
+
+
+def headless(cardsname = 'cards.csv', logfp = None, sink = None):
+  '''Library entry point: a Tracker that never touches the terminal. Give it command lines
+     ('seqnum|cmd|args') with feed() and read its state from .decks/.game.'''
+  return Tracker(loadCards(cardsname), logfp, sink = sink)
+
+
+class FlowDemux(object):
+  '''Routes incoming data to a CommandFramer per TCP connection and a Client (Tracker) per
+     client address, so one capture can follow several players at once. A client's world
+     (2201) and game (2202) connections share its Tracker.
+     Times are capture timestamps in seconds. Connections idle for flowidle and clients idle
+     for clientidle are dropped; onexpire(key) is called for each dropped connection.'''
+  def __init__(self, newclient, flowidle = 600, clientidle = 4 * 3600, maxbuffer = 1 << 20, onexpire = None):
+    self.newclient = newclient
+    self.flowidle = flowidle
+    self.clientidle = clientidle
+    self.maxbuffer = maxbuffer
+    self.onexpire = onexpire
+    self.flows = {}
+    # Connections to resync as soon as they start, see resync(), and to start from a command's start, see carry().
+    self.lost = set()
+    self.carried = {}
+    self.clients = {}
+    self.nextexpire = None
+
+  def feed(self, stamp, key, stype, data):
+    '''key is (srcip, srcport, dstip, dstport) of the incoming direction.'''
+    flow = self.flows.get(key)
+    if flow is None:
+      addr = key[2]
+      client = self.clients.get(addr)
+      if client is None:
+        client = self.newclient(addr)
+        self.clients[addr] = client
+      flow = [CommandFramer(self.maxbuffer), client, stamp]
+      self.flows[key] = flow
+      if key in self.lost:
+        self.lost.discard(key)
+        flow[0].resync()
+      elif key in self.carried:
+        flow[0].buf += self.carried.pop(key)
+    framer,client,lastseen = flow
+    flow[2] = client.lastseen = stamp
+    tracker = client.tracker
+    tracker.now = stamp
+    stats = ftstats.current
+    # Capture stamps only have whole seconds, lag is timed from here to the draw (Renderer.draw).
+    if stats is not None and tracker.received is None:
+      tracker.received = time.monotonic()
+    commands = framer.feed(data)
+    client.partial[stype] = len(framer.buf) > 0
+    client.feed(stype, commands)
+    if stats is not None:
+      stats.count('bytes ' + stype, len(data))
+      stats.tick()
+    if self.nextexpire is None:
+      self.nextexpire = stamp + 60
+    elif stamp >= self.nextexpire:
+      self.expire(stamp)
+      self.nextexpire = stamp + 60
+
+  def resync(self, key):
+    '''Data of connection key was lost, its next command may have lost its start. The connection
+       need not have started yet (captured mid stream).'''
+    flow = self.flows.get(key)
+    if flow is not None:
+      flow[0].resync()
+    else:
+      self.lost.add(key)
+
+  def partials(self):
+    '''Returns {key: the start of a command} for the connections partway through one.'''
+    return dict((key, bytes(flow[0].buf)) for key,flow in self.flows.items() if flow[0].buf)
+
+  def carry(self, partials):
+    '''Connections in partials (as partials() returned them when the capture was stopped) go on
+       from the start of a command given there when they start again.'''
+    self.carried.update(partials)
+
+  def closeFlow(self, key):
+    self.flows.pop(key, None)
+    self.lost.discard(key)
+    self.carried.pop(key, None)
+
+  def expire(self, now):
+    for key,flow in list(self.flows.items()):
+      if now - flow[2] > self.flowidle:
+        del self.flows[key]
+        if self.onexpire is not None:
+          self.onexpire(key)
+    inuse = set(flow[1].addr for flow in self.flows.values())
+    for addr,client in list(self.clients.items()):
+      if addr not in inuse and now - client.lastseen > self.clientidle:
+        del self.clients[addr]
+        client.close()
+
+  def close(self):
+    for client in self.clients.values():
+      client.close()
+    self.clients = {}
+    self.flows = {}
+
+
+def openTimelineLog(logdir = 'logs'):
+  return open(os.path.join(logdir, 'faeriatrack_timelines_{0}.log'.format(time.strftime('%Y%m%d'))), 'a')
+
+
+def runTCPFlow(cards, fp, focus = None, headless = False, server = None, timelines = False):
+  import ftarchive
+  import ftdb
+  glogfp = open(os.path.join('logs', 'faeriatrack_gamelog_{0}.log'.format(time.strftime('%Y%m%d'))), 'a')
+  timelinefp = openTimelineLog() if timelines else None
+  logfp = ftarchive.ArchiveWriter(archivedir, 'net', archivesegsize, archivemax, wrap = LogWriter)
+  clogfp = ftarchive.ArchiveWriter(archivedir, 'commands', archivesegsize, archivemax, wrap = LogWriter)
+  gamedb = ftdb.GameDB()
+  demux = FlowDemux(clientFactory(cards, glogfp, clogfp, focus, headless, gamedb, 'faeriatrack_state.json', server, (logfp, clogfp),
+                                  timelinefp))
+  if hasattr(fp, 'buffer'):
+    fp = PipeReader(fp.buffer, 'utf-8')
+  try:
+    for stamp,stype,key,data in readTCPFlow(fp, logfp):
+      demux.feed(stamp, key, stype, data)
+  finally:
+    demux.close()
+    clogfp.close()
+    logfp.close()
+    gamedb.close()
+
+
+class Source(object):
+  '''One stream of multi mode: tcpflow output arriving in chunks of bytes, tracked like tcpflow mode
+     headless. Archives go to archivedir/LABEL/, the gamelog, checkpoint and timelines to logs/LABEL/
+     and status messages are prefixed with the label. A block that does not parse or a command the
+     tracker fails on is reported and skipped.'''
+  def __init__(self, cards, label, gamedb = None, timelines = False):
+    import ftarchive
+    self.label = label
+    self.logdir = os.path.join('logs', label)
+    os.makedirs(self.logdir, exist_ok = True)
+    self.glogfp = open(os.path.join(self.logdir, 'faeriatrack_gamelog_{0}.log'.format(time.strftime('%Y%m%d'))), 'a')
+    self.timelinefp = openTimelineLog(self.logdir) if timelines else None
+    adir = os.path.join(archivedir, label)
+    self.logfp = ftarchive.ArchiveWriter(adir, 'net', archivesegsize, archivemax, wrap = LogWriter)
+    self.clogfp = ftarchive.ArchiveWriter(adir, 'commands', archivesegsize, archivemax, wrap = LogWriter)
+    self.demux = FlowDemux(clientFactory(cards, self.glogfp, self.clogfp, None, True, gamedb,
+                                         os.path.join(self.logdir, 'faeriatrack_state.json'), None, (self.logfp, self.clogfp),
+                                         self.timelinefp, self.say, self.logdir))
+    self.parser = TCPFlowParser()
+    self.partial = b''
+    # Characters of the block in progress, tcpflow output being ASCII that is its size in bytes.
+    self.held = 0
+    self.say('Reading')
+
+  def say(self, msg):
+    print('[{0}] {1}'.format(self.label, msg))
+
+  def feed(self, data):
+    end = data.rfind(b'\n')
+    if end < 0:
+      self.partial += data
+      return
+    lines = (self.partial + data[:end]).decode('utf-8', 'replace').split('\n')
+    self.partial = data[end + 1:]
+    for line in lines:
+      self.line(line + '\n')
+
+  def unread(self):
+    '''Bytes fed that have not been tracked yet: the partial line and the block it belongs to.'''
+    return len(self.partial) + self.held
+
+  def line(self, line):
+    self.logfp.write(line)
+    try:
+      block = self.parser.feed(line)
+    except ValueError as e:
+      self.say('Skipping to the next block: {0}'.format(e))
+      key = self.parser.resync()
+      if key is not None:
+        self.demux.resync(key)
+      # It may be the next block's first line.
+      block = self.parser.feed(line)
+    if block is not None:
+      self.block(block)
+    self.held = 0 if self.parser.header is None else self.held + len(line)
+
+  def block(self, block):
+    stamp,stype,key,data = block
+    try:
+      self.demux.feed(stamp, key, stype, data)
+    except Exception as e:
+      self.say('Error tracking {0}, skipping the rest of the block: {1!r}'.format(key[2], e))
+      self.demux.resync(key)
+
+  def resume(self, partials):
+    '''Carries on from where close(False) stopped, see ftingest.py.'''
+    self.demux.carry(dict((tuple(key), bytes.fromhex(data)) for key,data in partials))
+
+  def close(self, complete = True):
+    '''complete False drops the unfinished block instead of tracking it and returns what resume()
+       needs to carry on from there, see ftingest.py.'''
+    partials = None
+    if complete:
+      if self.partial:
+        self.line(self.partial.decode('utf-8', 'replace'))
+        self.partial = b''
+      block = self.parser.end()
+      if block is not None:
+        self.block(block)
+    else:
+      # It carries on from here next time, so the checkpoint has to be of here too.
+      for client in self.demux.clients.values():
+        if client.tracker.checkpointfn is not None:
+          client.tracker.saveCheckpoint()
+      partials = [[list(key), data.hex()] for key,data in self.demux.partials().items()]
+    self.demux.close()
+    self.clogfp.close()
+    self.logfp.close()
+    self.glogfp.close()
+    if self.timelinefp is not None:
+      self.timelinefp.close()
+    self.say('Closed')
+    return partials
+
+
+def runMulti(cards, args):
+  '''Tracks every source in args at once, each with its own Source. See ftingest.py for what a source can be.'''
+  # Only loaded when asked for, asyncio is slow to import.
+  import ftingest
+  import ftdb
+  timelines = False
+  fromstart = False
+  specs = []
+  for arg in args:
+    if arg == '--stats':
+      ftstats.enable()
+    elif arg == '--timelines':
+      timelines = True
+    elif arg == '--from-start':
+      fromstart = True
+    else:
+      specs.append(arg)
+  if not specs:
+    print('Example: {0}'.format(examplemulti))
+    return
+  ftstats.installSignal()
+  exitOnSignals()
+  gamedb = ftdb.GameDB()
+  try:
+    ftingest.Ingest(specs, lambda label: Source(cards, label, gamedb, timelines),
+                    offsetsfn = os.path.join('logs', 'faeriatrack_offsets.json'), fromstart = fromstart).run()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    gamedb.close()
+
+
+def tfAddr(ip):
+  # tcpflow zero pads: 010.000.000.001
+  return '.'.join(str(int(o)) for o in ip.split('.'))
+
+
+class TCPFlowParser(object):
+  '''readTCPFlow for data that arrives in pieces: feed() it one line at a time and it returns
+     (stamp, stype, key, data) when that line completes an incoming block, else None.'''
+  __slots__ = ('header', 'stype', 'hexparts', 'resyncing')
+  def __init__(self):
+    self.header = None
+    self.stype = None
+    self.hexparts = None
+    self.resyncing = False
 
+  def feed(self, line):
+    header = self.header
+    if header is None:
+      header = re_tf_initial.match(line)
+      if header is None:
+        if self.resyncing:
+          return None
+        raise ValueError('Fail: Could not parse initial part.')
+      self.resyncing = False
+      srcport = header.group(3)
+      if srcport == '02201':
+        self.stype = 'W'
+      elif srcport == '02202':
+        self.stype = 'G'
+      else:
+        # Outgoing, just log it.
+        self.stype = None
+      self.header = header
+      self.hexparts = []
+      return None
+    if line == '' or line.isspace():
+      return self.end()
+    if self.stype is not None:
+      self.hexparts.append(tfHex(line))
+    return None
+
+  def end(self):
+    '''Ends the block in progress (the input ended), returning it if there is one.'''
+    header,hexparts = self.header,self.hexparts
+    self.header = self.hexparts = None
+    if self.stype is None or not hexparts:
+      return None
+    key = (tfAddr(header.group(2)), int(header.group(3)), tfAddr(header.group(4)), int(header.group(5)))
+    return (int(header.group(1)), self.stype, key, bytes.fromhex(' '.join(hexparts)))
+
+  def resync(self):
+    '''Drops the block in progress and skips lines up to the next block. Returns the key of the
+       dropped block if it was incoming.'''
+    header = self.header
+    self.header = self.hexparts = None
+    self.resyncing = True
+    if header is None or self.stype is None:
+      return None
+    return (tfAddr(header.group(2)), int(header.group(3)), tfAddr(header.group(4)), int(header.group(5)))
+
+
+def readTCPFlow(fp, logfp = None):
+  '''Yields (stamp, stype, key, data) for each incoming tcpflow block, copying every line read to logfp.
+     key is (srcip, srcport, dstip, dstport).'''
+  parser = TCPFlowParser()
+  feed = parser.feed
+  for line in fp:
+    if logfp is not None:
+      logfp.write(line)
+    block = feed(line)
+    if block is not None:
+      yield block
+  block = parser.end()
+  if block is not None:
+    yield block
+
+
+def replay(tracker, fp, speed = 0.0):
+  '''Feeds a saved faeriatrack_net.log or faeriatrack_commands.log through tracker.
+     With a net log and speed > 0 the tcpflow timestamps are followed, scaled by speed.
+     Returns the number of commands fed.'''
+  first = fp.readline()
+  if first == '':
+    return 0
+  if re_tf_initial.match(first) is None:
+    return replayCommands(tracker, itertools.chain((first,), fp))
+  framers = { 'W': CommandFramer(), 'G': CommandFramer() }
+  feed = tracker.feed
+  count = 0
+  started = None
+  for stamp,stype,key,data in readTCPFlow(PushbackReader(first, fp)):
+    tracker.now = stamp
+    if speed > 0:
+      if started is None:
+        started = (stamp, time.monotonic())
+      wait = started[1] + (stamp - started[0]) / speed - time.monotonic()
+      if wait > 0:
+        time.sleep(wait)
+    for command in framers[stype].feed(data):
+      if command:
+        feed(command)
+        count += 1
+  return count
+
+
+def replayArchive(tracker, idxfn, game = None, speed = 0.0):
+  '''Replays every segment of the archive with index idxfn, or only what game n needs: its segment
+     up to the end of the game, starting from the checkpoint stored with the segment.'''
+  import ftarchive
+  archive = ftarchive.Archive(idxfn)
+  if game is None:
+    if not archive.segments:
+      return 0
+    seg = next(iter(archive.segments))
+    lines = archive.read()
+  else:
+    seg = archive.games[game]['seg']
+    lines = archive.readGame(game, whole = True)
+    # What comes before it in the segment only gets the tracker to its start, no game there is logged again.
+    muteGames(tracker, archive.earlier(game))
+  state = archive.state(seg)
+  if state is not None:
+    tracker.restore(state)
+  return replay(tracker, lines, speed)
+
+
+def muteGames(tracker, count):
+  '''Keeps tracker from writing games to its gamelog, game db and timelines until count games
+     have started and the next one does.'''
+  saved = (tracker.logfp, tracker.gamedb, tracker.timelinefp, tracker.onevent)
+  tracker.logfp = tracker.gamedb = tracker.timelinefp = None
+  started = [0]
+  def onevent(name, info):
+    if name == 'start':
+      started[0] += 1
+      if started[0] > count:
+        tracker.logfp,tracker.gamedb,tracker.timelinefp,tracker.onevent = saved
+    if saved[3] is not None:
+      saved[3](name, info)
+  tracker.onevent = onevent
+
+
+def replayCommands(tracker, lines):
+  feed = tracker.feed
+  count = 0
+  for line in lines:
+    # 'W: 12|$sset|...' as written by feedCommands.
+    command = line[3:].rstrip('\n')
+    if command:
+      feed(command)
+      count += 1
+  return count
+
+
+class PushbackReader(object):
+  '''Line reader that hands back an already consumed first line before the rest of fp.'''
+  def __init__(self, first, fp):
+    self.first = first
+    self.fp = fp
+
+  def readline(self):
+    first = self.first
+    if first is not None:
+      self.first = None
+      return first
+    return self.fp.readline()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    line = self.readline()
+    if line == '':
+      raise StopIteration
+    return line
+
+
+def runPcap(cards, fps, focus = None, headless = False, checkpointfn = None, server = None, timelines = False):
+  import ftarchive
+  import ftdb
+  import ftpcap
+  glogfp = open(os.path.join('logs', 'faeriatrack_gamelog_{0}.log'.format(time.strftime('%Y%m%d'))), 'a')
+  timelinefp = openTimelineLog() if timelines else None
+  gamedb = ftdb.GameDB()
+  with ftarchive.ArchiveWriter(archivedir, 'commands', archivesegsize, archivemax, wrap = LogWriter) as clogfp:
+    reassembler = ftpcap.TCPReassembler()
+    demux = FlowDemux(clientFactory(cards, glogfp, clogfp, focus, headless, gamedb, checkpointfn, server, (clogfp,), timelinefp),
+                      onexpire = reassembler.forget)
+    reassembler.ongap = demux.resync
+    try:
+      for fp in fps:
+        for stamp,srcip,srcport,dstip,dstport,seq,flags,payload in ftpcap.readSegments(fp):
+          if srcport not in (2201, 2202):
+            continue
+          key = (srcip, srcport, dstip, dstport)
+          data = reassembler.feed(key, seq, flags, payload)
+          if data:
+            demux.feed(stamp, key, 'W' if srcport == 2201 else 'G', data)
+          if flags & (ftpcap.TCP_FIN | ftpcap.TCP_RST):
+            demux.closeFlow(key)
+    finally:
+      demux.close()
+      gamedb.close()
+
+
+def runReplay(cards, args):
+  speed = 0.0
+  glogname = os.devnull
+  game = None
+  timelinefp = None
+  fns = []
+  args = list(args)
+  while args:
+    arg = args.pop(0)
+    if arg == '--speed':
+      speed = float(args.pop(0))
+    elif arg == '--gamelog':
+      glogname = args.pop(0)
+    elif arg == '--game':
+      game = int(args.pop(0))
+    elif arg == '--timelines':
+      timelinefp = open(args.pop(0), 'a')
+    elif arg == '--stats':
+      ftstats.enable(interval = None)
+    else:
+      fns.append(arg)
+  with open(glogname, 'a') as glogfp:
+    for fn in fns or ['-']:
+      tracker = Tracker(cards, glogfp)
+      if timelinefp is not None:
+        tracker.recordTimelines(timelinefp)
+      if ftstats.current is not None:
+        tracker.instrument(ftstats.current)
+      started = time.time()
+      if fn == '-':
+        count = replay(tracker, sys.stdin, speed)
+      elif fn.endswith('.idx'):
+        count = replayArchive(tracker, fn, game, speed)
+      else:
+        with open(fn, 'r') as fp:
+          count = replay(tracker, fp, speed)
+      elapsed = time.time() - started
+      print('- Replayed {0}: {1} commands in {2:.2f}s'.format(fn, count, elapsed))
+
+
+def indexSessions(fn):
+  '''Splits a saved net or commands log into WorldServer sessions (at each $welcome|source:WorldServer).
+     Returns a list of (fn, None, start, end) byte ranges. Archives (their .idx) are split at the
+     session marks in each segment instead, (idxfn, seg, start, end) with end None for the rest.'''
+  if fn.endswith('.idx'):
+    import ftarchive
+    archive = ftarchive.Archive(fn)
+    sessions = []
+    for seg in archive.segments:
+      starts = sorted(set([0] + archive.sessions.get(seg, [])))
+      sessions.extend((fn, seg, start, end) for start,end in zip(starts, starts[1:] + [None]))
+    return sessions
+  starts = [0]
+  with open(fn, 'rb') as fp:
+    isnet = re_tf_initial.match(fp.readline().decode('ascii', 'replace')) is not None
+    fp.seek(0)
+    offset = 0
+    if isnet:
+      header = None
+      world = False
+      hexparts = []
+      for line in fp:
+        if header is None:
+          header = offset
+          world = b'.02201-' in line
+          hexparts = []
+        elif line.isspace():
+          if world and hexparts:
+            data = bytes.fromhex(' '.join(hexparts))
+            if b'|$welcome|' in data and b'source:WorldServer' in data:
+              starts.append(header)
+          header = None
+        elif world:
+          hexparts.append(tfHex(line.decode('ascii')))
+        offset += len(line)
+    else:
+      for line in fp:
+        if b'|$welcome|' in line and b'source:WorldServer' in line:
+          starts.append(offset)
+        offset += len(line)
+  starts = sorted(set(starts))
+  ends = starts[1:] + [offset]
+  return [(fn, None, start, end) for start,end in zip(starts, ends) if end > start]
+
+
+rebuildcards = None
+def rebuildInit(cards):
+  global rebuildcards
+  rebuildcards = cards
+
+
+def rebuildSession(session):
+  '''Pool worker: runs one session through a fresh Tracker, returns (games, error, untimed). untimed
+     is set for a commands log, its games are stamped with the file time.'''
+  fn,seg,start,end = session
+  glogfp = io.StringIO()
+  tracker = Tracker(rebuildcards, glogfp)
+  error = None
+  untimed = False
+  try:
+    if seg is None:
+      with open(fn, 'rb') as fp:
+        fp.seek(start)
+        lines = io.StringIO(fp.read(end - start).decode('ascii', 'replace'))
+      # Command logs carry no timestamps, the file time is the best we have.
+      tracker.now = os.path.getmtime(fn)
+    else:
+      import ftarchive
+      archive = ftarchive.Archive(fn)
+      lines = archive.read(seg, start, seg, end)
+      tracker.now = os.path.getmtime(os.path.join(archive.dirname, archive.segments[seg]['file']))
+      state = archive.state(seg)
+      # A segment rotated mid session goes on from where the previous one left off.
+      if start == 0 and state is not None:
+        tracker.restore(state)
+    first = lines.readline()
+    untimed = re_tf_initial.match(first) is None
+    replay(tracker, PushbackReader(first, lines))
+  except ValueError as e:
+    error = '{0}@{1}: {2}'.format(fn, start, e)
+  return ([json.loads(l) for l in glogfp.getvalue().splitlines()], error, untimed)
+
+
+def spreadStamps(games):
+  '''Games re-derived from one commands log, in order, all have about the file time as their stamp.
+     Moves each one to at least a second before the next so they stay distinct games.'''
+  times = [time.mktime(time.strptime(game['stamp'], '%Y%m%dT%H%M%S')) for game in games]
+  for n in range(len(games) - 2, -1, -1):
+    if times[n] >= times[n + 1]:
+      times[n] = times[n + 1] - 1
+      games[n]['stamp'] = time.strftime('%Y%m%dT%H%M%S', time.localtime(times[n]))
+
+
+def gameKey(game):
+  return (game['stamp'], game['opponent']['name'], game['me']['deckname'])
+
+
+def mergeGamelogs(games, logdir):
+  '''Merges games into logdir/faeriatrack_gamelog_YYYYMMDD.log by stamp. A game with the same
+     stamp, opponent and deck as one already logged replaces it. Returns the files written.'''
+  bydate = {}
+  for game in games:
+    bydate.setdefault(game['stamp'][:8], []).append(game)
+  written = []
+  for date,new in sorted(bydate.items()):
+    fn = os.path.join(logdir, 'faeriatrack_gamelog_{0}.log'.format(date))
+    merged = collections.OrderedDict()
+    if os.path.exists(fn):
+      with open(fn, 'r') as fp:
+        for line in fp:
+          if line.strip():
+            game = json.loads(line)
+            merged[gameKey(game)] = game
+    for game in new:
+      merged[gameKey(game)] = game
+    tmpfn = fn + '.tmp'
+    with open(tmpfn, 'w') as fp:
+      for game in sorted(merged.values(), key = lambda g: g['stamp']):
+        fp.write(json.dumps(game))
+        fp.write('\n')
+    os.replace(tmpfn, fn)
+    written.append(fn)
+  return written
+
+
+def runRebuild(cards, args):
+  import concurrent.futures
+  import ftdb
+  jobs = os.cpu_count() or 1
+  logdir = 'logs'
+  paths = []
+  args = list(args)
+  while args:
+    arg = args.pop(0)
+    if arg == '--jobs':
+      jobs = int(args.pop(0))
+    elif arg == '--logs':
+      logdir = args.pop(0)
+    else:
+      paths.append(arg)
+  fns = []
+  for path in paths:
+    if os.path.isdir(path):
+      for dirpath,dirnames,filenames in os.walk(path):
+        # Archive segments are read through their index. Where there is a net archive or log the
+        # commands one next to it has the same games (stamped differently, so they would not merge).
+        names = set(filenames)
+        skip = set(fn for fn in filenames if 'commands' in fn and fn.replace('commands', 'net', 1) in names)
+        fns.extend(os.path.join(dirpath, fn) for fn in sorted(filenames)
+                   if (fn.endswith('.idx') or fn.endswith('.log')) and fn not in skip)
+    elif path.endswith('.idx') or path.endswith('.log'):
+      fns.append(path)
+    else:
+      print('! Skipping {0}: not a .log file or an archive .idx'.format(path))
+  started = time.time()
+  games = []
+  errors = []
+  with concurrent.futures.ProcessPoolExecutor(jobs, initializer = rebuildInit, initargs = (cards,)) as pool:
+    sessions = [s for ss in pool.map(indexSessions, fns) for s in ss]
+    print('- Rebuilding {0} session{1} from {2} file{3} with {4} worker{5}'.format(
+      len(sessions), 's' if len(sessions) != 1 else '', len(fns), 's' if len(fns) != 1 else '', jobs, 's' if jobs != 1 else ''))
+    # fn -> games from it without timestamps of their own.
+    untimedgames = collections.OrderedDict()
+    for session,(sgames,error,untimed) in zip(sessions, pool.map(rebuildSession, sessions, chunksize = 4)):
+      games.extend(sgames)
+      if untimed:
+        untimedgames.setdefault(session[0], []).extend(sgames)
+      if error is not None:
+        errors.append(error)
+  for fgames in untimedgames.values():
+    spreadStamps(fgames)
+  for error in errors:
+    print('! {0}'.format(error))
+  written = mergeGamelogs(games, logdir)
+  gamedb = ftdb.GameDB(os.path.join(logdir, os.path.basename(ftdb.defaultdb)))
+  gamedb.addMany(games)
+  gamedb.close()
+  print('- Rebuilt {0} game{1} into {2} gamelog{3} in {4:.2f}s'.format(
+    len(games), 's' if len(games) != 1 else '', len(written), 's' if len(written) != 1 else '', time.time() - started))
+
+
+def exitOnSignals():
+  '''SIGTERM and SIGHUP stop the tracker like ^C does, so the logs and archives get closed properly.'''
+  def stop(signum, frame):
+    raise SystemExit(128 + signum)
+  for name in ('SIGTERM', 'SIGHUP'):
+    if hasattr(signal, name):
+      signal.signal(getattr(signal, name), stop)
 
 
 example = '''sudo tcpflow -E tcpdemux -p -c -D -Ft -Fc -S enable_report=NO tcp src portrange 2201-2202 | python3 faeriatrack.py tcpflow'''
+examplereplay = '''python3 faeriatrack.py replay [--speed 10] [--gamelog replayed.log] [--timelines tl.log] [--stats] [--game N] archive/net.idx'''
+examplerebuild = '''python3 faeriatrack.py rebuild [--jobs 8] [--logs logs] archive/'''
+examplepcap = '''sudo tcpdump -i any -U -s 0 -w - tcp src portrange 2201-2202 | python3 faeriatrack.py pcap'''
+examplemulti = '''python3 faeriatrack.py multi [--stats] [--timelines] [--from-start] tcp:9000 unix:/tmp/ft.sock alice=fifo:/tmp/alice.fifo bob_tcpflow.txt'''
 
 def main():
-  print(term.bold('* Faeria deck tracker v{0} by Vulpyne <vulpyne@gmail.com>'.format(version)))
+  mode = 'help'
+  if len(sys.argv) > 1:
+    mode = sys.argv[1]
+  # Modes that never draw do not load the terminal stack at all.
+  nodraw = mode in ('replay', 'rebuild', 'multi') or '--headless' in sys.argv[2:]
+  banner = '* Faeria deck tracker v{0} by Vulpyne <vulpyne@gmail.com>'.format(version)
+  print(banner if nodraw else getTerminal().bold(banner))
   cardsname = 'cards.csv'
   print('- Loading cards from file: {0}'.format(cardsname))
   cards = loadCards(cardsname)
   print('- Loaded {0} card{1}'.format(len(cards), 's' if len(cards) != 1 else ''))
-  mode = 'help'
   if len(sys.argv) > 1:
-    mode = sys.argv[1]
     print('- Running with mode: {0}\n'.format(mode))
   if mode == 'help':
     print('Example: {0}'.format(example))
-  elif mode == 'tcpflow':
-    runTCPFlow(cards, sys.stdin)
+    print('Example: {0}'.format(examplepcap))
+    print('Example: {0}'.format(examplereplay))
+    print('Example: {0}'.format(examplerebuild))
+    print('Example: {0}'.format(examplemulti))
+  elif mode in ('tcpflow', 'pcap'):
+    args = sys.argv[2:]
+    focus = None
+    headless = False
+    server = None
+    timelines = False
+    while args[:1] in (['--client'], ['--headless'], ['--stats'], ['--serve'], ['--timelines']):
+      if args[0] == '--client':
+        focus = args[1]
+        args = args[2:]
+      elif args[0] == '--stats':
+        ftstats.enable()
+        args = args[1:]
+      elif args[0] == '--timelines':
+        timelines = True
+        args = args[1:]
+      elif args[0] == '--serve':
+        # Only loaded when asked for, asyncio is slow to import.
+        import ftserve
+        port = 8321
+        if args[1:2] and args[1].isdigit():
+          port = int(args[1])
+          args = args[1:]
+        server = ftserve.StateServer(port, maxrate = renderfps)
+        server.start()
+        print('- Serving state on http://127.0.0.1:{0}/state and ws://127.0.0.1:{0}/ws'.format(port))
+        args = args[1:]
+      else:
+        headless = True
+        args = args[1:]
+    ftstats.installSignal()
+    exitOnSignals()
+    if mode == 'tcpflow':
+      runTCPFlow(cards, sys.stdin, focus, headless, server, timelines)
+    elif not args:
+      runPcap(cards, [PipeReader(sys.stdin.buffer)], focus, headless, 'faeriatrack_state.json', server, timelines)
+    else:
+      runPcap(cards, (PipeReader(sys.stdin.buffer) if fn == '-' else open(fn, 'rb') for fn in args), focus, headless,
+              server = server, timelines = timelines)
+  elif mode == 'replay':
+    runReplay(cards, sys.argv[2:])
+  elif mode == 'rebuild':
+    runRebuild(cards, sys.argv[2:])
+  elif mode == 'multi':
+    runMulti(cards, sys.argv[2:])
   else:
     print('Unknown mode.')
 
@@ -0,0 +1,287 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Opponent archetypes: the revealed opponent deck of every game in the game
+# history as a game x card count matrix, clustered by cosine similarity
+# (spherical k-means) with the opponent's land colours as extra features.
+# Requires NumPy.
+#
+# The matrix is kept sparse (row, column, count triples) in an .npz cache
+# together with the last cluster centres, so a run only parses the games
+# added since the last one and k-means starts from where it ended.
+
+
+import os
+import os.path
+
+import numpy
+
+
+defaultcache = os.path.join('logs', 'faeriatrack_archetypes.npz')
+cacheversion = 1
+
+# Gamelog land keys, in feature column order after the cards.
+landnames = ('neutral', 'red', 'blue', 'green', 'yellow')
+
+
+class GameMatrix(object):
+  '''Revealed opponent decks of the games in a GameDB, plus what each game's matchup needs.'''
+  def __init__(self):
+    self.ids = numpy.zeros(0, numpy.int64)
+    self.victory = numpy.zeros(0, bool)
+    # Index into decknames, our deck in each game.
+    self.deck = numpy.zeros(0, numpy.int32)
+    self.decknames = []
+    # Column -> card id and name. Only ever appended to, so old columns keep their place.
+    self.cardids = []
+    self.cardnames = []
+    # Non-zero entries of the game x card matrix.
+    self.rows = numpy.zeros(0, numpy.int32)
+    self.cols = numpy.zeros(0, numpy.int32)
+    self.counts = numpy.zeros(0, numpy.uint8)
+    self.lands = numpy.zeros((0, len(landnames)), numpy.float32)
+    # Cluster centres from the last run and how many card columns there were then.
+    self.centroids = None
+    self.centroidcards = 0
+    self.added = 0
+    self.dropped = 0
+
+  def __len__(self):
+    return len(self.ids)
+
+  @classmethod
+  def load(cls, fn = defaultcache):
+    '''The cached matrix in fn, or an empty one if there is none (or it is from another version).'''
+    result = cls()
+    try:
+      with numpy.load(fn) as npz:
+        if int(npz['version']) != cacheversion:
+          return result
+        for name in ('ids', 'victory', 'deck', 'rows', 'cols', 'counts', 'lands'):
+          setattr(result, name, npz[name])
+        result.decknames = npz['decknames'].tolist()
+        result.cardids = npz['cardids'].tolist()
+        result.cardnames = npz['cardnames'].tolist()
+        if 'centroids' in npz:
+          result.centroids = npz['centroids']
+          result.centroidcards = int(npz['centroidcards'])
+    except FileNotFoundError:
+      pass
+    return result
+
+  def save(self, fn = defaultcache):
+    arrays = dict(version = cacheversion, ids = self.ids, victory = self.victory, deck = self.deck,
+      rows = self.rows, cols = self.cols, counts = self.counts, lands = self.lands,
+      decknames = numpy.array(self.decknames, dtype = str), cardids = numpy.array(self.cardids, dtype = numpy.int64),
+      cardnames = numpy.array(self.cardnames, dtype = str))
+    if self.centroids is not None:
+      arrays['centroids'] = self.centroids
+      arrays['centroidcards'] = self.centroidcards
+    tmpfn = fn + '.tmp'
+    with open(tmpfn, 'wb') as fp:
+      numpy.savez_compressed(fp, **arrays)
+    os.replace(tmpfn, fn)
+
+  def update(self, gamedb):
+    '''Drops games no longer in gamedb and adds the new ones. Returns how many were added.'''
+    current = numpy.array(gamedb.ids(), dtype = numpy.int64)
+    keep = numpy.isin(self.ids, current)
+    self.dropped = int(len(keep) - keep.sum())
+    if self.dropped:
+      newrow = numpy.cumsum(keep) - 1
+      entries = keep[self.rows]
+      self.rows = newrow[self.rows[entries]].astype(numpy.int32)
+      self.cols = self.cols[entries]
+      self.counts = self.counts[entries]
+      self.ids = self.ids[keep]
+      self.victory = self.victory[keep]
+      self.deck = self.deck[keep]
+      self.lands = self.lands[keep]
+    after = int(self.ids.max()) if len(self.ids) else 0
+    colof = dict((cardid, col) for col,cardid in enumerate(self.cardids))
+    deckof = dict((name, n) for n,name in enumerate(self.decknames))
+    ids = []
+    victory = []
+    deck = []
+    lands = []
+    rows = []
+    cols = []
+    counts = []
+    row = len(self.ids)
+    for gid,deckname,won,ocards,olands in gamedb.opponentGames(after):
+      ids.append(gid)
+      victory.append(won)
+      dnum = deckof.get(deckname)
+      if dnum is None:
+        dnum = deckof[deckname] = len(self.decknames)
+        self.decknames.append(deckname)
+      deck.append(dnum)
+      lands.append([olands.get(name) or 0 for name in landnames])
+      for quantity,cardid,name in ocards:
+        col = colof.get(cardid)
+        if col is None:
+          col = colof[cardid] = len(self.cardids)
+          self.cardids.append(cardid)
+          self.cardnames.append(name)
+        rows.append(row)
+        cols.append(col)
+        counts.append(min(255, max(1, quantity)))
+      row += 1
+    self.added = len(ids)
+    if ids:
+      self.ids = numpy.concatenate((self.ids, numpy.array(ids, dtype = numpy.int64)))
+      self.victory = numpy.concatenate((self.victory, numpy.array(victory, dtype = bool)))
+      self.deck = numpy.concatenate((self.deck, numpy.array(deck, dtype = numpy.int32)))
+      self.lands = numpy.concatenate((self.lands, numpy.array(lands, dtype = numpy.float32).reshape(-1, len(landnames))))
+      self.rows = numpy.concatenate((self.rows, numpy.array(rows, dtype = numpy.int32)))
+      self.cols = numpy.concatenate((self.cols, numpy.array(cols, dtype = numpy.int32)))
+      self.counts = numpy.concatenate((self.counts, numpy.array(counts, dtype = numpy.uint8)))
+    return self.added
+
+  def seen(self):
+    '''Distinct cards revealed per game.'''
+    return numpy.bincount(self.rows, minlength = len(self.ids))
+
+  def features(self, landweight = 0.5):
+    '''Dense unit rows: card counts normalised to length 1, then land colour shares scaled by landweight.'''
+    ncards = len(self.cardids)
+    x = numpy.zeros((len(self.ids), ncards + len(landnames)), numpy.float32)
+    x[self.rows, self.cols] = self.counts
+    cards = x[:, :ncards]
+    cards /= numpy.maximum(numpy.linalg.norm(cards, axis = 1), 1e-9)[:, None]
+    x[:, ncards:] = landweight * self.lands / numpy.maximum(self.lands.sum(axis = 1), 1.0)[:, None]
+    x /= numpy.maximum(numpy.linalg.norm(x, axis = 1), 1e-9)[:, None]
+    return x
+
+  def startCentroids(self, k):
+    '''The cached centres with columns for cards first seen since, if there were k of them.'''
+    c = self.centroids
+    if c is None or len(c) != k:
+      return None
+    ncards = len(self.cardids)
+    result = numpy.zeros((k, ncards + len(landnames)), numpy.float32)
+    result[:, :self.centroidcards] = c[:, :self.centroidcards]
+    result[:, ncards:] = c[:, self.centroidcards:]
+    return result
+
+
+def normalise(x):
+  x /= numpy.maximum(numpy.linalg.norm(x, axis = 1), 1e-9)[:, None]
+  return x
+
+
+def kmeansPlusPlus(x, weights, k, rng):
+  '''Spread out starting centres: each next one picked with probability weight x cosine distance.'''
+  chosen = [rng.choice(len(x), p = weights / weights.sum())]
+  best = x @ x[chosen[0]]
+  for _ in range(1, k):
+    p = weights * numpy.maximum(1.0 - best, 0.0)
+    total = p.sum()
+    if total <= 0:
+      break
+    n = rng.choice(len(x), p = p / total)
+    chosen.append(n)
+    numpy.maximum(best, x @ x[n], out = best)
+  return x[chosen].copy()
+
+
+def cluster(x, weights, k, init = None, iterations = 100, seed = 1):
+  '''Weighted spherical k-means over the unit rows of x. Returns (centres, labels, score), score
+     being the weighted sum of each row's similarity to its centre.'''
+  rng = numpy.random.default_rng(seed)
+  k = min(k, len(x))
+  centres = init if init is not None else kmeansPlusPlus(x, weights, k, rng)
+  k = len(centres)
+  labels = None
+  for _ in range(iterations):
+    sims = x @ centres.T
+    newlabels = sims.argmax(axis = 1)
+    if labels is not None and numpy.array_equal(newlabels, labels):
+      break
+    labels = newlabels
+    # Weighted sums per cluster in one product: a k x n matrix with each row's weight in its cluster's row.
+    member = numpy.zeros((k, len(x)), numpy.float32)
+    member[labels, numpy.arange(len(x))] = weights
+    centres = member @ x
+    empty = numpy.flatnonzero(member.sum(axis = 1) == 0)
+    if len(empty):
+      # Restart empty clusters on the rows furthest from their centre.
+      fit = sims[numpy.arange(len(x)), labels]
+      centres[empty] = x[numpy.argsort(fit)[:len(empty)]]
+    normalise(centres)
+  score = float((weights * (x @ centres.T)[numpy.arange(len(x)), labels]).sum())
+  return centres, labels, score
+
+
+def archetypes(matrix, k = 8, mincards = 4, landweight = 0.5, restarts = 8):
+  '''Clusters the games with at least mincards cards revealed into k archetypes, starting from the
+     cached centres when there are k of them, otherwise keeping the best of restarts random starts.
+     Identical decks are clustered once, weighted by how often they were seen. Returns (labels,
+     centres), label -1 for games with too little revealed. The centres are kept in matrix for the
+     next run.'''
+  x = matrix.features(landweight)
+  labels = numpy.full(len(x), -1, numpy.int64)
+  fit = matrix.seen() >= mincards
+  if not fit.any():
+    return labels, None
+  x = x[fit]
+  # Identical rows have identical projections, and distinct rows practically never do. Much faster
+  # than numpy.unique(axis = 0), which sorts whole rows.
+  key = x.astype(numpy.float64) @ numpy.random.default_rng(0).standard_normal(x.shape[1])
+  _,first,inverse,counts = numpy.unique(key, return_index = True, return_inverse = True, return_counts = True)
+  unique = x[first]
+  weights = counts.astype(numpy.float32)
+  init = matrix.startCentroids(k)
+  if init is not None:
+    centres,ulabels,_ = cluster(unique, weights, k, init)
+  else:
+    centres,ulabels,_ = max((cluster(unique, weights, k, seed = seed) for seed in range(1, restarts + 1)), key = lambda r: r[2])
+  labels[fit] = ulabels[inverse.reshape(-1)]
+  matrix.centroids = centres
+  matrix.centroidcards = len(matrix.cardids)
+  return labels, centres
+
+
+def matchups(matrix, labels, centres, topcards = 3):
+  '''Per archetype (biggest first, then the unclustered games): a dict with its top cards, main land
+     colours, games and wins overall and [(deckname, games, wins)] for each of our decks played against it.'''
+  k = len(centres) if centres is not None else 0
+  ndecks = max(1, len(matrix.decknames))
+  slot = labels + 1
+  games = numpy.bincount(slot, minlength = k + 1)
+  wins = numpy.bincount(slot, weights = matrix.victory, minlength = k + 1)
+  pair = slot * ndecks + matrix.deck
+  pgames = numpy.bincount(pair, minlength = (k + 1) * ndecks).reshape(k + 1, ndecks)
+  pwins = numpy.bincount(pair, weights = matrix.victory, minlength = (k + 1) * ndecks).reshape(k + 1, ndecks)
+  ncards = len(matrix.cardids)
+  result = []
+  for s in sorted(range(1, k + 1), key = lambda s: -games[s]) + [0]:
+    if games[s] == 0:
+      continue
+    entry = { 'games': int(games[s]), 'wins': int(wins[s]), 'cards': [], 'lands': [] }
+    if s > 0:
+      centre = centres[s - 1]
+      entry['cards'] = [matrix.cardnames[c] for c in numpy.argsort(-centre[:ncards])[:topcards] if centre[c] > 0]
+      landpart = centre[ncards:]
+      if landpart.sum() > 0:
+        share = landpart / landpart.sum()
+        entry['lands'] = [(landnames[n], float(share[n])) for n in numpy.argsort(-share) if share[n] >= 0.2]
+    entry['decks'] = [(matrix.decknames[d], int(pgames[s, d]), int(pwins[s, d]))
+                      for d in numpy.argsort(-pgames[s]) if pgames[s, d] > 0]
+    result.append(entry)
+  return result
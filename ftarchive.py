@@ -0,0 +1,373 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Compressed, rotating archive for the net and commands logs.
+#
+# An archive is a directory of segments, NAME_STAMP_SEQ.log.xz (or .gz), and
+# NAME.idx, a JSON record per line:
+#   {"seg": 3, "file": ..., "state": checkpoint or null}   segment opened
+#   {"seg": 3, "off": 1234, "event": "session"|"start"|"end", ...}
+#   {"seg": 3, "state": checkpoint}                        tracker resumed before reading any of it
+#   {"seg": 3, "file": ..., "size": ..., "csize": ...}      segment closed
+# Offsets are characters into the segment's text and always fall on a line
+# (block) boundary. A segment starts either with a fresh tracker or from the
+# checkpoint stored with it, so any game can be replayed by decompressing its
+# own segment only. Segments rotate at a session reset or game end once
+# segsize is reached (anywhere past four times that) and the oldest are
+# deleted to keep the archive under maxbytes compressed.
+# A segment is a series of complete xz streams (gzip members), one is ended
+# at every mark and every few MB. A tracker killed mid segment loses what it
+# wrote since the last one, reading stops there.
+#
+# List games:          python3 ftarchive.py archive/net.idx
+# Extract game N:      python3 ftarchive.py archive/net.idx N > game.log
+# Replay game N:       python3 faeriatrack.py replay --game N archive/net.idx
+
+
+import json
+import lzma
+import os
+import os.path
+import sys
+import time
+import zlib
+
+
+class SegmentFile(object):
+  '''Text writer for one segment. sync() ends the compressed stream in progress, the next write
+     starts another. Nothing is translated, so offsets are exact.'''
+  def __init__(self, fn, syncsize = 4 << 20):
+    self.name = fn
+    self.fp = open(fn, 'wb')
+    self.gzip = fn.endswith('.gz')
+    # Past the preset 3 dictionary size a new stream costs nothing in ratio.
+    self.syncsize = syncsize
+    self.compressor = None
+    self.size = 0
+
+  def write(self, s):
+    compressor = self.compressor
+    if compressor is None:
+      if self.gzip:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+      else:
+        # Preset 3 gets the hex dumps to about 5% of their size using a tenth of the CPU of 6.
+        compressor = lzma.LZMACompressor(preset = 3)
+      self.compressor = compressor
+    data = s.encode('utf-8')
+    self.fp.write(compressor.compress(data))
+    self.size += len(data)
+    if self.size >= self.syncsize:
+      self.sync()
+
+  def flush(self):
+    self.fp.flush()
+
+  def sync(self):
+    if self.compressor is not None:
+      self.fp.write(self.compressor.flush())
+      self.fp.flush()
+      self.compressor = None
+      self.size = 0
+
+  def close(self):
+    self.sync()
+    self.fp.close()
+
+
+def readStreams(fn, chunksize = 1 << 20):
+  '''Yields the text of each complete stream (member) in segment fn. An unfinished last one,
+     from a tracker that was killed, is left out.'''
+  gz = fn.endswith('.gz')
+  with open(fn, 'rb') as fp:
+    decompressor = None
+    parts = []
+    data = b''
+    while True:
+      if not data:
+        data = fp.read(chunksize)
+        if not data:
+          return
+      if decompressor is None:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gz else lzma.LZMADecompressor()
+      parts.append(decompressor.decompress(data))
+      if not decompressor.eof:
+        data = b''
+        continue
+      data = decompressor.unused_data
+      decompressor = None
+      yield b''.join(parts).decode('utf-8')
+      parts = []
+
+
+def readIndex(idxfn):
+  try:
+    with open(idxfn, 'r') as fp:
+      return [json.loads(line) for line in fp if line.strip()]
+  except FileNotFoundError:
+    return []
+
+
+class ArchiveWriter(object):
+  '''File-like writer for one archive. wrap(fp) is applied to every segment opened, to move
+     compression off the caller's thread (faeriatrack passes LogWriter). Nothing is created
+     until the first write.'''
+  def __init__(self, dirname, name, segsize = 64 << 20, maxbytes = 4 << 30, compression = 'xz', wrap = None):
+    self.dirname = dirname
+    self.name = name
+    self.segsize = segsize
+    self.maxbytes = maxbytes
+    self.ext = '.log.' + compression
+    self.wrap = wrap
+    self.idxfn = os.path.join(dirname, name + '.idx')
+    self.idxfp = None
+    # [seg, fn, csize] of closed segments still on disk, oldest first.
+    self.closed = []
+    self.seq = 0
+    for rec in readIndex(self.idxfn):
+      self.seq = max(self.seq, rec['seg'] + 1)
+      if 'csize' in rec:
+        self.closed.append([rec['seg'], rec['file'], rec['csize']])
+    self.out = None
+    self.fn = None
+    self.pos = 0
+    # Checkpoint the next segment starts from.
+    self.state = None
+
+  def record(self, rec):
+    if self.idxfp is None:
+      os.makedirs(self.dirname, exist_ok = True)
+      self.idxfp = open(self.idxfn, 'a')
+    self.idxfp.write(json.dumps(rec, separators = (',', ':')))
+    self.idxfp.write('\n')
+    self.idxfp.flush()
+
+  def open(self):
+    os.makedirs(self.dirname, exist_ok = True)
+    self.fn = '{0}_{1}_{2:05d}{3}'.format(self.name, time.strftime('%Y%m%dT%H%M%S'), self.seq, self.ext)
+    fp = SegmentFile(os.path.join(self.dirname, self.fn))
+    self.out = self.wrap(fp) if self.wrap is not None else fp
+    self.pos = 0
+    self.record({ 'seg': self.seq, 'file': self.fn, 'state': self.state })
+    self.state = None
+
+  def write(self, s):
+    if self.out is None:
+      self.open()
+    self.out.write(s)
+    self.pos += len(s)
+
+  def flush(self):
+    pass
+
+  def tell(self):
+    return self.pos
+
+  def setState(self, state):
+    '''Checkpoint (Tracker.checkpoint()) the next segment opened starts from, or the current one
+       if the tracker has not been fed anything from it yet.'''
+    if self.out is None:
+      self.state = state
+    else:
+      self.record({ 'seg': self.seq, 'state': state })
+
+  def mark(self, event, offset, info):
+    if self.out is None:
+      self.open()
+    rec = { 'seg': self.seq, 'off': offset, 'event': event }
+    rec.update(info)
+    self.record(rec)
+    # Everything up to here survives the tracker being killed.
+    self.out.sync()
+
+  def due(self, event = None):
+    '''True if the segment should be rotated now. Only once it is big enough, at a session reset or
+       game end, unless it has grown far past that.'''
+    if self.out is None:
+      return False
+    if event in ('session', 'end'):
+      return self.pos >= self.segsize
+    return self.pos >= self.segsize * 4
+
+  def rotate(self, state = None):
+    '''Closes the current segment. The next write starts a new one from state.'''
+    if self.out is not None:
+      self.out.close()
+      path = os.path.join(self.dirname, self.fn)
+      csize = os.path.getsize(path)
+      self.record({ 'seg': self.seq, 'file': self.fn, 'size': self.pos, 'csize': csize })
+      self.closed.append([self.seq, self.fn, csize])
+      self.seq += 1
+      self.out = None
+      self.pos = 0
+      self.prune()
+    self.state = state
+
+  def prune(self):
+    total = sum(c[2] for c in self.closed)
+    dropped = set()
+    while self.closed and total > self.maxbytes:
+      seg,fn,csize = self.closed.pop(0)
+      try:
+        os.remove(os.path.join(self.dirname, fn))
+      except FileNotFoundError:
+        pass
+      total -= csize
+      dropped.add(seg)
+    if not dropped:
+      return
+    # Rewrite the index without them.
+    self.idxfp.close()
+    self.idxfp = None
+    recs = [rec for rec in readIndex(self.idxfn) if rec['seg'] not in dropped]
+    tmpfn = self.idxfn + '.tmp'
+    with open(tmpfn, 'w') as fp:
+      fp.write(''.join(json.dumps(rec, separators = (',', ':')) + '\n' for rec in recs))
+    os.replace(tmpfn, self.idxfn)
+
+  def close(self):
+    self.rotate()
+    if self.idxfp is not None:
+      self.idxfp.close()
+      self.idxfp = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+class SegmentReader(object):
+  '''Lines of one or more consecutive segments, from offset start in the first to offset end
+     in the last (None for all of it). Only those segments are decompressed.'''
+  def __init__(self, dirname, files, start = 0, end = None):
+    self.lines = self.generate(dirname, files, start, end)
+
+  def generate(self, dirname, files, start, end):
+    last = len(files) - 1
+    for n,fn in enumerate(files):
+      pos = 0
+      rest = ''
+      for text in readStreams(os.path.join(dirname, fn)):
+        lines = (rest + text).split('\n')
+        rest = lines.pop()
+        for line in lines:
+          line += '\n'
+          if n == last and end is not None and pos >= end:
+            return
+          if n > 0 or pos >= start:
+            yield line
+          pos += len(line)
+      if rest and (n > 0 or pos >= start) and not (n == last and end is not None and pos >= end):
+        yield rest
+
+  def readline(self):
+    return next(self.lines, '')
+
+  def __iter__(self):
+    return self.lines
+
+
+class Archive(object):
+  '''Reads an archive index (the .idx file) and the segments it lists.'''
+  def __init__(self, idxfn):
+    self.idxfn = idxfn
+    self.dirname = os.path.dirname(idxfn)
+    # seg -> {'file': ..., 'state': ..., 'size': ...}, in order.
+    self.segments = {}
+    self.games = []
+    # seg -> offsets of the session resets and game starts in it.
+    self.sessions = {}
+    self.starts = {}
+    start = None
+    for rec in readIndex(idxfn):
+      seg = rec['seg']
+      if 'size' in rec:
+        if seg in self.segments:
+          self.segments[seg]['size'] = rec['size']
+        continue
+      if 'file' in rec:
+        self.segments[seg] = { 'file': rec['file'], 'state': rec['state'], 'size': None }
+        continue
+      if 'state' in rec:
+        if seg in self.segments:
+          self.segments[seg]['state'] = rec['state']
+        continue
+      event = rec['event']
+      if event == 'start':
+        self.starts.setdefault(seg, []).append(rec['off'])
+        start = rec
+      elif event == 'end' and start is not None:
+        game = dict(rec)
+        game['seg'] = start['seg']
+        game['start'] = start['off']
+        game['endseg'] = seg
+        game['end'] = rec['off']
+        del game['off'], game['event']
+        self.games.append(game)
+        start = None
+      elif event == 'session':
+        self.sessions.setdefault(seg, []).append(rec['off'])
+        start = None
+
+  def segmentFiles(self, first, last):
+    return [self.segments[seg]['file'] for seg in range(first, last + 1) if seg in self.segments]
+
+  def state(self, seg):
+    '''Checkpoint the segment starts from, None for a fresh tracker.'''
+    return self.segments[seg]['state']
+
+  def read(self, seg = None, start = 0, endseg = None, end = None):
+    '''Lines from offset start in segment seg to offset end in segment endseg, all segments if seg is None.'''
+    if seg is None:
+      return SegmentReader(self.dirname, [s['file'] for s in self.segments.values()])
+    if endseg is None:
+      endseg = seg
+    return SegmentReader(self.dirname, self.segmentFiles(seg, endseg), start, end)
+
+  def earlier(self, n):
+    '''How many games (finished or not) started in game n's segment before it.'''
+    game = self.games[n]
+    return sum(1 for off in self.starts.get(game['seg'], ()) if off < game['start'])
+
+  def readGame(self, n, whole = False):
+    '''Lines of game n. With whole set, from the start of its segment so that feeding them to a
+       tracker restored from state(game['seg']) tracks it like it did live. Those include
+       earlier() games that started in the segment.'''
+    game = self.games[n]
+    return self.read(game['seg'], 0 if whole else game['start'], game['endseg'], game['end'])
+
+
+def main():
+  if len(sys.argv) < 2:
+    print('Usage: {0} ARCHIVE.idx [GAME]'.format(sys.argv[0]))
+    return
+  archive = Archive(sys.argv[1])
+  if len(sys.argv) > 2:
+    sys.stdout.writelines(archive.readGame(int(sys.argv[2])))
+    return
+  for n,game in enumerate(archive.games):
+    if game['seg'] not in archive.segments:
+      continue
+    print('{0: >5d} {1} {2} vs {3} ({4}) in {5}'.format(n, game.get('stamp', '?'), 'Won ' if game.get('victory') else 'Lost',
+      game.get('opponent', '?'), game.get('deck', '?'), archive.segments[game['seg']]['file']))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,21 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Throughput benchmarks for the tracker and a synthetic Faeria protocol stream generator.
+#
+# Run from the repository root:
+#   python3 -m ftbench [--games N] [--turns N] [--seed N] [--only NAME[,NAME]]
+#   python3 -m ftbench.generate [--format commands|tcpflow] [--games N] > stream.log
@@ -0,0 +1,255 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Usage: python3 -m ftbench [--games N] [--turns N] [--seed N] [--repeat N]
+#                           [--only NAME[,NAME]] [--save FILE] [--compare FILE]
+#
+# --save writes the results as JSON, --compare prints the change against a saved run.
+
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import faeriatrack
+from ftbench.generate import StreamGenerator
+
+
+def best(repeat, fn):
+  '''Runs fn repeat times, returns (fastest seconds, last result).'''
+  result = None
+  fastest = None
+  for _ in range(repeat):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    if fastest is None or elapsed < fastest:
+      fastest = elapsed
+  return fastest, result
+
+
+def benchTCPFlow(gen, cards, repeat):
+  '''Full live path, headless: tcpflow text -> framing -> archives, logs, game db and checkpoints
+     -> Tracker.feed. The board is drawn on the Renderer's own thread, render times that part.'''
+  lines = list(gen.tcpflow())
+  text = ''.join(lines)
+  ncommands = sum(1 for _ in gen.commands())
+  olddir = os.getcwd()
+  elapsed = None
+  for _ in range(repeat):
+    # A fresh directory every time, or later runs resume from the first one's checkpoint and
+    # add to its archives and game db.
+    with tempfile.TemporaryDirectory() as tmpdir:
+      os.chdir(tmpdir)
+      try:
+        os.mkdir('logs')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+          started = time.perf_counter()
+          faeriatrack.runTCPFlow(cards, io.StringIO(text), headless = True)
+          took = time.perf_counter() - started
+      finally:
+        os.chdir(olddir)
+    if elapsed is None or took < elapsed:
+      elapsed = took
+  return {
+    'seconds': elapsed,
+    'commands': ncommands,
+    'commands_per_sec': ncommands / elapsed,
+    'lines_per_sec': len(lines) / elapsed,
+    'mb_per_sec': len(text) / elapsed / 1e6,
+    'output_bytes': len(out.getvalue()),
+  }
+
+
+def benchFeed(gen, cards, repeat):
+  '''Tracker.feed alone, headless.'''
+  commands = [c for _,c in gen.commands()]
+  def run():
+    tracker = faeriatrack.Tracker(cards, open(os.devnull, 'w'))
+    feed = tracker.feed
+    for command in commands:
+      feed(command)
+  elapsed, _ = best(repeat, run)
+  return {
+    'seconds': elapsed,
+    'commands': len(commands),
+    'commands_per_sec': len(commands) / elapsed,
+    'us_per_command': elapsed / len(commands) * 1e6,
+  }
+
+
+def benchHandlers(gen, cards, repeat):
+  '''Time spent in each handler (and in the dispatch of unhandled commands).'''
+  commands = [c for _,c in gen.commands()]
+  totals = {}
+  counts = {}
+  def timed(name, handler):
+    def wrapper(self, *args):
+      started = time.perf_counter()
+      try:
+        return handler(self, *args)
+      finally:
+        totals[name] = totals.get(name, 0.0) + time.perf_counter() - started
+        counts[name] = counts.get(name, 0) + 1
+    return wrapper
+  tracker = faeriatrack.Tracker(cards, open(os.devnull, 'w'))
+  tracker.handlers = dict((name, timed(name, handler)) for name,handler in faeriatrack.Tracker.handlers.items())
+  unhandled = 0
+  for command in commands:
+    cmd = command.split('|', 2)[1]
+    if cmd not in tracker.handlers:
+      unhandled += 1
+    tracker.feed(command)
+  result = { 'unhandled': unhandled, 'handlers': {} }
+  for name in sorted(totals, key = lambda n: -totals[n]):
+    result['handlers'][name] = {
+      'calls': counts[name],
+      'total_ms': totals[name] * 1e3,
+      'us_per_call': totals[name] / counts[name] * 1e6,
+    }
+  return result
+
+
+def benchMemory(gen, cards, repeat):
+  '''Peak Python heap while feeding the whole stream.'''
+  commands = [c for _,c in gen.commands()]
+  tracemalloc.start()
+  try:
+    tracker = faeriatrack.Tracker(cards, open(os.devnull, 'w'))
+    for command in commands:
+      tracker.feed(command)
+    current,peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return { 'peak_kb': peak / 1024.0, 'retained_kb': current / 1024.0 }
+
+
+def benchRender(gen, cards, repeat):
+  '''Cost of showStatus on a mid game board, with the frame rate limit off.'''
+  tracker = faeriatrack.Tracker(cards, open(os.devnull, 'w'))
+  commands = [c for _,c in gen.commands()]
+  # Stop somewhere in the middle of the first game.
+  for command in commands[:len(commands) // (2 * gen.games) + 1]:
+    tracker.feed(command)
+  if tracker.game is None or tracker.game.currpnum is None:
+    return { 'frames': 0 }
+  out = io.StringIO()
+  tracker.renderer = faeriatrack.Renderer(out, maxfps = 0)
+  frames = 200
+  player = tracker.game.players[tracker.game.currpnum]
+  def run():
+    for n in range(frames):
+      # Something small changes between frames, as in a real game.
+      player.health = n % 20
+      tracker.showStatus()
+  elapsed, _ = best(repeat, run)
+  return {
+    'frames': frames,
+    'ms_per_frame': elapsed / frames * 1e3,
+    'bytes_per_frame': len(out.getvalue()) / float(frames * repeat),
+  }
+
+
+benchmarks = (
+  ('tcpflow', benchTCPFlow),
+  ('feed', benchFeed),
+  ('handlers', benchHandlers),
+  ('memory', benchMemory),
+  ('render', benchRender),
+)
+
+
+def report(results, baseline):
+  def delta(path, value):
+    ref = baseline
+    for key in path:
+      ref = ref.get(key) if isinstance(ref, dict) else None
+    if not isinstance(ref, (int, float)) or not ref:
+      return ''
+    return '  ({0:+.1f}%)'.format((value - ref) / ref * 100.0)
+  for name,result in results.items():
+    print('== {0}'.format(name))
+    for key,value in result.items():
+      if key == 'handlers':
+        print('  {0: <22s} {1: >8s} {2: >10s} {3: >10s}'.format('handler', 'calls', 'total ms', 'us/call'))
+        for hname,h in value.items():
+          print('  {0: <22s} {1: >8d} {2: >10.2f} {3: >10.2f}{4}'.format(
+            hname, h['calls'], h['total_ms'], h['us_per_call'], delta((name, key, hname, 'us_per_call'), h['us_per_call'])))
+      elif isinstance(value, float):
+        print('  {0: <22s} {1: >14.2f}{2}'.format(key, value, delta((name, key), value)))
+      else:
+        print('  {0: <22s} {1: >14}'.format(key, value))
+  tf = results.get('tcpflow')
+  if tf:
+    # The live loop falls behind once the capture delivers commands faster than this.
+    rate = tf['commands_per_sec']
+    render = results.get('render')
+    if render and render.get('frames'):
+      # The Renderer thread takes its share of the interpreter at up to renderfps frames a second.
+      busy = min(1.0, faeriatrack.renderfps * render['ms_per_frame'] / 1e3)
+      print('\n* Sustained live rate before lagging: ~{0:.0f} commands/sec headless, ~{1:.0f} drawing {2} frames/sec'
+        .format(rate, rate * (1.0 - busy), faeriatrack.renderfps))
+    else:
+      print('\n* Sustained live rate before lagging: ~{0:.0f} commands/sec headless'.format(rate))
+
+
+def main():
+  args = list(sys.argv[1:])
+  opts = {}
+  repeat = 3
+  only = None
+  save = None
+  compare = None
+  while args:
+    arg = args.pop(0)
+    if arg in ('--seed', '--games', '--turns', '--cards', '--noise'):
+      opts[arg[2:]] = int(args.pop(0))
+    elif arg == '--repeat':
+      repeat = int(args.pop(0))
+    elif arg == '--only':
+      only = args.pop(0).split(',')
+    elif arg == '--save':
+      save = args.pop(0)
+    elif arg == '--compare':
+      compare = args.pop(0)
+    else:
+      raise ValueError('ftbench: Unknown argument {0}'.format(arg))
+  opts.setdefault('games', 20)
+  gen = StreamGenerator(**opts)
+  cards = gen.cards()
+  results = {}
+  for name,fn in benchmarks:
+    if only is None or name in only:
+      results[name] = fn(gen, cards, repeat)
+  baseline = {}
+  if compare:
+    with open(compare, 'r') as fp:
+      baseline = json.load(fp)
+  print('* ftbench: {0} (tracker v{1})\n'.format(', '.join('{0}={1}'.format(k, v) for k,v in sorted(opts.items())), faeriatrack.version))
+  report(results, baseline)
+  if save:
+    with open(save, 'w') as fp:
+      json.dump(results, fp, indent = 2)
+
+
+if __name__ == '__main__':
+  main()
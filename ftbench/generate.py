@@ -0,0 +1,244 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Seeded generator for Faeria server traffic as the tracker sees it. The
+# stream is a plausible session: login, deck list, then a number of games
+# with draws, plays, faeria, lands, player states and a victory. A share of
+# commands have no handler, as in real traffic.
+
+
+import random
+import sys
+
+
+landtypes = ('red', 'blue', 'green', 'yellow', 'human')
+
+# Commands the tracker does not handle, roughly in the mix seen on the wire.
+noisecommands = (
+  '#Attack|{0}|{1}',
+  '#Damage|{0}|{1}|1',
+  '~ping|{0}',
+  '#SetAttribute|{0}|power|{1}',
+  '#SetAttribute|{0}|life|{1}',
+  '$chat|from:Someone|text:gg{0}',
+  '#Heal|{0}|{1}',
+  '~timer|{0}|{1}',
+)
+
+
+class StreamGenerator(object):
+  '''Produces a deterministic (for a given seed) session of Faeria commands.
+     games, turns and cards scale the size: turns is per game, cards is the size of the card pool.'''
+  def __init__(self, seed = 0, games = 1, turns = 12, cards = 300, decks = 4, noise = 3, name = 'Benchmarker'):
+    self.seed = seed
+    self.games = games
+    self.turns = turns
+    self.ncards = cards
+    self.ndecks = decks
+    self.noise = noise
+    self.name = name
+
+  def cardNames(self):
+    '''Yields (cardid, name, text) for the synthetic card pool.'''
+    rnd = random.Random(self.seed ^ 0x5eed)
+    words = ('Aurora', 'Glen', 'Hearth', 'Nature', 'Wild', 'Soul', 'Yak', 'Lord', 'Gift', 'Storm',
+             'Ember', 'Tide', 'Stone', 'Wind', 'Oak', 'Flame', 'Rune', 'Sky', 'Dream', 'Shard')
+    for cardid in range(1, self.ncards + 1):
+      name = ' '.join(rnd.choice(words) for _ in range(rnd.randint(1, 3)))
+      if rnd.random() < 0.15:
+        name = '{0}, {1}'.format(name, ' '.join(rnd.choice(words) for _ in range(3)))
+      yield (cardid, name, 'Synthetic card {0}.'.format(cardid))
+
+  def cardsCSV(self):
+    '''Yields lines in the same format as cards.csv.'''
+    for cardid,name,text in self.cardNames():
+      yield '{0}.name;{1}\n'.format(cardid, name)
+      yield '{0}.text;{1}\n'.format(cardid, text)
+
+  def cards(self):
+    '''Returns a card dict as loadCards() would.'''
+    import faeriatrack
+    return dict((cardid, faeriatrack.Card(cardid, name, text)) for cardid,name,text in self.cardNames())
+
+  def commands(self):
+    '''Yields (stype, command) with stype W (world server, 2201) or G (game server, 2202).'''
+    rnd = random.Random(self.seed)
+    seq = [0]
+    def cmd(stype, fmt, *args):
+      seq[0] += 1
+      return (stype, '{0}|{1}'.format(seq[0], fmt.format(*args) if args else fmt))
+    def noise(stype, n):
+      for _ in range(rnd.randint(0, n)):
+        yield cmd(stype, rnd.choice(noisecommands), rnd.randint(1, 500), rnd.randint(0, 9))
+    pool = list(range(1, self.ncards + 1))
+    decks = {}
+    yield cmd('W', '$welcome|source:WorldServer|version:1')
+    for n in range(self.ndecks):
+      deckid = 100 + n
+      yield cmd('W', '$sset|dr:decks|t:DECK|name:Deck {0}|id:{1}', n, deckid)
+      picks = rnd.sample(pool, 15)
+      decks[deckid] = [(cardid, 2) for cardid in picks]
+      for start in range(0, len(picks), 5):
+        yield cmd('W', '$setQuantity|dr:deck{0}|t:CARD|{1}', deckid,
+                  '|'.join('{0}:{1}'.format(cardid, qty) for cardid,qty in decks[deckid][start:start + 5]))
+    deckids = sorted(decks)
+    yield cmd('W', '$sset|dr:you|pickedDeckId:{0}|userName:{1}', deckids[0], self.name)
+    gcid = 1000
+    for gnum in range(self.games):
+      deckid = rnd.choice(deckids)
+      yield cmd('W', '$set|t:ACCOUNT|pickedDeckId:{0}', deckid)
+      yield cmd('W', '$sset|dr:gameMembers|userName:Opponent{0}|constructedRank:{1}|constructedGodRank:{2}',
+                gnum, rnd.randint(1, 20), rnd.choice((0, 0, 0, rnd.randint(1, 500))))
+      yield cmd('G', '$startGame')
+      yield cmd('G', '$setRankedMode|him:{0}|me:{1}', rnd.choice(('COMPETITIVE', 'CASUAL')), rnd.choice(('COMPETITIVE', 'CASUAL')))
+      mypnum = rnd.randint(0, 1)
+      opnum = 1 - mypnum
+      yield cmd('G', '~iam|{0}', mypnum)
+      library = []
+      for cardid,qty in decks[deckid]:
+        for _ in range(qty):
+          gcid += 1
+          yield cmd('G', '*createGameCard|{0}|{1}|{2}|CARD|0', gcid, cardid, mypnum)
+          library.append(gcid)
+      rnd.shuffle(library)
+      hand = []
+      health = { 0: 20, 1: 20 }
+      decksize = { mypnum: len(library), opnum: 30 }
+      handsize = { mypnum: 0, opnum: 0 }
+      for pnum,count in ((mypnum, 4), (opnum, 4)):
+        for _ in range(count):
+          if pnum == mypnum:
+            g = library.pop()
+            hand.append(g)
+            yield cmd('G', '#ZoneMove|0|{0}|deck|{1}|hand|{1}', g, pnum)
+          decksize[pnum] -= 1
+          handsize[pnum] += 1
+      for turn in range(1, self.turns + 1):
+        for pnum in (0, 1):
+          yield cmd('G', '~newTurn|{0}|{1}', pnum, turn * 2 - 1 + pnum)
+          for stype,c in noise('G', self.noise):
+            yield (stype, c)
+          if decksize[pnum] > 0:
+            decksize[pnum] -= 1
+            handsize[pnum] += 1
+            if pnum == mypnum and library:
+              g = library.pop()
+              hand.append(g)
+              yield cmd('G', '#ZoneMove|0|{0}|deck|{1}|hand|{1}', g, pnum)
+          yield cmd('G', '#FaeriaGain|0|{0}|3', pnum)
+          if rnd.random() < 0.5:
+            yield cmd('G', '#CreateTokenLand|{0}|{1}|0|{2}', rnd.randint(1, 40), pnum, rnd.choice(landtypes))
+          else:
+            yield cmd('G', '#HarvestFaeria|{0}|{1}|1|{2}', rnd.randint(1, 500), rnd.randint(1, 40), pnum)
+            yield cmd('G', '#FaeriaGain|0|{0}|1', pnum)
+          for _ in range(rnd.randint(0, 2)):
+            if handsize[pnum] == 0:
+              break
+            handsize[pnum] -= 1
+            if pnum == mypnum and hand:
+              g = hand.pop(rnd.randrange(len(hand)))
+            else:
+              gcid += 1
+              g = gcid
+              yield cmd('G', '*createGameCard|{0}|{1}|{2}|CARD|0', g, rnd.choice(pool), pnum)
+            yield cmd('G', '#PayFaeria|0|{0}|{1}', pnum, rnd.randint(0, 4))
+            yield cmd('G', '#ZoneMove|0|{0}|hand|{1}|board|{1}', g, pnum)
+            yield cmd('G', '#ComeIntoPlay|0|{0}|{1}', g, pnum)
+            for stype,c in noise('G', self.noise):
+              yield (stype, c)
+          other = 1 - pnum
+          health[other] = max(0, health[other] - rnd.randint(0, 3))
+          for p in (0, 1):
+            yield cmd('G', '~playerState|{0}|{1}|{2}|{3}|{4}|0', p, health[p], rnd.randint(0, 9), handsize[p], decksize[p])
+          for stype,c in noise('W', 1):
+            yield (stype, c)
+      winner = rnd.randint(1, 2)
+      yield cmd('G', '$victory|{0}|{1}', winner, rnd.choice(('DEATH', 'SURRENDER', 'TIMEOUT')))
+      yield cmd('G', '$stopGame')
+
+  def commandLog(self):
+    '''Yields lines in faeriatrack_commands.log format.'''
+    for stype,command in self.commands():
+      yield '{0}: {1}\n'.format(stype, command)
+
+  def packets(self):
+    '''Yields (stamp, srcport, data) with commands packed into packet sized chunks, split
+       mid command like real TCP, plus some outgoing traffic.'''
+    rnd = random.Random(self.seed + 1)
+    stamp = 1500000000
+    pending = { 'W': bytearray(), 'G': bytearray() }
+    ports = { 'W': 2201, 'G': 2202 }
+    for stype,command in self.commands():
+      other = 'G' if stype == 'W' else 'W'
+      if pending[other]:
+        # Keep the order between the two servers, the tracker relies on it.
+        yield (stamp, ports[other], bytes(pending[other]))
+        pending[other] = bytearray()
+      buf = pending[stype]
+      buf += command.encode('ascii') + b'\n'
+      if len(buf) < rnd.choice((40, 200, 600, 1400)):
+        continue
+      cut = min(len(buf), rnd.randint(len(buf) // 2, len(buf) + 1))
+      stamp += rnd.choice((0, 0, 0, 1))
+      yield (stamp, ports[stype], bytes(buf[:cut]))
+      del buf[:cut]
+      if rnd.random() < 0.3:
+        yield (stamp, 50000, '{0}|ack\n'.format(rnd.randint(1, 1000)).encode('ascii'))
+    for stype in ('W', 'G'):
+      if pending[stype]:
+        yield (stamp, ports[stype], bytes(pending[stype]))
+
+  def tcpflow(self):
+    '''Yields lines in the tcpflow -D -Ft -Fc format that runTCPFlow reads.'''
+    for stamp,srcport,data in self.packets():
+      if srcport == 50000:
+        yield '{0}T192.168.001.002.50000-010.000.000.001.02202:\n'.format(stamp)
+      else:
+        yield '{0}T010.000.000.001.{1:05d}-192.168.001.002.50000:\n'.format(stamp, srcport)
+      for off in range(0, len(data), 16):
+        row = data[off:off + 16]
+        hexd = ' '.join(row[i:i + 2].hex() for i in range(0, len(row), 2))
+        text = ''.join(chr(b) if 32 <= b < 127 else '.' for b in row)
+        yield '{0:04x}: {1: <40}  {2}\n'.format(off, hexd, text)
+      yield '\n'
+
+
+def main():
+  args = list(sys.argv[1:])
+  fmt = 'commands'
+  opts = {}
+  while args:
+    arg = args.pop(0)
+    if arg == '--format':
+      fmt = args.pop(0)
+    elif arg in ('--seed', '--games', '--turns', '--cards', '--decks', '--noise'):
+      opts[arg[2:]] = int(args.pop(0))
+    else:
+      raise ValueError('generate: Unknown argument {0}'.format(arg))
+  gen = StreamGenerator(**opts)
+  if fmt == 'commands':
+    lines = gen.commandLog()
+  elif fmt == 'tcpflow':
+    lines = gen.tcpflow()
+  elif fmt == 'cards':
+    lines = gen.cardsCSV()
+  else:
+    raise ValueError('generate: Unknown format {0}'.format(fmt))
+  sys.stdout.writelines(lines)
+
+
+if __name__ == '__main__':
+  main()
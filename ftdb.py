@@ -0,0 +1,285 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Game history store: every finished game in one SQLite file, indexed on the
+# columns ftlv filters by. The full gamelog record is kept as JSON next to
+# them so nothing is lost and readers get exactly what the gamelog has.
+# Games the tracker adds are written from a background thread.
+
+
+import json
+import os
+import os.path
+import queue
+import sqlite3
+import threading
+
+
+defaultdb = os.path.join('logs', 'faeriatrack_games.db')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS {0} (
+  id INTEGER PRIMARY KEY,
+  stamp TEXT NOT NULL,
+  victory INTEGER NOT NULL,
+  first INTEGER NOT NULL,
+  endreason TEXT,
+  turn INTEGER,
+  oname TEXT NOT NULL COLLATE NOCASE,
+  omode TEXT,
+  orank INTEGER,
+  ogrank INTEGER,
+  mmode TEXT,
+  mname TEXT,
+  deckname TEXT NOT NULL COLLATE NOCASE,
+  oeco INTEGER,
+  meco INTEGER,
+  record TEXT NOT NULL,
+  UNIQUE (stamp, oname, deckname)
+);
+'''
+
+indexes = '''
+CREATE INDEX IF NOT EXISTS games_stamp ON games (stamp);
+CREATE INDEX IF NOT EXISTS games_oname ON games (oname COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS games_deckname ON games (deckname COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS games_mode ON games (mmode, omode);
+CREATE INDEX IF NOT EXISTS games_victory ON games (victory, stamp);
+'''
+
+# Filesystems where WAL's shared memory locking does not work (see networkFS).
+networkfstypes = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', '9p', 'fuse.sshfs', 'ncpfs', 'glusterfs', 'ceph', 'lustre')
+
+columns = ('stamp', 'victory', 'first', 'endreason', 'turn', 'oname', 'omode', 'orank', 'ogrank',
+           'mmode', 'mname', 'deckname', 'oeco', 'meco', 'record')
+
+
+def toInt(s):
+  try:
+    return int(s)
+  except (TypeError, ValueError):
+    return None
+
+
+def gameRow(game):
+  '''Flattens a gamelog record (as written by Tracker.handler_victory) into a row for the games table.'''
+  opp = game['opponent']
+  me = game['me']
+  return (game['stamp'], int(bool(game['victory'])), int(bool(game['first'])), game.get('endreason'), game.get('turn'),
+    opp.get('name') or '', opp.get('mode'), toInt(opp.get('rank')), toInt(opp.get('grank')),
+    me.get('mode'), me.get('name'), me.get('deckname') or '', opp.get('eco'), me.get('eco'),
+    json.dumps(game))
+
+
+def networkFS(fn):
+  '''True if fn is on a network filesystem, as far as /proc/self/mounts tells (Linux only).'''
+  try:
+    with open('/proc/self/mounts', 'r') as fp:
+      mounts = [line.split()[1:3] for line in fp]
+  except OSError:
+    return False
+  path = os.path.realpath(fn)
+  best = ''
+  fstype = None
+  for mountpoint,mtype in mounts:
+    mountpoint = mountpoint.replace('\\040', ' ')
+    if (path == mountpoint or path.startswith(mountpoint.rstrip('/') + '/')) and len(mountpoint) >= len(best):
+      best,fstype = mountpoint,mtype
+  return fstype in networkfstypes
+
+
+class GameDB(object):
+  '''Opens (creating if needed) the game history at fn. Games with the same stamp, opponent
+     and deck replace each other, so importing or rebuilding the same games twice is harmless.
+     add() only queues the game, a background thread writes it. flush() waits for that and
+     close() writes whatever is left.'''
+  def __init__(self, fn = defaultdb):
+    self.fn = fn
+    # For connections made on other threads, which may run after a chdir.
+    self.path = os.path.abspath(fn)
+    self.conn = sqlite3.connect(fn, timeout = 30)
+    # The tracker writes while ftlv reads, WAL lets them do that without waiting on each other.
+    # Its locking needs memory shared between processes though, so not on network filesystems
+    # (home directories often are), and a rollback journal is used there.
+    self.journal = 'delete'
+    if not networkFS(fn):
+      try:
+        self.journal = self.conn.execute('PRAGMA journal_mode=WAL').fetchone()[0].lower()
+      except sqlite3.OperationalError:
+        pass
+    if self.journal != 'wal':
+      self.journal = self.conn.execute('PRAGMA journal_mode=DELETE').fetchone()[0].lower()
+    self.migrate()
+    self.conn.executescript(schema.format('games') + indexes)
+    self.insertsql = 'INSERT OR REPLACE INTO games ({0}) VALUES ({1})'.format(', '.join(columns), ', '.join('?' * len(columns)))
+    self.queue = None
+    self.thread = None
+    self.error = None
+
+  def migrate(self):
+    '''Tables made before oname and deckname were NOCASE are copied into one that has them, so
+       LIKE can use their indexes.'''
+    row = self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'games'").fetchone()
+    if row is None or 'oname TEXT NOT NULL COLLATE NOCASE' in row[0]:
+      return
+    with self.conn:
+      self.conn.execute('DROP TABLE IF EXISTS games_new')
+      self.conn.execute(schema.format('games_new'))
+      self.conn.execute('INSERT OR REPLACE INTO games_new SELECT * FROM games ORDER BY id')
+      self.conn.execute('DROP TABLE games')
+      self.conn.execute('ALTER TABLE games_new RENAME TO games')
+
+  def add(self, game):
+    if self.error is not None:
+      raise self.error
+    if self.thread is None:
+      self.queue = queue.Queue()
+      self.thread = threading.Thread(target = self.run, name = 'GameDB({0})'.format(self.fn))
+      self.thread.daemon = True
+      self.thread.start()
+    self.queue.put(game)
+
+  def flush(self):
+    '''Waits for the games added so far to be written.'''
+    if self.thread is not None:
+      done = threading.Event()
+      self.queue.put(done)
+      done.wait()
+    if self.error is not None:
+      raise self.error
+
+  def run(self):
+    # Connections stay on the thread that made them.
+    conn = sqlite3.connect(self.path, timeout = 30)
+    if self.journal == 'wal':
+      # Commits do not wait for the disk, a game is only lost if the machine goes down with it.
+      conn.execute('PRAGMA synchronous=NORMAL')
+    q = self.queue
+    done = False
+    while not done:
+      items = [q.get()]
+      # Everything queued meanwhile goes in the same transaction.
+      while True:
+        try:
+          items.append(q.get_nowait())
+        except queue.Empty:
+          break
+      games = [item for item in items if isinstance(item, dict)]
+      if games:
+        try:
+          with conn:
+            conn.executemany(self.insertsql, (gameRow(game) for game in games))
+        except Exception as e:
+          # Keep draining so add() and flush() never hang, add() reports the error.
+          self.error = e
+      for item in items:
+        if item is None:
+          done = True
+        elif isinstance(item, threading.Event):
+          item.set()
+    conn.close()
+
+  def addMany(self, games):
+    '''Adds games in one transaction, returns how many.'''
+    with self.conn:
+      cur = self.conn.executemany(self.insertsql, (gameRow(game) for game in games))
+    return cur.rowcount
+
+  def importLog(self, fp):
+    '''Adds every game from a gamelog (one JSON record per line), returns how many.'''
+    return self.addMany(json.loads(line) for line in fp if line.strip())
+
+  def query(self, since = None, until = None, opponent = None, deck = None, mmode = None, omode = None,
+            victory = None, first = None, limit = None, newest = False):
+    '''Yields gamelog records matching all the given filters, oldest first unless newest is set.
+       since/until are stamp prefixes (for example 2017 or 20170714), until is inclusive.
+       opponent and deck match case insensitively and may use % wildcards.'''
+    where = []
+    params = []
+    if since is not None:
+      where.append('stamp >= ?')
+      params.append(since)
+    if until is not None:
+      # Any stamp starting with until sorts below until + DEL.
+      where.append('stamp < ?')
+      params.append(until + '\x7f')
+    if opponent is not None:
+      where.append('oname LIKE ?' if '%' in opponent else 'oname = ? COLLATE NOCASE')
+      params.append(opponent)
+    if deck is not None:
+      where.append('deckname LIKE ?' if '%' in deck else 'deckname = ? COLLATE NOCASE')
+      params.append(deck)
+    if mmode is not None:
+      where.append('mmode = ?')
+      params.append(mmode)
+    if omode is not None:
+      where.append('omode = ?')
+      params.append(omode)
+    if victory is not None:
+      where.append('victory = ?')
+      params.append(int(bool(victory)))
+    if first is not None:
+      where.append('first = ?')
+      params.append(int(bool(first)))
+    sql = 'SELECT record FROM games'
+    if where:
+      sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY stamp DESC, id DESC' if newest else ' ORDER BY stamp, id'
+    if limit is not None:
+      sql += ' LIMIT ?'
+      params.append(int(limit))
+    for record, in self.conn.execute(sql, params):
+      yield json.loads(record)
+
+  def opponentDecks(self, upto = None):
+    '''Yields the revealed opponent deck (gamelog ocards) of every game, oldest first. With upto
+       only of the games with an id up to it.'''
+    sql = "SELECT json_extract(record, '$.opponent.deck') FROM games"
+    params = ()
+    if upto is not None:
+      sql += ' WHERE id <= ?'
+      params = (upto,)
+    for deck, in self.conn.execute(sql + ' ORDER BY stamp, id', params):
+      if deck:
+        yield json.loads(deck)
+
+  def ids(self):
+    return [gid for gid, in self.conn.execute('SELECT id FROM games')]
+
+  def opponentGames(self, after = 0):
+    '''Yields (id, deckname, victory, revealed opponent deck, opponent lands) for every game with
+       an id above after, by id. Replaced games get a new id, so they come up again.'''
+    sql = ("SELECT id, deckname, victory, json_extract(record, '$.opponent.deck'), json_extract(record, '$.opponent.lands')"
+           " FROM games WHERE id > ? ORDER BY id")
+    for gid,deckname,victory,deck,lands in self.conn.execute(sql, (after,)):
+      yield gid, deckname, bool(victory), json.loads(deck) if deck else [], json.loads(lands) if lands else {}
+
+  def count(self):
+    return self.conn.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+  def lastId(self):
+    return self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM games').fetchone()[0]
+
+  def close(self):
+    if self.thread is not None:
+      self.queue.put(None)
+      self.thread.join()
+      self.thread = None
+    self.conn.close()
+    if self.error is not None:
+      raise self.error
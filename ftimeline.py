@@ -0,0 +1,137 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Game timelines for post-game review: a keyframe (the tracker checkpoint of
+# the game, without the account's decks) at the start of the game and every
+# few turns, and between them the small changes each event made. Any point
+# in the game is rebuilt from the nearest keyframe before it.
+#
+# Changes are lists, applied to the checkpoint's game:
+#   ['p', pnum, field, value]                          player field (index into the checkpoint player)
+#   ['c', pnum, cardid, quantity, hquantity, generated] deck card
+#   ['g', gcid, pnum, typ, cardid]                     game card created
+#   ['t', turn, currpnum]                              new turn
+
+
+import bisect
+import json
+
+
+class Timeline(object):
+  __slots__ = ('keyevery', 'keyframes', 'keypos', 'events', 'turns', 'last')
+  def __init__(self, keyevery = 4):
+    self.keyevery = keyevery
+    # Keyframes as JSON text, keypos[n] is how many events keyframes[n] already includes.
+    self.keyframes = []
+    self.keypos = []
+    # [cmd, changes]
+    self.events = []
+    # Turn -> index of its newturn event.
+    self.turns = {}
+    # What the recorder last saw, only used while recording.
+    self.last = {}
+
+  def keyframe(self, state):
+    self.keyframes.append(json.dumps(state, separators = (',', ':')))
+    self.keypos.append(len(self.events))
+
+  def event(self, cmd, changes):
+    '''Adds the changes made by one command, a new turn must be the only change of its event.'''
+    if changes[0][0] == 't':
+      self.turns[changes[0][1]] = len(self.events)
+    self.events.append([cmd, changes])
+
+  def __len__(self):
+    return len(self.events)
+
+  def stateAt(self, event = None, turn = None):
+    '''Returns the checkpoint right after event number event, or at the start of turn, or at the end
+       if neither is given. Tracker.restore() takes it as it is.'''
+    if turn is not None:
+      event = self.turns[turn]
+    elif event is None:
+      event = len(self.events) - 1
+    if event < -1 or event >= len(self.events):
+      raise IndexError('Timeline:stateAt: No event {0}'.format(event))
+    k = bisect.bisect_right(self.keypos, event + 1) - 1
+    state = json.loads(self.keyframes[k])
+    applyChanges(state['game'], self.events[self.keypos[k]:event + 1])
+    return state
+
+  def todict(self):
+    return { 'keyevery': self.keyevery, 'keyframes': [[pos, json.loads(kf)] for pos,kf in zip(self.keypos, self.keyframes)],
+             'events': self.events }
+
+  @classmethod
+  def fromdict(cls, d):
+    result = cls(d['keyevery'])
+    result.events = d['events']
+    for pos,state in d['keyframes']:
+      result.keypos.append(pos)
+      result.keyframes.append(json.dumps(state, separators = (',', ':')))
+    for n,(cmd,changes) in enumerate(result.events):
+      if changes[0][0] == 't':
+        result.turns[changes[0][1]] = n
+    return result
+
+
+def applyChanges(game, events):
+  players = dict((p[0], p) for p in game['players'])
+  base = None
+  for cmd,changes in events:
+    for change in changes:
+      kind = change[0]
+      if kind == 'p':
+        players[change[1]][change[2]] = change[3]
+      elif kind == 'c':
+        _,pnum,cardid,quantity,hquantity,generated = change
+        dstate = players[pnum][8]
+        entry = [cardid, quantity, hquantity, generated]
+        if dstate[0] == 'game':
+          own = dstate[1]
+          for n,dc in enumerate(own):
+            if dc[0] == cardid:
+              own[n] = entry
+              break
+          else:
+            own.append(entry)
+            if base is None:
+              base = set(dc[0] for dc in game['inideck'][2])
+            if cardid not in base and cardid not in dstate[2]:
+              dstate[2].append(cardid)
+        else:
+          cards = dstate[3]
+          for n,dc in enumerate(cards):
+            if dc[0] == cardid:
+              cards[n] = entry
+              break
+          else:
+            cards.append(entry)
+      elif kind == 'g':
+        game['gamecards'].append(change[1:])
+      elif kind == 't':
+        game['attrs']['turn'] = change[1]
+        game['attrs']['currpnum'] = change[2]
+
+
+def loadTimelines(fp):
+  '''Yields (record, Timeline) for every game in a timeline log as written by the tracker.'''
+  for line in fp:
+    if line.strip():
+      record = json.loads(line)
+      yield record, Timeline.fromdict(record['timeline'])
@@ -0,0 +1,264 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Reads many capture streams at once on one asyncio loop, standard library only.
+#
+#   tcp:[HOST:]PORT  listen (on 127.0.0.1 unless HOST is given), one stream per connection
+#   unix:PATH        listen on a unix socket, one stream per connection
+#   fifo:PATH        named pipe, kept open across writers coming and going
+#   file:PATH        regular file, followed as it is appended to (like tail -f)
+#   PATH             fifo: or file: depending on what it is
+#
+# Any of them can be prefixed with LABEL= to name its stream(s), otherwise the
+# name comes from the path or the peer address. Every stream gets its own sink
+# from newsource(label): an object with feed(data) for each chunk of bytes read
+# and close() at the end of the stream. Data is handed over a chunk at a time as
+# it arrives, so a source that is slow (or quiet) never holds up the others.
+#
+# Given an offsetsfn, how far each followed file has been read is saved there and
+# a file that is still the same one is carried on from there next time instead of
+# read again from the start. A sink with an unread() method returning how many of
+# the bytes fed to it it has not acted on yet is resumed that many bytes earlier,
+# and is closed with close(False) when it is only stopped there: it drops those
+# bytes rather than acting on them, they will be fed to it again. What that
+# close(False) returns (JSON safe) is saved with the offset and given to the
+# sink's resume() when the file is carried on from there.
+
+
+import asyncio
+import json
+import os
+import os.path
+import re
+import stat
+
+
+re_label = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def parseSpec(spec):
+  '''Returns (label or None, kind, target) for a source given on the command line.'''
+  label = None
+  name,eq,rest = spec.partition('=')
+  if eq and re_label.search(name) is None and name:
+    label,spec = name,rest
+  kind,colon,target = spec.partition(':')
+  if colon and kind in ('tcp', 'unix', 'fifo', 'file'):
+    if kind == 'tcp':
+      host,_,port = target.rpartition(':')
+      if not port.isdigit():
+        raise ValueError('Ingest:parseSpec: Bad port in {0}'.format(spec))
+      target = (host or '127.0.0.1', int(port))
+    return label, kind, target
+  try:
+    mode = os.stat(spec).st_mode
+  except OSError:
+    raise ValueError('Ingest:parseSpec: No such source: {0}'.format(spec))
+  return label, 'fifo' if stat.S_ISFIFO(mode) else 'file', spec
+
+
+def loadOffsets(fn):
+  '''Returns the {path: [inode, offset]} saved in fn, nothing if it is missing or unreadable.'''
+  try:
+    with open(fn, 'r') as fp:
+      offsets = json.load(fp)
+  except (OSError, ValueError):
+    return {}
+  return offsets if isinstance(offsets, dict) else {}
+
+
+def pathLabel(path):
+  return re_label.sub('_', os.path.basename(path).split('.')[0]) or 'source'
+
+
+class Ingest(object):
+  def __init__(self, specs, newsource, chunksize = 65536, pollinterval = 0.5, offsetsfn = None,
+               fromstart = False, saveinterval = 5.0):
+    self.specs = [parseSpec(spec) for spec in specs]
+    self.newsource = newsource
+    self.chunksize = chunksize
+    self.pollinterval = pollinterval
+    # Path -> [inode, offset] of the followed files, saved to offsetsfn at most every saveinterval
+    # seconds and when a file is closed. fromstart ignores what was saved before.
+    self.offsetsfn = offsetsfn
+    self.offsets = loadOffsets(offsetsfn) if offsetsfn is not None and not fromstart else {}
+    self.saveinterval = saveinterval
+    self.savedat = 0.0
+    self.dirty = False
+    # Label -> sink of the streams currently open, a second stream with the same name gets a suffix.
+    self.active = {}
+    self.servers = []
+
+  def run(self):
+    '''Reads until every source has ended, which for sockets and followed files is never,
+       or until interrupted. Every stream is closed either way.'''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+      loop.run_until_complete(self.main())
+    finally:
+      for server in self.servers:
+        server.close()
+      # Cancelled readers close their streams on the way out.
+      pending = asyncio.all_tasks(loop)
+      for task in pending:
+        task.cancel()
+      loop.run_until_complete(asyncio.gather(*pending, return_exceptions = True))
+      for name,source in list(self.active.items()):
+        self.close(name, source)
+      for label,kind,target in self.specs:
+        if kind == 'unix' and os.path.exists(target) and stat.S_ISSOCK(os.stat(target).st_mode):
+          os.remove(target)
+      loop.close()
+
+  async def main(self):
+    tasks = []
+    for label,kind,target in self.specs:
+      if kind == 'tcp':
+        self.servers.append(await asyncio.start_server(self.connection(label), target[0], target[1]))
+      elif kind == 'unix':
+        if os.path.exists(target) and stat.S_ISSOCK(os.stat(target).st_mode):
+          os.remove(target)
+        self.servers.append(await asyncio.start_unix_server(self.connection(label or pathLabel(target)), target))
+      elif kind == 'fifo':
+        tasks.append(asyncio.ensure_future(self.readFifo(label or pathLabel(target), target)))
+      else:
+        tasks.append(asyncio.ensure_future(self.followFile(label or pathLabel(target), target)))
+    if self.servers:
+      # Listening keeps the loop going for good.
+      await asyncio.Event().wait()
+    elif tasks:
+      await asyncio.gather(*tasks)
+
+  def open(self, label):
+    name = label
+    n = 1
+    while name in self.active:
+      n += 1
+      name = '{0}_{1}'.format(label, n)
+    source = self.newsource(name)
+    self.active[name] = source
+    return name, source
+
+  def close(self, name, source, complete = True):
+    if self.active.pop(name, None) is not None:
+      if complete:
+        return source.close()
+      return source.close(False)
+    return None
+
+  def connection(self, label):
+    async def handle(reader, writer):
+      name = label
+      if name is None:
+        peer = writer.get_extra_info('peername')
+        name = re_label.sub('_', peer[0]) if isinstance(peer, tuple) else 'unix'
+      name,source = self.open(name)
+      try:
+        while True:
+          data = await reader.read(self.chunksize)
+          if not data:
+            break
+          source.feed(data)
+      except ConnectionError:
+        pass
+      finally:
+        self.close(name, source)
+        writer.close()
+    return handle
+
+  async def readFifo(self, label, path):
+    loop = asyncio.get_event_loop()
+    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    # Holding a write end too means there is always a writer, so a capture that exits and is
+    # started again later just carries on instead of ending the stream.
+    wfd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+    reader = asyncio.StreamReader(limit = self.chunksize)
+    transport,_ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, 'rb', 0))
+    name,source = self.open(label)
+    try:
+      while True:
+        data = await reader.read(self.chunksize)
+        if not data:
+          break
+        source.feed(data)
+    finally:
+      self.close(name, source)
+      transport.close()
+      os.close(wfd)
+
+  def saveOffsets(self, force = False):
+    if self.offsetsfn is None or not (self.dirty or force):
+      return
+    now = asyncio.get_event_loop().time()
+    if not force and now - self.savedat < self.saveinterval:
+      return
+    self.savedat = now
+    self.dirty = False
+    tmpfn = self.offsetsfn + '.tmp'
+    with open(tmpfn, 'w') as fp:
+      json.dump(self.offsets, fp)
+    os.replace(tmpfn, self.offsetsfn)
+
+  async def followFile(self, label, path):
+    '''Reads path from where it was left off (see offsetsfn) or the start, and then whatever is appended
+       to it, polling for more. Starts over if the file is truncated or replaced.'''
+    key = os.path.abspath(path)
+    name,source = self.open(label)
+    unread = getattr(source, 'unread', None)
+    fp = open(path, 'rb')
+    st = os.fstat(fp.fileno())
+    ino = st.st_ino
+    saved = self.offsets.get(key)
+    if saved is not None and saved[0] == ino and saved[1] <= st.st_size:
+      fp.seek(saved[1])
+      if len(saved) > 2 and saved[2] is not None and hasattr(source, 'resume'):
+        source.resume(saved[2])
+    try:
+      while True:
+        data = fp.read(self.chunksize)
+        if data:
+          source.feed(data)
+          self.offsets[key] = [ino, fp.tell() - (unread() if unread is not None else 0)]
+          self.dirty = True
+          self.saveOffsets()
+          # Let the other sources in before the next chunk.
+          await asyncio.sleep(0)
+          continue
+        await asyncio.sleep(self.pollinterval)
+        # What came in last may not have been saved yet.
+        self.saveOffsets()
+        try:
+          st = os.stat(path)
+        except FileNotFoundError:
+          continue
+        if st.st_ino != os.fstat(fp.fileno()).st_ino or st.st_size < fp.tell():
+          fp.close()
+          fp = open(path, 'rb')
+          ino = os.fstat(fp.fileno()).st_ino
+          self.offsets[key] = [ino, 0]
+          self.dirty = True
+    finally:
+      if unread is not None:
+        offset = fp.tell() - unread()
+        self.offsets[key] = [ino, offset, self.close(name, source, False)]
+      else:
+        self.close(name, source)
+        self.offsets[key] = [ino, fp.tell()]
+      fp.close()
+      self.saveOffsets(True)
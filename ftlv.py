@@ -16,8 +16,15 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import concurrent.futures
+import glob
 import json
+import math
+import os
 import sys
+import time
+
+import ftdb
 
 def prettylands(l):
   if l is None:
@@ -26,36 +33,361 @@ def prettylands(l):
 
 
 modetranslate = { 'COMPETITIVE': 'R', 'CASUAL': 'C' }
+modeuntranslate = dict((v, k) for k,v in modetranslate.items())
 fmt = '{stamp: <13s}  {victory: <3s}  {first: <4s}  {mode: >4} {oeco: >5}  {meco: >5}  {olands: <14s}  {mlands: <14s}  {dname: <15s}  {orank: <5s}  {oname: <20s}'
 fmtshow = { 'stamp': '** Timestamp', 'victory': 'W/L', 'first': '1st', 'mode': 'mode', 'oeco': 'oeco', 'meco': 'meco', 'mlands': 'mlands', 'olands': 'olands', 'dname': 'deckname', 'orank': 'orank', 'oname': 'oname' }
-def main():
-  ln = 0
-  for l in sys.stdin:
-    if ln % 10 == 0:
-      if ln != 0:
+
+def formatGame(le):
+  if le['opponent']['grank'] != '0':
+    orank = '#{0}'.format(le['opponent']['grank'])
+  else:
+    orank = 'R{0}'.format(le['opponent']['rank'])
+  oname = le['opponent']['name']
+  args = {
+    'stamp': le['stamp'][:13],
+    'victory': 'W' if le['victory'] else 'L',
+    'first': 'F' if le['first'] else 'S',
+    'oeco': le['opponent']['eco'],
+    'meco': le['me']['eco'],
+    'olands': prettylands(le['opponent'].get('lands')),
+    'mlands': prettylands(le['me'].get('lands')),
+    'dname': le['me']['deckname'][:15],
+    'mode': '{0}v{1}'.format(modetranslate.get(le['me']['mode'], '?'), modetranslate.get(le['opponent']['mode'], '?')),
+    'orank': orank,
+    'oname': oname[:20],
+  }
+  return fmt.format(**args)
+
+class GameTable(object):
+  '''Prints games as rows, with the header repeated every 10.'''
+  def __init__(self):
+    self.ln = 0
+
+  def add(self, le):
+    if self.ln % 10 == 0:
+      if self.ln != 0:
         print('')
       print(fmt.format(**fmtshow))
-    ln = ln + 1
-    le = json.loads(l)
-    if le['opponent']['grank'] != '0':
-      orank = '#{0}'.format(le['opponent']['grank'])
-    else:
-      orank = 'R{0}'.format(le['opponent']['rank'])
-    oname = le['opponent']['name']
-    args = {
-      'stamp': le['stamp'][:13],
-      'victory': 'W' if le['victory'] else 'L',
-      'first': 'F' if le['first'] else 'S',
-      'oeco': le['opponent']['eco'],
-      'meco': le['me']['eco'],
-      'olands': prettylands(le['opponent'].get('lands')),
-      'mlands': prettylands(le['me'].get('lands')),
-      'dname': le['me']['deckname'][:15],
-      'mode': '{0}v{1}'.format(modetranslate.get(le['me']['mode'], '?'), modetranslate.get(le['opponent']['mode'], '?')),
-      'orank': orank,
-      'oname': oname[:20],
-    }
-    print(fmt.format(**args))
+    self.ln = self.ln + 1
+    print(formatGame(le))
+
+def printGames(games):
+  table = GameTable()
+  for le in games:
+    table.add(le)
+
+def runImport(args):
+  dbname = ftdb.defaultdb
+  fns = []
+  while args:
+    arg = args.pop(0)
+    if arg == '--db':
+      dbname = args.pop(0)
+    else:
+      fns.append(arg)
+  gamedb = ftdb.GameDB(dbname)
+  for fn in fns:
+    with open(fn, 'r') as fp:
+      print('- Imported {0} game(s) from {1}'.format(gamedb.importLog(fp), fn))
+  print('- {0} game(s) in {1}'.format(gamedb.count(), dbname))
+  gamedb.close()
+
+def runQuery(args):
+  dbname = ftdb.defaultdb
+  filters = {}
+  last = None
+  while args:
+    arg = args.pop(0)
+    if arg == '--db':
+      dbname = args.pop(0)
+    elif arg in ('--since', '--until', '--opponent', '--deck'):
+      filters[arg[2:]] = args.pop(0)
+    elif arg == '--mode':
+      # RvC style as shown in the mode column, ? matches any.
+      value = args.pop(0)
+      mode = value.upper().split('V')
+      if len(mode) != 2:
+        raise ValueError('ftlv: Bad --mode {0}, expected something like RvC or ?vR'.format(value))
+      filters['mmode'] = modeuntranslate.get(mode[0])
+      filters['omode'] = modeuntranslate.get(mode[1])
+    elif arg in ('--won', '--lost'):
+      filters['victory'] = arg == '--won'
+    elif arg in ('--first', '--second'):
+      filters['first'] = arg == '--first'
+    elif arg == '--last':
+      last = int(args.pop(0))
+    else:
+      raise ValueError('ftlv: Unknown argument {0}'.format(arg))
+  gamedb = ftdb.GameDB(dbname)
+  if last is None:
+    printGames(gamedb.query(**filters))
+  else:
+    printGames(reversed(list(gamedb.query(limit = last, newest = True, **filters))))
+  gamedb.close()
+
+# Stats are kept per (group, value) as [games, wins, turns, my eco, opponent eco] sums so
+# partial results from different files just add up.
+statgroups = ('all', 'deck', 'order', 'omode', 'rank')
+
+def rankBand(opp):
+  rank = opp.get('rank')
+  grank = opp.get('grank')
+  # Same as the tracker: both ranks 0 is a CPU opponent, '?' is a rank that was never sent.
+  if rank == '0' and grank == '0':
+    return 'CPU'
+  if grank in (None, '', '?'):
+    return 'Unknown'
+  if grank != '0':
+    return 'Legend'
+  try:
+    rank = int(rank)
+  except (TypeError, ValueError):
+    return 'Unknown'
+  if rank < 1:
+    return 'Unknown'
+  low = ((rank - 1) // 5) * 5 + 1
+  return 'R{0}-{1}'.format(low, low + 4)
+
+def addGameStats(partial, le):
+  keys = (
+    ('all', 'All games'),
+    ('deck', le['me']['deckname']),
+    ('order', 'First' if le['first'] else 'Second'),
+    ('omode', le['opponent']['mode'] or '?'),
+    ('rank', rankBand(le['opponent'])),
+    )
+  win = 1 if le['victory'] else 0
+  turn = le.get('turn') or 0
+  meco = le['me'].get('eco') or 0
+  oeco = le['opponent'].get('eco') or 0
+  for key in keys:
+    acc = partial.get(key)
+    if acc is None:
+      partial[key] = [1, win, turn, meco, oeco]
+    else:
+      acc[0] += 1
+      acc[1] += win
+      acc[2] += turn
+      acc[3] += meco
+      acc[4] += oeco
+
+def fileStats(fn):
+  '''Partial stats for one gamelog file. Runs in a worker process.'''
+  partial = {}
+  with open(fn, 'r') as fp:
+    for l in fp:
+      if l.strip():
+        addGameStats(partial, json.loads(l))
+  return partial
+
+def mergeStats(total, partial):
+  for key,acc in partial.items():
+    tacc = total.get(key)
+    if tacc is None:
+      total[key] = list(acc)
+    else:
+      for i,v in enumerate(acc):
+        tacc[i] += v
+  return total
+
+def wilson(wins, games, z = 1.96):
+  '''95% Wilson score interval for a win rate, as (low, high).'''
+  if games == 0:
+    return (0.0, 0.0)
+  p = wins / float(games)
+  denom = 1 + z * z / games
+  centre = p + z * z / (2 * games)
+  spread = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games))
+  return ((centre - spread) / denom, (centre + spread) / denom)
+
+statfmt = '{name: <24s}  {games: >6}  {wins: >6}  {rate: >6}  {ci: >13}  {turn: >6}  {meco: >6}  {oeco: >6}'
+statshow = { 'name': '', 'games': 'games', 'wins': 'wins', 'rate': 'win%', 'ci': '95% CI', 'turn': 'turn', 'meco': 'meco', 'oeco': 'oeco' }
+stattitles = { 'all': 'Overall', 'deck': 'By deck', 'order': 'By first/second', 'omode': 'By opponent mode', 'rank': 'By opponent rank' }
+
+def printStats(total):
+  for group in statgroups:
+    rows = sorted(((value, acc) for (g, value),acc in total.items() if g == group), key = lambda r: (-r[1][0], r[0]))
+    if not rows:
+      continue
+    statshow['name'] = '** {0}'.format(stattitles[group])
+    print(statfmt.format(**statshow))
+    for value,(games, wins, turns, meco, oeco) in rows:
+      low,high = wilson(wins, games)
+      print(statfmt.format(name = str(value)[:24], games = games, wins = wins,
+        rate = '{0:.1f}'.format(100.0 * wins / games), ci = '{0:.1f}-{1:.1f}'.format(100.0 * low, 100.0 * high),
+        turn = '{0:.1f}'.format(turns / float(games)), meco = '{0:.1f}'.format(meco / float(games)),
+        oeco = '{0:.1f}'.format(oeco / float(games))))
+    print('')
+
+def runStats(args):
+  jobs = os.cpu_count() or 1
+  fns = []
+  while args:
+    arg = args.pop(0)
+    if arg == '--jobs':
+      jobs = int(args.pop(0))
+    else:
+      # Globs are expanded here too, for shells that do not (or lists too long for them).
+      matched = sorted(glob.glob(arg)) if glob.has_magic(arg) else [arg]
+      fns.extend(matched)
+  total = {}
+  if jobs > 1 and len(fns) > 1:
+    with concurrent.futures.ProcessPoolExecutor(min(jobs, len(fns))) as pool:
+      for partial in pool.map(fileStats, fns, chunksize = max(1, len(fns) // (jobs * 4))):
+        mergeStats(total, partial)
+  else:
+    for fn in fns:
+      mergeStats(total, fileStats(fn))
+  print('* {0} game(s) from {1} file(s)\n'.format(total.get(('all', 'All games'), [0])[0], len(fns)))
+  printStats(total)
+
+class GamelogTail(object):
+  '''Follows the daily gamelogs in logdir, only reading what was appended since the last poll.
+     The tracker keeps writing to the file for the day it started on, so after midnight both
+     yesterday's and today's files are followed.'''
+  def __init__(self, logdir = 'logs'):
+    self.logdir = logdir
+    # fn -> [offset, partial line]
+    self.files = {}
+    self.day = None
+
+  def gamelog(self, day):
+    return os.path.join(self.logdir, 'faeriatrack_gamelog_{0}.log'.format(day))
+
+  def poll(self):
+    '''Returns the games appended since the last call.'''
+    day = time.strftime('%Y%m%d')
+    if day != self.day:
+      fn = self.gamelog(day)
+      self.files = dict((k, v) for k,v in self.files.items() if k == self.gamelog(self.day))
+      self.files.setdefault(fn, [0, b''])
+      self.day = day
+    games = []
+    for fn,state in self.files.items():
+      try:
+        size = os.path.getsize(fn)
+      except OSError:
+        continue
+      if size < state[0]:
+        # Replaced (for example by rebuild), start over.
+        state[0] = 0
+        state[1] = b''
+      if size == state[0]:
+        continue
+      with open(fn, 'rb') as fp:
+        fp.seek(state[0])
+        data = fp.read(size - state[0])
+      state[0] += len(data)
+      lines = (state[1] + data).split(b'\n')
+      # The last piece is a line still being written (or empty).
+      state[1] = lines.pop()
+      games.extend(json.loads(l.decode('utf-8')) for l in lines if l.strip())
+    return games
+
+def runFollow(args):
+  logdir = 'logs'
+  interval = 2.0
+  while args:
+    arg = args.pop(0)
+    if arg == '--logs':
+      logdir = args.pop(0)
+    elif arg == '--interval':
+      interval = float(args.pop(0))
+    else:
+      raise ValueError('ftlv: Unknown argument {0}'.format(arg))
+  tail = GamelogTail(logdir)
+  table = GameTable()
+  session = {}
+  try:
+    while True:
+      games = tail.poll()
+      for le in games:
+        table.add(le)
+        addGameStats(session, le)
+      if games:
+        played,wins,turns,meco,oeco = session[('all', 'All games')]
+        print('- {0}W {1}L ({2:.1f}%), avg turn {3:.1f}, eco {4:.1f} vs {5:.1f}'.format(
+          wins, played - wins, 100.0 * wins / played, turns / float(played), meco / float(played), oeco / float(played)))
+        sys.stdout.flush()
+      time.sleep(interval)
+  except KeyboardInterrupt:
+    pass
+
+archfmt = '{name: <24s}  {games: >6}  {wins: >6}  {rate: >6}  {ci: >13}'
+
+def runArchetypes(args):
+  # NumPy is only needed here.
+  import ftarchetype
+  dbname = ftdb.defaultdb
+  cachename = ftarchetype.defaultcache
+  k = 8
+  mincards = 4
+  rebuild = False
+  while args:
+    arg = args.pop(0)
+    if arg == '--db':
+      dbname = args.pop(0)
+    elif arg == '--cache':
+      cachename = args.pop(0)
+    elif arg == '--k':
+      k = int(args.pop(0))
+    elif arg == '--min-cards':
+      mincards = int(args.pop(0))
+    elif arg == '--rebuild':
+      rebuild = True
+    else:
+      raise ValueError('ftlv: Unknown argument {0}'.format(arg))
+  started = time.time()
+  matrix = ftarchetype.GameMatrix() if rebuild else ftarchetype.GameMatrix.load(cachename)
+  gamedb = ftdb.GameDB(dbname)
+  matrix.update(gamedb)
+  gamedb.close()
+  labels,centres = ftarchetype.archetypes(matrix, k, mincards)
+  matrix.save(cachename)
+  print('* {0} game(s), {1} card(s) seen, {2} new and {3} dropped since the last run, {4:.2f}s\n'.format(
+    len(matrix), len(matrix.cardids), matrix.added, matrix.dropped, time.time() - started))
+  for n,entry in enumerate(ftarchetype.matchups(matrix, labels, centres)):
+    if entry['cards']:
+      lands = ' '.join('{0} {1:.0f}%'.format(name, 100.0 * share) for name,share in entry['lands'])
+      title = '** {0}. {1}{2}'.format(n + 1, ', '.join(entry['cards']), ' ({0})'.format(lands) if lands else '')
+    else:
+      title = '** Fewer than {0} cards seen'.format(mincards)
+    print(title)
+    print(archfmt.format(name = '', games = 'games', wins = 'wins', rate = 'win%', ci = '95% CI'))
+    rows = [('All', entry['games'], entry['wins'])] + entry['decks']
+    for name,games,wins in rows:
+      low,high = wilson(wins, games)
+      print(archfmt.format(name = str(name)[:24], games = games, wins = wins,
+        rate = '{0:.1f}'.format(100.0 * wins / games), ci = '{0:.1f}-{1:.1f}'.format(100.0 * low, 100.0 * high)))
+    print('')
+
+usage = '''Usage: python3 ftlv.py < logs/faeriatrack_gamelog_YYYYMMDD.log
+       python3 ftlv.py import [--db FILE] logs/faeriatrack_gamelog_*.log
+       python3 ftlv.py query [--db FILE] [--since STAMP] [--until STAMP] [--opponent NAME] [--deck NAME]
+                             [--mode RvC] [--won|--lost] [--first|--second] [--last N]
+       python3 ftlv.py --follow [--logs DIR] [--interval SECONDS]
+       python3 ftlv.py stats [--jobs N] 'logs/faeriatrack_gamelog_2017*.log' ...
+       python3 ftlv.py archetypes [--db FILE] [--cache FILE] [--k N] [--min-cards N] [--rebuild]
+
+STAMP is a prefix like 2017, 201707 or 20170714T02. NAME matches case insensitively, % is a wildcard.
+The database defaults to {0}. archetypes needs NumPy and caches its work in logs/faeriatrack_archetypes.npz.'''.format(ftdb.defaultdb)
+
+def main():
+  args = sys.argv[1:]
+  if not args:
+    printGames(json.loads(l) for l in sys.stdin)
+  elif args[0] == 'import':
+    runImport(args[1:])
+  elif args[0] == 'query':
+    runQuery(args[1:])
+  elif args[0] == 'stats':
+    runStats(args[1:])
+  elif args[0] == 'archetypes':
+    runArchetypes(args[1:])
+  elif args[0] == '--follow':
+    runFollow(args[1:])
+  else:
+    print(usage)
 
 if __name__ == '__main__':
   main()
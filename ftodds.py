@@ -0,0 +1,87 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Draw odds: the chance of drawing at least one of K copies within the next
+# k draws from a deck of N cards (hypergeometric, without replacement).
+# Hand contents and mulligans only matter through N and K: cards in hand are
+# not in the deck and a mulliganed card is moved back to it, which the
+# tracker already counts.
+
+
+import functools
+
+
+@functools.lru_cache(maxsize = 8192)
+def hitChances(decksize, copies, horizons):
+  '''Chance of drawing at least one of copies cards within each of horizons draws from decksize cards.'''
+  if copies <= 0 or decksize <= 0:
+    return tuple(0.0 for _ in horizons)
+  result = []
+  miss = 1.0
+  drawn = 0
+  for k in horizons:
+    # P(no copy in k draws) = prod (N - K - i) / (N - i), extended one draw at a time.
+    while drawn < k:
+      if drawn >= decksize - copies:
+        miss = 0.0
+        break
+      miss *= float(decksize - copies - drawn) / float(decksize - drawn)
+      drawn += 1
+    result.append(1.0 - miss)
+  return tuple(result)
+
+
+@functools.lru_cache(maxsize = 8192)
+def chanceText(decksize, copies, horizons):
+  parts = []
+  for chance in hitChances(decksize, copies, horizons):
+    perc = int(chance * 100.0)
+    parts.append('NX' if perc >= 100 else '{0: >2d}'.format(perc))
+  return '/'.join(parts)
+
+
+class DrawOdds(object):
+  '''Per game draw odds for display. Remembers the deck size and copy count each card was last
+     shown with and only looks its odds up again when one of them changed.'''
+  __slots__ = ('horizons', 'shown')
+  def __init__(self, horizons = (1,)):
+    self.horizons = tuple(horizons)
+    self.shown = {}
+
+  def width(self):
+    '''Characters taken by cardText().'''
+    return 3 * len(self.horizons) - 1
+
+  def cardText(self, key, decksize, copies):
+    shown = self.shown.get(key)
+    if shown is not None and shown[0] == decksize and shown[1] == copies:
+      return shown[2]
+    text = chanceText(decksize, copies, self.horizons)
+    self.shown[key] = (decksize, copies, text)
+    return text
+
+  def groupText(self, key, decksize, copies):
+    '''cardText() for drawing any card of a group, given the copies of each in the deck.'''
+    return self.cardText(key, decksize, sum(copies))
+
+  def cardChances(self, decksize, copies):
+    return hitChances(decksize, copies, self.horizons)
+
+  def groupChances(self, decksize, copies):
+    '''Chance of drawing at least one card of a group, given the copies of each in the deck.'''
+    return hitChances(decksize, sum(copies), self.horizons)
@@ -0,0 +1,337 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Minimal libpcap/pcapng reader with TCP stream reassembly. Only what the
+# tracker needs: Ethernet/SLL/raw/loopback link types, IPv4/IPv6 and TCP.
+# Works on files and on pipes (for example tcpdump -U -w -).
+
+
+import struct
+import socket
+
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+# Out of order segments held per flow before giving up on the gap.
+MAX_PENDING = 256
+
+# Segments with data held when joining a flow mid stream, the lowest seq among them is where it starts.
+JOIN_SEGMENTS = 4
+
+
+def readExact(fp, size):
+  result = fp.read(size)
+  if not result:
+    return None
+  while len(result) < size:
+    more = fp.read(size - len(result))
+    if not more:
+      raise ValueError('pcap: Truncated capture (wanted {0} bytes, got {1})'.format(size, len(result)))
+    result += more
+  return result
+
+
+def decodeIP(frame, linktype):
+  '''Returns (srcip, srcport, dstip, dstport, seq, flags, payload) or None if the frame is not TCP.'''
+  if linktype == LINKTYPE_ETHERNET:
+    if len(frame) < 14:
+      return None
+    ethertype, = struct.unpack_from('!H', frame, 12)
+    offset = 14
+    while ethertype in (0x8100, 0x88a8) and len(frame) >= offset + 4:
+      ethertype, = struct.unpack_from('!H', frame, offset + 2)
+      offset += 4
+  elif linktype == LINKTYPE_LINUX_SLL:
+    if len(frame) < 16:
+      return None
+    ethertype, = struct.unpack_from('!H', frame, 14)
+    offset = 16
+  elif linktype == LINKTYPE_LINUX_SLL2:
+    if len(frame) < 20:
+      return None
+    ethertype, = struct.unpack_from('!H', frame, 0)
+    offset = 20
+  elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+    if len(frame) < 5:
+      return None
+    offset = 4
+    ethertype = 0x86dd if (frame[4] >> 4) == 6 else 0x0800
+  elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+    if len(frame) < 1:
+      return None
+    offset = 0
+    ethertype = 0x86dd if (frame[0] >> 4) == 6 else 0x0800
+  else:
+    raise ValueError('pcap: Unsupported link type {0}'.format(linktype))
+  if ethertype == 0x0800:
+    if len(frame) < offset + 20:
+      return None
+    vihl = frame[offset]
+    ihl = (vihl & 0x0f) * 4
+    totlen, = struct.unpack_from('!H', frame, offset + 2)
+    if frame[offset + 9] != 6:
+      return None
+    srcip = socket.inet_ntop(socket.AF_INET, frame[offset + 12:offset + 16])
+    dstip = socket.inet_ntop(socket.AF_INET, frame[offset + 16:offset + 20])
+    # totlen trims Ethernet padding; 0 means TSO and the frame length is all we have.
+    end = offset + totlen if totlen else len(frame)
+    offset += ihl
+  elif ethertype == 0x86dd:
+    if len(frame) < offset + 40:
+      return None
+    plen, = struct.unpack_from('!H', frame, offset + 4)
+    if frame[offset + 6] != 6:
+      return None
+    srcip = socket.inet_ntop(socket.AF_INET6, frame[offset + 8:offset + 24])
+    dstip = socket.inet_ntop(socket.AF_INET6, frame[offset + 24:offset + 40])
+    offset += 40
+    end = offset + plen if plen else len(frame)
+  else:
+    return None
+  if len(frame) < offset + 20:
+    return None
+  srcport,dstport,seq,ack,doff,flags = struct.unpack_from('!HHIIBB', frame, offset)
+  offset += (doff >> 4) * 4
+  return (srcip, srcport, dstip, dstport, seq, flags, frame[offset:min(end, len(frame))])
+
+
+def readPcap(fp, header):
+  if header == b'\xd4\xc3\xb2\xa1':
+    endian, tsdiv = '<', 1e6
+  elif header == b'\xa1\xb2\xc3\xd4':
+    endian, tsdiv = '>', 1e6
+  elif header == b'\x4d\x3c\xb2\xa1':
+    endian, tsdiv = '<', 1e9
+  elif header == b'\xa1\xb2\x3c\x4d':
+    endian, tsdiv = '>', 1e9
+  else:
+    raise ValueError('pcap: Unknown capture file magic {0!r}'.format(header))
+  ghdr = readExact(fp, 20)
+  if ghdr is None:
+    return
+  linktype = struct.unpack(endian + 'HHiIII', ghdr)[5] & 0x0fffffff
+  rhdr = struct.Struct(endian + 'IIII')
+  while True:
+    hdr = readExact(fp, 16)
+    if hdr is None:
+      return
+    tssec,tsfrac,caplen,origlen = rhdr.unpack(hdr)
+    frame = readExact(fp, caplen) if caplen else b''
+    if frame is None:
+      return
+    yield (tssec + tsfrac / tsdiv, linktype, frame)
+
+
+def readPcapNG(fp, header):
+  endian = None
+  interfaces = []
+  while True:
+    if header is None:
+      header = readExact(fp, 4)
+      if header is None:
+        return
+    if header == b'\x0a\x0d\x0d\x0a':
+      rest = readExact(fp, 8)
+      bom = rest[4:8]
+      if bom == b'\x4d\x3c\x2b\x1a':
+        endian = '<'
+      elif bom == b'\x1a\x2b\x3c\x4d':
+        endian = '>'
+      else:
+        raise ValueError('pcapng: Bad byte order magic {0!r}'.format(bom))
+      blen, = struct.unpack(endian + 'I', rest[:4])
+      readExact(fp, blen - 12)
+      interfaces = []
+      header = None
+      continue
+    if endian is None:
+      raise ValueError('pcapng: Block before section header')
+    btype, = struct.unpack(endian + 'I', header)
+    blen, = struct.unpack(endian + 'I', readExact(fp, 4))
+    body = readExact(fp, blen - 8)
+    header = None
+    if body is None:
+      return
+    body = body[:-4]
+    if btype == 1:
+      linktype, = struct.unpack_from(endian + 'H', body, 0)
+      tsdiv = 1e6
+      opos = 8
+      while opos + 4 <= len(body):
+        ocode,olen = struct.unpack_from(endian + 'HH', body, opos)
+        if ocode == 0:
+          break
+        if ocode == 9 and olen >= 1:
+          tsresol = body[opos + 4]
+          tsdiv = float(2 ** (tsresol & 0x7f)) if tsresol & 0x80 else float(10 ** tsresol)
+        opos += 4 + ((olen + 3) & ~3)
+      interfaces.append((linktype, tsdiv))
+    elif btype == 6:
+      ifid,tshigh,tslow,caplen,origlen = struct.unpack_from(endian + 'IIIII', body, 0)
+      linktype,tsdiv = interfaces[ifid]
+      yield (((tshigh << 32) | tslow) / tsdiv, linktype, body[20:20 + caplen])
+    elif btype == 3:
+      origlen, = struct.unpack_from(endian + 'I', body, 0)
+      linktype,tsdiv = interfaces[0]
+      yield (None, linktype, body[4:4 + origlen])
+    elif btype == 2:
+      ifid,drops,tshigh,tslow,caplen,origlen = struct.unpack_from(endian + 'HHIIII', body, 0)
+      linktype,tsdiv = interfaces[ifid]
+      yield (((tshigh << 32) | tslow) / tsdiv, linktype, body[20:20 + caplen])
+
+
+def readFrames(fp):
+  '''Yields (timestamp, linktype, frame) from a libpcap or pcapng stream.'''
+  header = readExact(fp, 4)
+  if header is None:
+    return iter(())
+  if header == b'\x0a\x0d\x0d\x0a':
+    return readPcapNG(fp, header)
+  return readPcap(fp, header)
+
+
+def readSegments(fp):
+  '''Yields (timestamp, srcip, srcport, dstip, dstport, seq, flags, payload) for every TCP segment.'''
+  stamp = 0.0
+  for ts,linktype,frame in readFrames(fp):
+    if ts is not None:
+      stamp = ts
+    seg = decodeIP(frame, linktype)
+    if seg is None:
+      continue
+    yield (stamp,) + seg
+
+
+class TCPStream(object):
+  def __init__(self):
+    self.nextseq = None
+    self.pending = {}
+    # (seq, payload) seen before nextseq is known, for flows joined mid stream.
+    self.joining = []
+
+
+class TCPReassembler(object):
+  '''Puts TCP segments back in order per flow. feed() returns the in order payload (possibly empty).
+     ongap(key) is called when data was lost for good and the stream resumes after a hole, and
+     before the first data of a flow joined mid stream, which most likely starts after one too.'''
+  def __init__(self, ongap = None):
+    self.streams = {}
+    self.ongap = ongap
+
+  def feed(self, key, seq, flags, payload):
+    stream = self.streams.get(key)
+    if stream is None:
+      stream = TCPStream()
+      self.streams[key] = stream
+    if flags & TCP_SYN:
+      stream.nextseq = (seq + 1) & 0xffffffff
+      stream.pending = {}
+      stream.joining = []
+      seq = stream.nextseq
+    elif stream.nextseq is None:
+      # Joined mid stream. The first segment seen need not be the first sent after that, so
+      # hold a few and start from the earliest of them.
+      if payload:
+        stream.joining.append((seq, payload))
+      if len(stream.joining) < JOIN_SEGMENTS and not flags & (TCP_FIN | TCP_RST):
+        return b''
+      return self.join(key, stream, flags)
+    result = b''
+    if payload:
+      result = self.add(key, stream, seq, payload)
+    if flags & (TCP_FIN | TCP_RST):
+      del self.streams[key]
+    return result
+
+  def join(self, key, stream, flags):
+    held = stream.joining
+    stream.joining = []
+    result = b''
+    if held:
+      base = held[0][0]
+      stream.nextseq = min((seq for seq,payload in held), key = lambda s: (s - base + 0x80000000) & 0xffffffff)
+      if self.ongap is not None:
+        self.ongap(key)
+      result = b''.join(self.add(key, stream, seq, payload) for seq,payload in held)
+    if flags & (TCP_FIN | TCP_RST):
+      del self.streams[key]
+    return result
+
+  def forget(self, key):
+    self.streams.pop(key, None)
+
+  def add(self, key, stream, seq, payload):
+    delta = (seq - stream.nextseq) & 0xffffffff
+    if delta >= 0x80000000:
+      # Starts before what we already have: retransmit or overlap.
+      skip = 0x100000000 - delta
+      if skip >= len(payload):
+        return b''
+      payload = payload[skip:]
+      delta = 0
+    if delta > 0:
+      if len(stream.pending) >= MAX_PENDING:
+        # Lost a segment for good, resume from the earliest we hold.
+        if self.ongap is not None:
+          self.ongap(key)
+        return self.skipGap(stream, seq, payload)
+      stream.pending[seq] = payload
+      return b''
+    out = [payload]
+    stream.nextseq = (stream.nextseq + len(payload)) & 0xffffffff
+    self.drain(stream, out)
+    return b''.join(out)
+
+  def drain(self, stream, out):
+    pending = stream.pending
+    while pending:
+      payload = pending.pop(stream.nextseq, None)
+      if payload is None:
+        # Drop anything now entirely behind us, trim partial overlaps.
+        for pseq in list(pending):
+          delta = (pseq - stream.nextseq) & 0xffffffff
+          if delta >= 0x80000000:
+            pdata = pending.pop(pseq)
+            skip = 0x100000000 - delta
+            if skip < len(pdata):
+              pending[stream.nextseq] = pdata[skip:]
+        if stream.nextseq not in pending:
+          return
+        continue
+      out.append(payload)
+      stream.nextseq = (stream.nextseq + len(payload)) & 0xffffffff
+
+  def skipGap(self, stream, seq, payload):
+    pending = stream.pending
+    pending[seq] = payload
+    first = min(pending, key = lambda s: (s - stream.nextseq) & 0xffffffff)
+    stream.nextseq = first
+    out = []
+    self.drain(stream, out)
+    return b''.join(out)
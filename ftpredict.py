@@ -0,0 +1,255 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Opponent deck prediction. Every opponent deck seen in past games (the
+# revealed part, 'ocards' in the gamelog) goes into an inverted index from
+# card id to the decks containing it. During a game each card the opponent
+# reveals narrows the candidates to the decks containing the most of them.
+
+
+import collections
+import heapq
+import itertools
+import threading
+
+
+# Most recent candidates the likely cards are counted over.
+MAX_SAMPLE = 200
+
+
+class DeckIndex(object):
+  '''Past opponent decks, identical card sets stored once with a count.'''
+  def __init__(self):
+    # Deck number -> frozenset of card ids, and times seen. Higher numbers were seen later.
+    self.cardsets = []
+    self.times = []
+    self.bycards = {}
+    # Card id -> numbers of the decks containing it, ascending, and their times seen summed.
+    self.index = {}
+    self.weights = {}
+    # False while loadGameDB() is filling it in on its own thread, adds meanwhile wait in queued.
+    self.ready = True
+    self.lock = threading.Lock()
+    self.queued = []
+
+  def add(self, ocards):
+    '''Adds a deck given as gamelog ocards: [quantity, cardid, name] entries.'''
+    if not self.ready:
+      with self.lock:
+        if not self.ready:
+          self.queued.append(ocards)
+          return
+    self.addDeck(ocards)
+
+  def addDeck(self, ocards):
+    cardids = frozenset(c[1] for c in ocards)
+    if not cardids:
+      return
+    weights = self.weights
+    dnum = self.bycards.get(cardids)
+    if dnum is not None:
+      self.times[dnum] += 1
+      for cardid in cardids:
+        weights[cardid] += 1
+      return
+    dnum = len(self.cardsets)
+    self.cardsets.append(cardids)
+    self.times.append(1)
+    self.bycards[cardids] = dnum
+    index = self.index
+    for cardid in cardids:
+      dnums = index.get(cardid)
+      if dnums is None:
+        index[cardid] = dnums = []
+        weights[cardid] = 0
+      dnums.append(dnum)
+      weights[cardid] += 1
+
+  def addGames(self, games):
+    for game in games:
+      self.add(game['opponent']['deck'])
+
+  @classmethod
+  def fromGameDB(cls, gamedb):
+    result = cls()
+    for ocards in gamedb.opponentDecks():
+      result.addDeck(ocards)
+    return result
+
+  @classmethod
+  def loadGameDB(cls, gamedb):
+    '''Like fromGameDB, but returns right away and reads the games on a thread of its own with
+       its own connection. Predictions wait for it (see ready), games added meanwhile go in after.'''
+    import ftdb
+    result = cls()
+    result.ready = False
+    # Games from here on are added as they finish, so the thread stops short of them.
+    upto = gamedb.lastId()
+    def load():
+      try:
+        db = ftdb.GameDB(gamedb.path)
+        try:
+          for ocards in db.opponentDecks(upto):
+            result.addDeck(ocards)
+        finally:
+          db.close()
+      finally:
+        with result.lock:
+          for ocards in result.queued:
+            result.addDeck(ocards)
+          result.queued = []
+          result.ready = True
+    thread = threading.Thread(target = load, name = 'DeckIndex')
+    thread.daemon = True
+    thread.start()
+    return result
+
+  def __len__(self):
+    return len(self.cardsets)
+
+
+class Prediction(object):
+  '''Candidate decks for one opponent in one game: the past decks containing the most of the
+     cards revealed so far. Past decks are only what was revealed in those games, so a deck
+     missing one of the cards still counts when nothing better matches.
+     Every reveal also brings the card counts over (a sample of) the candidates up to date, so
+     count() and likely() only read them. Cards revealed before the index is ready are matched
+     once it is.'''
+  __slots__ = ('deckindex', 'seen', 'pending', 'hits', 'best', 'candidates', 'ndecks', 'sample', 'counts',
+               'total', 'likelycache')
+  def __init__(self, deckindex):
+    self.deckindex = deckindex
+    self.seen = set()
+    self.pending = []
+    # Deck number -> revealed cards it contains.
+    self.hits = collections.Counter()
+    self.best = 0
+    # None means no reveal has matched yet.
+    self.candidates = None
+    # Times seen of all the candidates.
+    self.ndecks = 0
+    # The MAX_SAMPLE newest candidates, card id -> times seen over them and their total times seen.
+    self.sample = set()
+    self.counts = collections.Counter()
+    self.total = 0
+    self.likelycache = None
+
+  def reveal(self, cardid):
+    if cardid in self.seen:
+      return
+    self.seen.add(cardid)
+    self.likelycache = None
+    if not self.deckindex.ready:
+      self.pending.append(cardid)
+      return
+    if self.pending:
+      self.catchUp()
+    self.match(cardid)
+
+  def catchUp(self):
+    pending = self.pending
+    self.pending = []
+    for cardid in pending:
+      self.match(cardid)
+    self.likelycache = None
+
+  def match(self, cardid):
+    deckindex = self.deckindex
+    dnums = deckindex.index.get(cardid)
+    if not dnums:
+      return
+    hits = self.hits
+    hits.update(dnums)
+    times = deckindex.times
+    candidates = self.candidates
+    if candidates is None:
+      self.best = 1
+      self.candidates = set(dnums)
+      self.ndecks = deckindex.weights[cardid]
+      # Deck numbers are in order, the newest are at the end.
+      self.resample(set(dnums[-MAX_SAMPLE:]))
+      return
+    # Only the decks at the best count so far can go one better.
+    better = candidates.intersection(dnums)
+    if better:
+      self.best += 1
+      self.candidates = better
+      self.ndecks = sum(map(times.__getitem__, better))
+      self.resample(better if len(better) <= MAX_SAMPLE else set(sorted(better)[-MAX_SAMPLE:]))
+      return
+    best = self.best
+    grown = [dnum for dnum in dnums if hits[dnum] == best]
+    if not grown:
+      return
+    candidates.update(grown)
+    self.ndecks += sum(map(times.__getitem__, grown))
+    sample = self.sample.union(grown)
+    self.resample(sample if len(sample) <= MAX_SAMPLE else set(sorted(sample)[-MAX_SAMPLE:]))
+
+  def resample(self, sample):
+    '''Moves the card counts over to sample, by difference when that is less work than counting afresh.'''
+    cardsets = self.deckindex.cardsets
+    times = self.deckindex.times
+    old = self.sample
+    removed = old - sample
+    added = sample - old
+    counts = self.counts
+    if len(removed) + len(added) >= len(sample):
+      counts = self.counts = collections.Counter(itertools.chain.from_iterable(map(cardsets.__getitem__, sample)))
+      total = len(sample)
+      for dnum in sample:
+        if times[dnum] > 1:
+          for _ in range(times[dnum] - 1):
+            counts.update(cardsets[dnum])
+          total += times[dnum] - 1
+      self.total = total
+    else:
+      for dnum in removed:
+        cardids = cardsets[dnum]
+        for _ in range(times[dnum]):
+          counts.subtract(cardids)
+        self.total -= times[dnum]
+      for dnum in added:
+        cardids = cardsets[dnum]
+        for _ in range(times[dnum]):
+          counts.update(cardids)
+        self.total += times[dnum]
+    self.sample = sample if sample is not self.candidates else set(sample)
+
+  def count(self):
+    if self.pending and self.deckindex.ready:
+      self.catchUp()
+    if self.candidates is None:
+      return 0
+    return self.ndecks
+
+  def likely(self, limit = 8):
+    '''Returns [(cardid, share of candidate decks containing it)] for cards not seen yet, most likely first.'''
+    if self.pending and self.deckindex.ready:
+      self.catchUp()
+    if self.candidates is None:
+      return []
+    cache = self.likelycache
+    if cache is not None and cache[0] >= limit:
+      return cache[1][:limit]
+    seen = self.seen
+    total = float(self.total)
+    ranked = heapq.nsmallest(limit, ((-n, cardid) for cardid,n in self.counts.items() if n > 0 and cardid not in seen))
+    result = [(cardid, -n / total) for n,cardid in ranked]
+    self.likelycache = (limit, result)
+    return result
@@ -0,0 +1,230 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Localhost state server for overlays and dashboards, standard library only.
+#
+#   GET /state  the current state as JSON
+#   GET /ws     WebSocket: first {"full": state}, then {"patch": delta} messages
+#
+# Deltas are JSON merge patches (RFC 7396): objects are merged key by key and
+# null removes a key. Each subscriber gets the difference between what it was
+# last sent and the newest state, so a slow one just gets fewer, bigger patches,
+# and none gets more than maxrate a second.
+# The server runs its own asyncio loop on a thread; publish() never blocks. It
+# only says the state changed, the state itself is built on the server's thread
+# when someone is about to be sent it.
+
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def diffState(old, new):
+  '''Returns the merge patch that turns old into new (both JSON objects), empty if equal.'''
+  patch = {}
+  for key,value in new.items():
+    if key not in old:
+      patch[key] = value
+      continue
+    ovalue = old[key]
+    if ovalue is value or ovalue == value:
+      continue
+    if isinstance(value, dict) and isinstance(ovalue, dict):
+      sub = diffState(ovalue, value)
+      if sub:
+        patch[key] = sub
+    else:
+      patch[key] = value
+  for key in old:
+    if key not in new:
+      patch[key] = None
+  return patch
+
+
+def wsFrame(text):
+  '''A single unmasked text frame, as servers send them.'''
+  data = text.encode('utf-8')
+  size = len(data)
+  if size < 126:
+    header = struct.pack('!BB', 0x81, size)
+  elif size < 65536:
+    header = struct.pack('!BBH', 0x81, 126, size)
+  else:
+    header = struct.pack('!BBQ', 0x81, 127, size)
+  return header + data
+
+
+class StateServer(object):
+  def __init__(self, port = 8321, host = '127.0.0.1', maxrate = 10):
+    self.host = host
+    self.port = port
+    self.interval = 1.0 / maxrate if maxrate > 0 else 0.0
+    self.latest = {}
+    # Builds the current state, set by publish(). stale means latest is older than what it would build.
+    self.view = None
+    self.stale = False
+    self.waking = False
+    self.subscribers = set()
+    self.loop = None
+    self.ready = threading.Event()
+    self.error = None
+    self.thread = threading.Thread(target = self.run, name = 'StateServer')
+    self.thread.daemon = True
+
+  def start(self):
+    self.thread.start()
+    self.ready.wait()
+    if self.error is not None:
+      raise self.error
+
+  def run(self):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    self.loop = loop
+    try:
+      loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+    except Exception as e:
+      self.error = e
+      self.ready.set()
+      return
+    self.ready.set()
+    loop.run_forever()
+
+  def publish(self, view):
+    '''Called from the tracker thread when the state changed. view() returns the new state, a fresh
+       object, and is called on the server's thread.'''
+    self.view = view
+    # Any number of changes before the loop gets to it are one wakeup.
+    if not self.waking:
+      self.waking = True
+      self.loop.call_soon_threadsafe(self.changed)
+
+  def changed(self):
+    self.waking = False
+    self.stale = True
+    for event in self.subscribers:
+      event.set()
+
+  def current(self):
+    if self.stale:
+      self.stale = False
+      self.latest = self.view()
+    return self.latest
+
+  async def handle(self, reader, writer):
+    try:
+      head = await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+      writer.close()
+      return
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ')
+    path = parts[1] if len(parts) > 1 else ''
+    headers = {}
+    for line in lines[1:]:
+      if ':' in line:
+        k,v = line.split(':', 1)
+        headers[k.strip().lower()] = v.strip()
+    try:
+      if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+        await self.websocket(reader, writer, headers)
+      elif path == '/state':
+        self.respond(writer, '200 OK', 'application/json', json.dumps(self.current()))
+      else:
+        self.respond(writer, '404 Not Found', 'text/plain', 'GET /state or a WebSocket on /ws\n')
+      await writer.drain()
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  def respond(self, writer, status, ctype, body):
+    body = body.encode('utf-8')
+    writer.write('HTTP/1.1 {0}\r\nContent-Type: {1}\r\nContent-Length: {2}\r\nAccess-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n'
+                 .format(status, ctype, len(body)).encode('latin-1') + body)
+
+  async def websocket(self, reader, writer, headers):
+    key = headers.get('sec-websocket-key', '')
+    accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+    writer.write('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {0}\r\n\r\n'
+                 .format(accept).encode('latin-1'))
+    event = asyncio.Event()
+    event.set()
+    self.subscribers.add(event)
+    closed = asyncio.ensure_future(self.readFrames(reader, writer))
+    loop = asyncio.get_event_loop()
+    try:
+      sent = None
+      senttime = 0.0
+      while not closed.done():
+        waiter = asyncio.ensure_future(event.wait())
+        await asyncio.wait((waiter, closed), return_when = asyncio.FIRST_COMPLETED)
+        if not waiter.done():
+          waiter.cancel()
+          break
+        wait = senttime + self.interval - loop.time()
+        if wait > 0:
+          # Changes meanwhile go out together after.
+          await asyncio.sleep(wait)
+        event.clear()
+        state = self.current()
+        if sent is None:
+          msg = { 'full': state }
+        else:
+          patch = diffState(sent, state)
+          if not patch:
+            continue
+          msg = { 'patch': patch }
+        writer.write(wsFrame(json.dumps(msg, separators = (',', ':'))))
+        # Only this subscriber waits on a slow connection, changes meanwhile only make the state stale.
+        await writer.drain()
+        sent = state
+        senttime = loop.time()
+    finally:
+      self.subscribers.discard(event)
+      closed.cancel()
+
+  async def readFrames(self, reader, writer):
+    '''Reads client frames until it closes: answers pings, ignores anything else.'''
+    try:
+      while True:
+        b1,b2 = await reader.readexactly(2)
+        opcode = b1 & 0x0f
+        size = b2 & 0x7f
+        if size == 126:
+          size, = struct.unpack('!H', await reader.readexactly(2))
+        elif size == 127:
+          size, = struct.unpack('!Q', await reader.readexactly(8))
+        mask = await reader.readexactly(4) if b2 & 0x80 else None
+        data = await reader.readexactly(size)
+        if mask is not None:
+          data = bytes(b ^ mask[i % 4] for i,b in enumerate(data))
+        if opcode == 0x8:
+          writer.write(b'\x88\x00')
+          return
+        if opcode == 0x9:
+          writer.write(struct.pack('!BB', 0x8a, len(data)) + data)
+    except (asyncio.IncompleteReadError, ConnectionError):
+      return
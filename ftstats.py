@@ -0,0 +1,162 @@
+#!env python3
+
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Counters, latency histograms and on demand profiling for the live tracker.
+# Nothing here runs unless enabled: callers check 'ftstats.current is not
+# None' once per batch and handlers are only wrapped when stats are on.
+
+
+import atexit
+import io
+import signal
+import time
+
+
+# The active Stats, None when disabled.
+current = None
+
+
+class Histogram(object):
+  '''Latencies in power of two microsecond buckets.'''
+  __slots__ = ('buckets', 'count', 'total', 'max')
+  def __init__(self):
+    self.buckets = [0] * 40
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def add(self, seconds):
+    self.buckets[min(39, int(seconds * 1e6).bit_length())] += 1
+    self.count += 1
+    self.total += seconds
+    if seconds > self.max:
+      self.max = seconds
+
+  def percentile(self, p):
+    '''Upper bound of the bucket holding the p-th percentile, in seconds.'''
+    want = self.count * p
+    seen = 0
+    for b,n in enumerate(self.buckets):
+      seen += n
+      if seen >= want and n:
+        return min(self.max, (1 << b) / 1e6)
+    return self.max
+
+
+class Stats(object):
+  def __init__(self, fn = 'faeriatrack_stats.log', interval = 60.0):
+    self.fn = fn
+    self.interval = interval
+    self.started = time.time()
+    self.nextdump = self.started + interval if interval else None
+    self.counters = {}
+    self.histograms = {}
+
+  def count(self, name, n = 1):
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def observe(self, name, seconds):
+    hist = self.histograms.get(name)
+    if hist is None:
+      hist = self.histograms[name] = Histogram()
+    hist.add(seconds)
+
+  def timed(self, name, fn):
+    '''Wraps fn to count its calls and time them under name.'''
+    observe = self.observe
+    clock = time.perf_counter
+    def wrapper(*args):
+      started = clock()
+      try:
+        return fn(*args)
+      finally:
+        observe(name, clock() - started)
+    return wrapper
+
+  def tick(self):
+    '''Called once per batch, writes the periodic dump when due.'''
+    if self.nextdump is not None and time.time() >= self.nextdump:
+      self.nextdump = time.time() + self.interval
+      self.dump()
+
+  def report(self):
+    out = io.StringIO()
+    elapsed = time.time() - self.started
+    out.write('* Stats at {0} after {1:.0f}s\n'.format(time.strftime('%Y%m%dT%H%M%S'), elapsed))
+    for name in sorted(self.counters):
+      value = self.counters[name]
+      out.write('  {0: <32s} {1: >12d} {2: >12.1f}/s\n'.format(name, value, value / elapsed if elapsed else 0.0))
+    if self.histograms:
+      out.write('  {0: <32s} {1: >8s} {2: >10s} {3: >9s} {4: >9s} {5: >9s} {6: >9s} {7: >9s}\n'.format(
+        'latency (us)', 'count', 'total ms', 'mean', 'p50', 'p90', 'p99', 'max'))
+      for name in sorted(self.histograms):
+        h = self.histograms[name]
+        out.write('  {0: <32s} {1: >8d} {2: >10.1f} {3: >9.1f} {4: >9.0f} {5: >9.0f} {6: >9.0f} {7: >9.0f}\n'.format(
+          name, h.count, h.total * 1e3, h.total / h.count * 1e6, h.percentile(0.5) * 1e6,
+          h.percentile(0.9) * 1e6, h.percentile(0.99) * 1e6, h.max * 1e6))
+    return out.getvalue()
+
+  def dump(self):
+    with open(self.fn, 'a') as fp:
+      fp.write(self.report())
+      fp.write('\n')
+
+
+def enable(fn = 'faeriatrack_stats.log', interval = 60.0):
+  '''Turns stats on. They are dumped to fn every interval seconds (if set) and printed on exit.'''
+  global current
+  current = Stats(fn, interval)
+  atexit.register(atExit)
+  return current
+
+
+def atExit():
+  if current is not None:
+    current.dump()
+    print(current.report())
+
+
+profiler = None
+
+def toggleProfile(signum = None, frame = None):
+  '''Starts a cProfile session, or stops the running one and writes it to faeriatrack_profile_STAMP.prof
+     with a summary appended to faeriatrack_stats.log.'''
+  # Only loaded when profiling, they pull in half the standard library.
+  import cProfile
+  import pstats
+  global profiler
+  if profiler is None:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return
+  prof = profiler
+  profiler = None
+  prof.disable()
+  fn = 'faeriatrack_profile_{0}.prof'.format(time.strftime('%Y%m%dT%H%M%S'))
+  prof.dump_stats(fn)
+  out = io.StringIO()
+  pstats.Stats(prof, stream = out).sort_stats('cumulative').print_stats(25)
+  with open(current.fn if current is not None else 'faeriatrack_stats.log', 'a') as fp:
+    fp.write('* Profile saved to {0}\n'.format(fn))
+    fp.write(out.getvalue())
+
+
+def installSignal():
+  '''SIGUSR1 toggles profiling. Not available on Windows.'''
+  if hasattr(signal, 'SIGUSR1'):
+    signal.signal(signal.SIGUSR1, toggleProfile)
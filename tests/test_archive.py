@@ -0,0 +1,112 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import glob
+import io
+import json
+import os
+
+import pytest
+
+import faeriatrack
+import ftarchive
+from ftbench.generate import StreamGenerator
+
+
+def blocks(n):
+  return ['{0}T010.000.000.001.02202-192.168.001.002.50000:\n0000: {1}\n\n'.format(1500000000 + i, 'ab' * 20) for i in range(n)]
+
+
+@pytest.mark.parametrize('compression', ['xz', 'gz'])
+def test_writeAndRead(tmp_path, compression):
+  dirname = str(tmp_path / 'archive')
+  text = blocks(30)
+  with ftarchive.ArchiveWriter(dirname, 'net', segsize = 1500, compression = compression) as writer:
+    for n,block in enumerate(text):
+      if n % 10 == 0:
+        writer.mark('start', writer.tell(), {})
+      writer.write(block)
+      if n % 10 == 9:
+        writer.mark('end', writer.tell(), { 'opponent': 'Opponent{0}'.format(n - 9) })
+        if writer.due('end'):
+          writer.rotate({ 'turn': n })
+  archive = ftarchive.Archive(os.path.join(dirname, 'net.idx'))
+  assert ''.join(archive.read()) == ''.join(text)
+  assert len(archive.segments) == 2
+  assert [archive.state(seg) for seg in archive.segments] == [None, { 'turn': 19 }]
+  assert [game['opponent'] for game in archive.games] == ['Opponent0', 'Opponent10', 'Opponent20']
+  for n in range(3):
+    assert ''.join(archive.readGame(n)) == ''.join(text[n * 10:n * 10 + 10])
+  assert archive.earlier(1) == 1 and archive.earlier(2) == 0
+  assert ''.join(archive.readGame(1, whole = True)) == ''.join(text[:20])
+
+
+def test_rotationDropsOldest(tmp_path):
+  dirname = str(tmp_path / 'archive')
+  maxbytes = 1000
+  writer = ftarchive.ArchiveWriter(dirname, 'net', segsize = 100, maxbytes = maxbytes)
+  text = blocks(40)
+  for block in text:
+    writer.mark('session', writer.tell(), {})
+    writer.write(block)
+    if writer.due('session'):
+      writer.rotate()
+  writer.close()
+  archive = ftarchive.Archive(os.path.join(dirname, 'net.idx'))
+  # Past maxbytes the closed segments go, oldest first, and the index forgets them.
+  segs = list(archive.segments)
+  assert 1 < len(segs) < 20 and segs == list(range(40 - len(segs), 40))
+  files = [archive.segments[seg]['file'] for seg in segs]
+  assert sorted(os.listdir(dirname)) == sorted(['net.idx'] + files)
+  assert sum(os.path.getsize(os.path.join(dirname, fn)) for fn in files) <= maxbytes
+  assert ''.join(archive.read()) == ''.join(text[-len(segs):])
+  # A writer opened on it again carries on the numbering.
+  writer = ftarchive.ArchiveWriter(dirname, 'net', segsize = 100, maxbytes = maxbytes)
+  writer.write(text[0])
+  writer.close()
+  assert list(ftarchive.Archive(os.path.join(dirname, 'net.idx')).segments)[-1] == 40
+
+
+def test_killedMidSegment(tmp_path):
+  fn = str(tmp_path / 'net_00000.log.xz')
+  segment = ftarchive.SegmentFile(fn)
+  segment.write('kept\n')
+  segment.sync()
+  segment.write('lost\n')
+  # Killed: what the compressor holds never reaches the file.
+  segment.fp.close()
+  assert list(ftarchive.readStreams(fn)) == ['kept\n']
+
+
+def test_replayGamesFromArchive(tmp_path, monkeypatch, capsys):
+  gen = StreamGenerator(seed = 13, games = 4)
+  cards = gen.cards()
+  monkeypatch.chdir(tmp_path)
+  # Small enough to rotate between games.
+  monkeypatch.setattr(faeriatrack, 'archivesegsize', 20000)
+  os.mkdir('logs')
+  faeriatrack.runTCPFlow(cards, io.StringIO(''.join(gen.tcpflow())), headless = True)
+  capsys.readouterr()
+  live = []
+  for fn in glob.glob(os.path.join('logs', 'faeriatrack_gamelog_*.log')):
+    with open(fn, 'r') as fp:
+      live.extend(json.loads(line) for line in fp)
+  archive = ftarchive.Archive(os.path.join('archive', 'net.idx'))
+  assert len(archive.segments) > 1 and len(archive.games) == len(live) == 4
+  for n,game in enumerate(live):
+    glogfp = io.StringIO()
+    faeriatrack.replayArchive(faeriatrack.Tracker(cards, glogfp, sink = lambda msg: None), archive.idxfn, n)
+    assert [json.loads(line) for line in glogfp.getvalue().splitlines()] == [game]
@@ -0,0 +1,99 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import json
+import os
+
+import pytest
+
+import faeriatrack
+from ftbench.generate import StreamGenerator
+
+
+gen = StreamGenerator(seed = 9, games = 2)
+cards = gen.cards()
+commands = [command for _,command in gen.commands()]
+
+
+def tracker(glogfp = None, checkpointfn = None):
+  return faeriatrack.Tracker(cards, glogfp if glogfp is not None else io.StringIO(), sink = lambda msg: None,
+                             checkpointfn = checkpointfn)
+
+
+def games(glogfp):
+  result = [json.loads(line) for line in glogfp.getvalue().splitlines()]
+  for game in result:
+    del game['stamp']
+  return result
+
+
+def feed(t, commands):
+  for command in commands:
+    t.feed(command)
+
+
+def test_roundTrip():
+  t = tracker()
+  # Every so often, including before, in and after games.
+  for n,command in enumerate(commands):
+    t.feed(command)
+    if n % 97 == 0:
+      state = json.loads(json.dumps(t.checkpoint()))
+      restored = tracker()
+      restored.restore(state)
+      assert restored.checkpoint() == state
+      assert restored.buildView() == t.buildView()
+
+
+def test_resumeMidGame(tmp_path):
+  checkpointfn = str(tmp_path / 'faeriatrack_state.json')
+  whole = io.StringIO()
+  feed(tracker(whole), commands)
+  # Stop right after a turn starts in the first game, where the checkpoint is saved.
+  turns = [n for n,command in enumerate(commands) if '|~newTurn|' in command]
+  cut = turns[len(turns) // 4] + 1
+  first = io.StringIO()
+  t = tracker(first, checkpointfn)
+  feed(t, commands[:cut])
+  assert t.game is not None
+  t.close()
+  state = faeriatrack.loadCheckpoint(checkpointfn)
+  assert state == json.loads(json.dumps(t.checkpoint()))
+  second = io.StringIO()
+  t = tracker(second)
+  t.restore(state)
+  feed(t, commands[cut:])
+  assert games(first) == []
+  assert games(second) == games(whole)
+  assert len(games(whole)) == 2
+
+
+def test_loadCheckpointIgnoresOld(tmp_path):
+  checkpointfn = str(tmp_path / 'faeriatrack_state.json')
+  assert faeriatrack.loadCheckpoint(checkpointfn) is None
+  with open(checkpointfn, 'w') as fp:
+    json.dump(tracker().checkpoint(), fp)
+  assert faeriatrack.loadCheckpoint(checkpointfn) is not None
+  os.utime(checkpointfn, (0, 0))
+  assert faeriatrack.loadCheckpoint(checkpointfn) is None
+
+
+def test_restoreRejectsOtherVersions():
+  state = tracker().checkpoint()
+  state['version'] = faeriatrack.checkpointversion + 1
+  with pytest.raises(ValueError):
+    tracker().restore(state)
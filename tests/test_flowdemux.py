@@ -0,0 +1,109 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import itertools
+import json
+
+import faeriatrack
+from ftbench.generate import StreamGenerator
+
+
+def parseGames(text):
+  result = [json.loads(line) for line in text.splitlines()]
+  for game in result:
+    del game['stamp']
+  return result
+
+
+class Clients(object):
+  '''newclient for FlowDemux with a Tracker and gamelog of its own per client.'''
+  def __init__(self, cards):
+    self.cards = cards
+    self.glogs = {}
+    self.closed = []
+
+  def __call__(self, addr):
+    glogfp = io.StringIO()
+    self.glogs[addr] = glogfp
+    client = faeriatrack.Client(addr, faeriatrack.Tracker(self.cards, glogfp, sink = lambda msg: None), io.StringIO())
+    close = client.close
+    def closed():
+      self.closed.append(addr)
+      close()
+    client.close = closed
+    return client
+
+
+def incoming(gen, addr, port):
+  '''Yields FlowDemux.feed arguments for gen's traffic to the client at addr:port.'''
+  for stamp,srcport,data in gen.packets():
+    if srcport in (2201, 2202):
+      yield (stamp, ('10.0.0.1', srcport, addr, port), 'W' if srcport == 2201 else 'G', data)
+
+
+def test_clientsTrackedApart():
+  gens = [StreamGenerator(seed = 4, games = 2), StreamGenerator(seed = 5, games = 1)]
+  cards = gens[0].cards()
+  clients = Clients(cards)
+  demux = faeriatrack.FlowDemux(clients)
+  streams = [incoming(gens[0], '192.168.1.2', 50000), incoming(gens[1], '192.168.1.3', 50001)]
+  for block in itertools.chain.from_iterable(itertools.zip_longest(*streams)):
+    if block is not None:
+      demux.feed(*block)
+  demux.close()
+  assert sorted(clients.glogs) == ['192.168.1.2', '192.168.1.3']
+  for gen,addr in zip(gens, ('192.168.1.2', '192.168.1.3')):
+    glogfp = io.StringIO()
+    faeriatrack.replay(faeriatrack.Tracker(cards, glogfp, sink = lambda msg: None), io.StringIO(''.join(gen.commandLog())))
+    assert parseGames(clients.glogs[addr].getvalue()) == parseGames(glogfp.getvalue())
+    assert len(parseGames(glogfp.getvalue())) == gen.games
+
+
+def test_worldAndGameShareClient():
+  clients = Clients({})
+  demux = faeriatrack.FlowDemux(clients)
+  demux.feed(1500000000, ('10.0.0.1', 2201, '192.168.1.2', 50000), 'W', b'1|~ping\n')
+  demux.feed(1500000000, ('10.0.0.1', 2202, '192.168.1.2', 50001), 'G', b'2|~ping\n')
+  assert len(demux.flows) == 2
+  assert list(demux.clients) == ['192.168.1.2']
+
+
+def test_idleExpiry():
+  expired = []
+  clients = Clients({})
+  demux = faeriatrack.FlowDemux(clients, flowidle = 100, clientidle = 200, onexpire = expired.append)
+  old = ('10.0.0.1', 2202, '192.168.1.2', 50000)
+  new = ('10.0.0.1', 2202, '192.168.1.3', 50000)
+  demux.feed(1500000000, old, 'G', b'1|~ping\n')
+  demux.feed(1500000050, new, 'G', b'1|~ping\n')
+  demux.feed(1500000150, new, 'G', b'2|~ping\n')
+  assert expired == [old]
+  assert clients.closed == []
+  demux.feed(1500000300, new, 'G', b'3|~ping\n')
+  assert clients.closed == ['192.168.1.2']
+  assert list(demux.clients) == ['192.168.1.3']
+
+
+def test_resyncBeforeFlowStarts():
+  clients = Clients({})
+  demux = faeriatrack.FlowDemux(clients)
+  key = ('10.0.0.1', 2202, '192.168.1.2', 50000)
+  demux.resync(key)
+  demux.feed(1500000000, key, 'G', b'ing\n1|~ping\n')
+  # The tail of the command that was cut off is not fed.
+  assert demux.clients['192.168.1.2'].clogfp.getvalue() == 'G: 1|~ping\n'
+  assert key not in demux.lost
@@ -0,0 +1,105 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import json
+
+import pytest
+
+import faeriatrack
+from ftbench.generate import StreamGenerator
+
+
+def test_framerCarriesPartialCommands():
+  framer = faeriatrack.CommandFramer()
+  assert framer.feed(b'1|$wel') == ()
+  assert framer.feed(b'come\n2|$sset|dr') == ['1|$welcome']
+  assert framer.feed(b':decks\n3|~ping\n') == ['2|$sset|dr:decks', '3|~ping']
+  assert framer.buf == b''
+
+
+def test_framerResyncDropsLostStart():
+  framer = faeriatrack.CommandFramer()
+  framer.feed(b'1|$welcome\n2|$sset|dr')
+  framer.resync()
+  # What follows the gap is the tail of a command whose start was lost.
+  assert framer.feed(b'cks\n3|~ping\n4|') == ['3|~ping']
+  assert framer.feed(b'~ping\n') == ['4|~ping']
+
+
+def test_framerDropsOverlongCommand():
+  framer = faeriatrack.CommandFramer(maxbuffer = 16)
+  assert framer.feed(b'x' * 20) == ()
+  assert framer.feed(b'yyy\n1|~ping\n') == ['1|~ping']
+
+
+def blocks(lines):
+  parser = faeriatrack.TCPFlowParser()
+  result = []
+  for line in lines:
+    block = parser.feed(line)
+    if block is not None:
+      result.append(block)
+  block = parser.end()
+  if block is not None:
+    result.append(block)
+  return result
+
+
+def test_parserBlocksMatchCommands():
+  gen = StreamGenerator(seed = 1, games = 1, turns = 4)
+  lines = list(gen.tcpflow())
+  result = blocks(lines)
+  assert result == list(faeriatrack.readTCPFlow(io.StringIO(''.join(lines))))
+  # Outgoing blocks are left out, the rest is the commands in order.
+  assert set(key[1] for _,_,key,_ in result) == set((2201, 2202))
+  for stype in ('W', 'G'):
+    data = b''.join(data for _,s,_,data in result if s == stype)
+    assert data.decode('ascii').split('\n')[:-1] == [c for s,c in gen.commands() if s == stype]
+
+
+def test_parserResync():
+  parser = faeriatrack.TCPFlowParser()
+  with pytest.raises(ValueError):
+    parser.feed('0000: 317c 2477  1|$w\n')
+  parser.feed('1500000000T010.000.000.001.02202-192.168.001.002.50000:\n')
+  parser.feed('0000: 317c 2477  1|$w\n')
+  assert parser.resync() == ('10.0.0.1', 2202, '192.168.1.2', 50000)
+  # The rest of the dropped block is skipped quietly.
+  assert parser.feed('0010: 656c  el\n') is None
+  assert parser.feed('\n') is None
+  parser.feed('1500000001T010.000.000.001.02201-192.168.001.002.50000:\n')
+  parser.feed('0000: 327c 7e70 696e 670a  2|~ping.\n')
+  assert parser.feed('\n') == (1500000001, 'W', ('10.0.0.1', 2201, '192.168.1.2', 50000), b'2|~ping\n')
+
+
+def games(text, cards):
+  glogfp = io.StringIO()
+  tracker = faeriatrack.Tracker(cards, glogfp, sink = lambda msg: None)
+  faeriatrack.replay(tracker, io.StringIO(text))
+  result = [json.loads(line) for line in glogfp.getvalue().splitlines()]
+  for game in result:
+    # The tcpflow replay has capture times, the commands log has none.
+    del game['stamp']
+  return result
+
+
+def test_netLogTracksLikeCommandsLog():
+  gen = StreamGenerator(seed = 3, games = 2)
+  cards = gen.cards()
+  fromnet = games(''.join(gen.tcpflow()), cards)
+  assert len(fromnet) == 2
+  assert fromnet == games(''.join(gen.commandLog()), cards)
@@ -0,0 +1,112 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import struct
+
+import ftpcap
+
+
+def segments(data, size, seq):
+  '''Splits data into (seq, payload) of size bytes starting at seq.'''
+  return [((seq + off) & 0xffffffff, data[off:off + size]) for off in range(0, len(data), size)]
+
+
+def feedAll(reasm, key, segs, flags = 0x18):
+  return b''.join(reasm.feed(key, seq, flags, payload) for seq,payload in segs)
+
+
+data = bytes(range(256)) * 8
+key = ('10.0.0.1', 2202, '192.168.1.2', 50000)
+
+
+def test_inOrder():
+  reasm = ftpcap.TCPReassembler()
+  assert reasm.feed(key, 999, ftpcap.TCP_SYN, b'') == b''
+  assert feedAll(reasm, key, segments(data, 100, 1000)) == data
+
+
+def test_outOfOrderAndRetransmits():
+  reasm = ftpcap.TCPReassembler()
+  reasm.feed(key, 999, ftpcap.TCP_SYN, b'')
+  segs = segments(data, 100, 1000)
+  segs[2],segs[5] = segs[5],segs[2]
+  # A retransmit of one already had and one overlapping two segments.
+  segs.insert(8, segs[3])
+  segs.insert(10, (1000 + 650, data[650:850]))
+  assert feedAll(reasm, key, segs) == data
+
+
+def test_seqWraps():
+  reasm = ftpcap.TCPReassembler()
+  reasm.feed(key, 0xffffff00, ftpcap.TCP_SYN, b'')
+  segs = segments(data, 100, 0xffffff01)
+  segs[0],segs[1] = segs[1],segs[0]
+  assert feedAll(reasm, key, segs) == data
+
+
+def test_joinMidStreamStartsAtEarliest():
+  gaps = []
+  reasm = ftpcap.TCPReassembler(gaps.append)
+  segs = segments(data, 100, 5000)
+  # The first segment seen is not the first one sent after the join.
+  segs[0],segs[1] = segs[1],segs[0]
+  assert feedAll(reasm, key, segs[:ftpcap.JOIN_SEGMENTS - 1]) == b''
+  assert feedAll(reasm, key, segs[ftpcap.JOIN_SEGMENTS - 1:]) == data
+  assert gaps == [key]
+
+
+def test_joinEndsBeforeEnoughSegments():
+  reasm = ftpcap.TCPReassembler()
+  segs = segments(data[:300], 100, 5000)
+  segs[0],segs[1] = segs[1],segs[0]
+  out = feedAll(reasm, key, segs[:2])
+  out += reasm.feed(key, segs[2][0], ftpcap.TCP_FIN, segs[2][1])
+  assert out == data[:300]
+  assert key not in reasm.streams
+
+
+def test_lostSegmentResumes():
+  gaps = []
+  reasm = ftpcap.TCPReassembler(gaps.append)
+  reasm.feed(key, 999, ftpcap.TCP_SYN, b'')
+  segs = segments(bytes(100 * (ftpcap.MAX_PENDING + 3)), 100, 1000)
+  out = reasm.feed(key, segs[0][0], 0x18, segs[0][1])
+  # segs[1] never arrives.
+  out += feedAll(reasm, key, segs[2:])
+  assert gaps == [key]
+  assert len(out) == 100 * (ftpcap.MAX_PENDING + 2)
+
+
+def test_readSegments():
+  out = io.BytesIO()
+  out.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, ftpcap.LINKTYPE_ETHERNET))
+  def packet(stamp, seq, flags, payload):
+    tcp = struct.pack('!HHIIBBHHH', 2202, 50000, seq, 0, 5 << 4, flags, 1000, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + len(payload), 0, 0, 64, 6, 0,
+                     bytes((10, 0, 0, 1)), bytes((192, 168, 1, 2)))
+    # Ethernet padding past the IP length is not payload.
+    frame = b'\0' * 12 + b'\x08\x00' + ip + tcp + payload + b'\0' * 6
+    out.write(struct.pack('<IIII', stamp, 500000, len(frame), len(frame)) + frame)
+  packet(1500000000, 999, ftpcap.TCP_SYN, b'')
+  packet(1500000001, 1000, 0x18, b'1|$welcome\n')
+  out.seek(0)
+  segs = list(ftpcap.readSegments(out))
+  assert [seg[:6] for seg in segs] == [
+    (1500000000.5, '10.0.0.1', 2202, '192.168.1.2', 50000, 999),
+    (1500000001.5, '10.0.0.1', 2202, '192.168.1.2', 50000, 1000),
+  ]
+  assert segs[1][7] == b'1|$welcome\n'
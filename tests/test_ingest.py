@@ -0,0 +1,185 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import glob
+import io
+import json
+import os
+import time
+
+import pytest
+
+import faeriatrack
+import ftingest
+from ftbench.generate import StreamGenerator
+
+
+class Sink(object):
+  '''Keeps what it is fed. Bytes after the last newline count as not acted on yet.'''
+  def __init__(self, label):
+    self.label = label
+    self.data = b''
+    self.closed = None
+    self.resumed = None
+
+  def feed(self, data):
+    self.data += data
+
+  def unread(self):
+    return len(self.data) - (self.data.rfind(b'\n') + 1)
+
+  def resume(self, state):
+    self.resumed = state
+
+  def close(self, complete = True):
+    self.closed = complete
+    return None if complete else { 'lines': self.data.count(b'\n') }
+
+
+class Plain(Sink):
+  '''A sink without unread(), all it is fed is done with.'''
+  unread = None
+
+  def close(self):
+    self.closed = True
+
+
+def follow(ingest, label, path, done):
+  '''Follows path until done() is true, then stops like a signal stops Ingest.run().'''
+  async def main():
+    task = asyncio.ensure_future(ingest.followFile(label, path))
+    deadline = time.time() + 10
+    while not done() and time.time() < deadline:
+      await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions = True)
+  loop = asyncio.new_event_loop()
+  try:
+    loop.run_until_complete(main())
+  finally:
+    loop.close()
+  assert done()
+
+
+def test_parseSpec(tmp_path):
+  assert ftingest.parseSpec('tcp:9000') == (None, 'tcp', ('127.0.0.1', 9000))
+  assert ftingest.parseSpec('alice=tcp:0.0.0.0:9000') == ('alice', 'tcp', ('0.0.0.0', 9000))
+  assert ftingest.parseSpec('unix:/tmp/ft.sock') == (None, 'unix', '/tmp/ft.sock')
+  with pytest.raises(ValueError):
+    ftingest.parseSpec('tcp:ninethousand')
+  fn = str(tmp_path / 'bob_tcpflow.txt')
+  fifo = str(tmp_path / 'carol.fifo')
+  open(fn, 'w').close()
+  os.mkfifo(fifo)
+  assert ftingest.parseSpec(fn) == (None, 'file', fn)
+  assert ftingest.parseSpec('b=' + fifo) == ('b', 'fifo', fifo)
+  with pytest.raises(ValueError):
+    ftingest.parseSpec(str(tmp_path / 'missing.txt'))
+  assert ftingest.pathLabel(fn) == 'bob_tcpflow'
+
+
+def test_sameLabelGetsSuffix():
+  ingest = ftingest.Ingest([], Sink)
+  assert [ingest.open('a')[0] for _ in range(3)] == ['a', 'a_2', 'a_3']
+
+
+def test_followAppendsAndStartsOver(tmp_path):
+  fn = str(tmp_path / 'a.txt')
+  with open(fn, 'wb') as fp:
+    fp.write(b'one\n')
+  sinks = []
+  ingest = ftingest.Ingest([], lambda label: sinks.append(Plain(label)) or sinks[-1], chunksize = 3, pollinterval = 0.01)
+  def appendThenReplace():
+    sink = sinks[0]
+    if sink.data == b'one\n':
+      with open(fn, 'ab') as fp:
+        fp.write(b'two\n')
+    elif sink.data == b'one\ntwo\n':
+      os.remove(fn)
+      with open(fn, 'wb') as fp:
+        fp.write(b'new\n')
+    return sink.data == b'one\ntwo\nnew\n'
+  follow(ingest, 'a', fn, lambda: bool(sinks) and appendThenReplace())
+  assert sinks[0].closed is True
+
+
+def test_resumesWhereLeftOff(tmp_path):
+  fn = str(tmp_path / 'a.txt')
+  offsetsfn = str(tmp_path / 'offsets.json')
+  with open(fn, 'wb') as fp:
+    fp.write(b'one\ntwo\nthr')
+  first = Sink('a')
+  follow(ftingest.Ingest([], lambda label: first, offsetsfn = offsetsfn), 'a', fn, lambda: first.data == b'one\ntwo\nthr')
+  # Only stopped, the partial line is read again next time.
+  assert first.closed is False
+  with open(fn, 'ab') as fp:
+    fp.write(b'ee\n')
+  second = Sink('a')
+  follow(ftingest.Ingest([], lambda label: second, offsetsfn = offsetsfn), 'a', fn, lambda: second.data.endswith(b'\n'))
+  assert second.data == b'three\n'
+  assert second.resumed == { 'lines': 2 }
+  again = Plain('a')
+  follow(ftingest.Ingest([], lambda label: again, offsetsfn = offsetsfn, fromstart = True), 'a', fn,
+         lambda: again.data.endswith(b'three\n'))
+  assert again.data == b'one\ntwo\nthree\n'
+  with open(offsetsfn, 'r') as fp:
+    assert json.load(fp) == { os.path.abspath(fn): [os.stat(fn).st_ino, len(b'one\ntwo\nthree\n')] }
+  assert again.resumed is None
+  # Another file by the same name is read from its start.
+  os.remove(fn)
+  with open(fn, 'wb') as fp:
+    fp.write(b'other\n')
+  other = Sink('a')
+  follow(ftingest.Ingest([], lambda label: other, offsetsfn = offsetsfn), 'a', fn, lambda: other.data == b'other\n')
+  assert other.resumed is None
+
+
+@pytest.mark.parametrize('share', [0.13, 0.5, 0.77])
+def test_restartDoesNotLogGamesAgain(tmp_path, monkeypatch, capsys, share):
+  gen = StreamGenerator(seed = 16, games = 4)
+  cards = gen.cards()
+  text = ''.join(gen.tcpflow()).encode('ascii')
+  monkeypatch.chdir(tmp_path)
+  os.mkdir('logs')
+  fn = 'capture.txt'
+  offsetsfn = os.path.join('logs', 'faeriatrack_offsets.json')
+  fed = [0]
+  def newsource(label):
+    source = faeriatrack.Source(cards, label)
+    feed = source.feed
+    def counted(data):
+      fed[0] += len(data)
+      feed(data)
+    source.feed = counted
+    return source
+  # Stopped mid line, mid block and mid game.
+  cut = int(len(text) * share) + 7
+  with open(fn, 'wb') as fp:
+    fp.write(text[:cut])
+  follow(ftingest.Ingest([], newsource, offsetsfn = offsetsfn), 's', fn, lambda: fed[0] == cut)
+  with open(fn, 'ab') as fp:
+    fp.write(text[cut:])
+  fed[0] = 0
+  follow(ftingest.Ingest([], newsource, offsetsfn = offsetsfn), 's', fn, lambda: fed[0] >= len(text) - cut)
+  assert 'Skipping' not in capsys.readouterr().out
+  games = []
+  for glogfn in glob.glob(os.path.join('logs', 's', 'faeriatrack_gamelog_*.log')):
+    with open(glogfn, 'r') as fp:
+      games.extend(json.loads(line) for line in fp)
+  glogfp = io.StringIO()
+  faeriatrack.replay(faeriatrack.Tracker(cards, glogfp, sink = lambda msg: None), io.StringIO(text.decode('ascii')))
+  assert games == [json.loads(line) for line in glogfp.getvalue().splitlines()]
@@ -0,0 +1,83 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import math
+
+import faeriatrack
+import ftodds
+from ftbench.generate import StreamGenerator
+
+
+def exact(decksize, copies, draws):
+  if draws > decksize:
+    draws = decksize
+  return 1.0 - math.comb(decksize - copies, draws) / math.comb(decksize, draws)
+
+
+def test_hitChancesMatchHypergeometric():
+  for decksize in (1, 5, 12, 30):
+    for copies in range(0, min(decksize, 4) + 1):
+      horizons = (1, 2, 3, 5, 40)
+      chances = ftodds.hitChances(decksize, copies, horizons)
+      for k,chance in zip(horizons, chances):
+        assert abs(chance - exact(decksize, copies, k)) < 1e-9
+
+
+def test_hitChancesEdges():
+  assert ftodds.hitChances(0, 3, (1, 2)) == (0.0, 0.0)
+  assert ftodds.hitChances(20, 0, (1, 2)) == (0.0, 0.0)
+  assert ftodds.hitChances(3, 3, (1,)) == (1.0,)
+  # More draws than cards without a copy, one is certain.
+  assert ftodds.hitChances(10, 3, (8, 9)) == (1.0, 1.0)
+  assert ftodds.chanceText(10, 3, (1, 8)) == '30/NX'
+
+
+def test_groupChances():
+  odds = ftodds.DrawOdds((1, 2, 3))
+  assert odds.groupChances(30, (2, 1, 3)) == ftodds.hitChances(30, 6, (1, 2, 3))
+  assert odds.groupChances(30, ()) == (0.0, 0.0, 0.0)
+  single = odds.cardChances(30, 2)
+  assert all(g > s for g,s in zip(odds.groupChances(30, (2, 2)), single))
+  assert odds.groupText('any', 30, (2, 1)) == ftodds.chanceText(30, 3, (1, 2, 3))
+
+
+def test_cardTextFollowsDeck():
+  odds = ftodds.DrawOdds((1, 2))
+  assert odds.width() == len(odds.cardText(1, 30, 2))
+  assert odds.cardText(1, 30, 2) == ftodds.chanceText(30, 2, (1, 2))
+  assert odds.cardText(1, 29, 2) == ftodds.chanceText(29, 2, (1, 2))
+  assert odds.cardText(1, 29, 1) == ftodds.chanceText(29, 1, (1, 2))
+
+
+def test_viewShowsGroupOdds():
+  gen = StreamGenerator(seed = 10, games = 1)
+  tracker = faeriatrack.Tracker(gen.cards(), io.StringIO(), sink = lambda msg: None)
+  shown = set()
+  for _,command in gen.commands():
+    tracker.feed(command)
+    if '|~newTurn|' not in command:
+      continue
+    game = tracker.view()['game']
+    horizons = tuple(game['horizons'])
+    for pnum,player in game['players'].items():
+      mine = pnum == str(game['me'])
+      known = [c['deck'] if mine else 3 - c['deck'] for c in player['cards'].values() if c['odds'] is not None]
+      groupodds = player['groupodds']
+      assert groupodds['known'] == [round(c, 3) for c in ftodds.hitChances(player['deckcards'], sum(known), horizons)]
+      assert groupodds['unknown'] == [round(c, 3) for c in ftodds.hitChances(player['deckcards'], max(0, player['unknown']), horizons)]
+      shown.update(c for c in groupodds['known'] + groupodds['unknown'] if 0.0 < c < 1.0)
+  assert shown
@@ -0,0 +1,126 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import json
+import random
+import time
+
+import faeriatrack
+import ftdb
+import ftpredict
+from ftbench.generate import StreamGenerator
+
+
+def ocards(cardids):
+  return [[1, cardid, str(cardid)] for cardid in cardids]
+
+
+def randomDecks(rnd, n):
+  # Few enough cards that decks share plenty, and some decks come up more than once.
+  decks = [sorted(rnd.sample(range(1, 40), rnd.randint(3, 12))) for _ in range(n)]
+  return decks + [rnd.choice(decks) for _ in range(n // 4)]
+
+
+def expected(decks, seen, limit):
+  '''What Prediction should say, worked out the slow way: (candidate decks, likely cards).'''
+  hits = [len(seen.intersection(deck)) for deck in decks]
+  best = max(hits + [0])
+  if best == 0:
+    return 0, []
+  # Identical decks are one deck numbered by when it was first seen.
+  order = []
+  for deck in decks:
+    if frozenset(deck) not in order:
+      order.append(frozenset(deck))
+  candidates = [cards for cards in order if len(seen.intersection(cards)) == best]
+  sample = candidates[-ftpredict.MAX_SAMPLE:]
+  counts = {}
+  total = 0
+  for cards in sample:
+    times = sum(1 for deck in decks if frozenset(deck) == cards)
+    total += times
+    for cardid in cards:
+      counts[cardid] = counts.get(cardid, 0) + times
+  ndecks = sum(1 for deck in decks if len(seen.intersection(deck)) == best)
+  ranked = sorted((-n, cardid) for cardid,n in counts.items() if cardid not in seen)[:limit]
+  return ndecks, [(cardid, -n / float(total)) for n,cardid in ranked]
+
+
+def test_predictionMatchesBruteForce(monkeypatch):
+  # Small enough that the sample is cut short.
+  monkeypatch.setattr(ftpredict, 'MAX_SAMPLE', 10)
+  rnd = random.Random(11)
+  for _ in range(20):
+    decks = randomDecks(rnd, 60)
+    index = ftpredict.DeckIndex()
+    for deck in decks:
+      index.add(ocards(deck))
+    prediction = ftpredict.Prediction(index)
+    seen = set()
+    for cardid in rnd.sample(range(1, 45), 8):
+      prediction.reveal(cardid)
+      seen.add(cardid)
+      ndecks, likely = expected(decks, seen, 8)
+      assert prediction.count() == ndecks
+      got = prediction.likely(8)
+      assert [c for c,_ in got] == [c for c,_ in likely]
+      assert all(abs(a - b) < 1e-9 for (_,a),(_,b) in zip(got, likely))
+      # Fewer from the cached list.
+      assert prediction.likely(3) == got[:3]
+
+
+def test_revealedBeforeReady():
+  index = ftpredict.DeckIndex()
+  index.ready = False
+  prediction = ftpredict.Prediction(index)
+  prediction.reveal(1)
+  index.add(ocards((1, 2, 3)))
+  assert prediction.count() == 0
+  with index.lock:
+    for deck in index.queued:
+      index.addDeck(deck)
+    index.ready = True
+  assert prediction.count() == 1
+  assert prediction.likely() == [(2, 1.0), (3, 1.0)]
+
+
+def gamelog(seed, games):
+  gen = StreamGenerator(seed = seed, games = games, decks = 3)
+  glogfp = io.StringIO()
+  faeriatrack.replay(faeriatrack.Tracker(gen.cards(), glogfp, sink = lambda msg: None), io.StringIO(''.join(gen.commandLog())))
+  return [json.loads(line) for line in glogfp.getvalue().splitlines()]
+
+
+def test_loadGameDB(tmp_path):
+  gamedb = ftdb.GameDB(str(tmp_path / 'games.db'))
+  games = gamelog(12, 6)
+  gamedb.addMany(games[:5])
+  index = ftpredict.DeckIndex.loadGameDB(gamedb)
+  # Finished while the index loads, added once it has.
+  index.addGames(games[5:])
+  deadline = time.time() + 10
+  while not index.ready and time.time() < deadline:
+    time.sleep(0.01)
+  assert index.ready
+  whole = ftpredict.DeckIndex()
+  whole.addGames(games)
+  assert index.cardsets == whole.cardsets and index.times == whole.times
+  assert index.index == whole.index and index.weights == whole.weights
+  gamedb.addMany(games[5:])
+  fromdb = ftpredict.DeckIndex.fromGameDB(gamedb)
+  assert fromdb.cardsets == whole.cardsets and fromdb.times == whole.times
+  gamedb.close()
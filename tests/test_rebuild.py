@@ -0,0 +1,94 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import glob
+import io
+import json
+import os
+
+import faeriatrack
+from ftbench.generate import StreamGenerator
+
+
+gens = [StreamGenerator(seed = 6, games = 2), StreamGenerator(seed = 7, games = 1)]
+cards = gens[0].cards()
+
+
+def loggedGames(logdir):
+  result = []
+  for fn in sorted(glob.glob(os.path.join(logdir, 'faeriatrack_gamelog_*.log'))):
+    with open(fn, 'r') as fp:
+      result.extend(json.loads(line) for line in fp if line.strip())
+  return result
+
+
+def game(stamp, opponent = 'Opponent0', deck = 'Deck0', turn = 10):
+  return { 'stamp': stamp, 'turn': turn, 'opponent': { 'name': opponent }, 'me': { 'deckname': deck } }
+
+
+def test_indexSessions(tmp_path):
+  netfn = str(tmp_path / 'faeriatrack_net.log')
+  cmdfn = str(tmp_path / 'faeriatrack_commands.log')
+  with open(netfn, 'w') as fp:
+    fp.writelines(line for gen in gens for line in gen.tcpflow())
+  with open(cmdfn, 'w') as fp:
+    fp.writelines(line for gen in gens for line in gen.commandLog())
+  for fn in (netfn, cmdfn):
+    sessions = faeriatrack.indexSessions(fn)
+    assert len(sessions) == 2
+    assert sessions[0][2] == 0 and sessions[0][3] == sessions[1][2] and sessions[1][3] == os.path.getsize(fn)
+  with open(cmdfn, 'rb') as fp:
+    fp.seek(sessions[1][2])
+    assert fp.read().decode('ascii') == ''.join(gens[1].commandLog())
+
+
+def test_spreadStamps():
+  games = [game('20170714T024018'), game('20170714T024018'), game('20170714T024018'), game('20170714T030000')]
+  faeriatrack.spreadStamps(games)
+  assert [g['stamp'] for g in games] == ['20170714T024016', '20170714T024017', '20170714T024018', '20170714T030000']
+
+
+def test_mergeReplacesSameGame(tmp_path):
+  logdir = str(tmp_path)
+  faeriatrack.mergeGamelogs([game('20170714T030000'), game('20170714T010000')], logdir)
+  written = faeriatrack.mergeGamelogs([game('20170714T030000', turn = 12), game('20170714T020000'),
+                                       game('20170715T010000')], logdir)
+  assert [os.path.basename(fn) for fn in written] == ['faeriatrack_gamelog_20170714.log', 'faeriatrack_gamelog_20170715.log']
+  games = loggedGames(logdir)
+  assert [g['stamp'] for g in games] == ['20170714T010000', '20170714T020000', '20170714T030000', '20170715T010000']
+  assert games[2]['turn'] == 12
+
+
+def test_rebuildCountsEachGameOnce(tmp_path, capsys):
+  logs = tmp_path / 'old'
+  logs.mkdir()
+  # A net log and the commands log written alongside it hold the same games.
+  with open(str(logs / 'faeriatrack_net.log'), 'w') as fp:
+    fp.writelines(line for gen in gens for line in gen.tcpflow())
+  with open(str(logs / 'faeriatrack_commands.log'), 'w') as fp:
+    fp.writelines(line for gen in gens for line in gen.commandLog())
+  # A commands log of its own is rebuilt too.
+  with open(str(logs / 'other_commands.log'), 'w') as fp:
+    fp.writelines(StreamGenerator(seed = 8, games = 2).commandLog())
+  logdir = str(tmp_path / 'logs')
+  os.mkdir(logdir)
+  faeriatrack.runRebuild(cards, ['--jobs', '2', '--logs', logdir, str(logs)])
+  assert 'Rebuilding 3 sessions from 2 files' in capsys.readouterr().out
+  games = loggedGames(logdir)
+  assert len(games) == 5
+  # Run again, the games already there are replaced rather than added.
+  faeriatrack.runRebuild(cards, ['--jobs', '1', '--logs', logdir, str(logs)])
+  assert loggedGames(logdir) == games
@@ -0,0 +1,85 @@
+#   Copyright 2017 Vulpyne
+
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import json
+
+import pytest
+
+import faeriatrack
+import ftimeline
+from ftbench.generate import StreamGenerator
+
+
+def record(seed, keyevery):
+  '''Tracks a generated game with timelines on. Returns its Timeline, the tracker checkpoint after
+     each of its events, the checkpoint at the start of each turn and the timeline log written.'''
+  gen = StreamGenerator(seed = seed, games = 1)
+  fp = io.StringIO()
+  tracker = faeriatrack.Tracker(gen.cards(), io.StringIO(), sink = lambda msg: None)
+  tracker.recordTimelines(fp, keyevery)
+  timeline = None
+  states = []
+  turns = {}
+  for _,command in gen.commands():
+    tracker.feed(command)
+    game = tracker.game
+    if game is None or game.timeline is None or len(game.timeline) == len(states):
+      continue
+    timeline = game.timeline
+    state = json.loads(json.dumps(tracker.checkpoint()))
+    # Keyframes leave the account's decks out.
+    state['decks'] = []
+    states.append(state)
+    if '|~newTurn|' in command:
+      turns[game.turn] = state
+  return timeline, states, turns, fp.getvalue()
+
+
+@pytest.mark.parametrize('keyevery', [1, 4])
+def test_stateAt(keyevery):
+  timeline, states, turns, _ = record(14, keyevery)
+  assert len(timeline) == len(states) > 50
+  assert len(timeline.keyframes) > 1
+  for n,state in enumerate(states):
+    assert timeline.stateAt(event = n) == state
+  for turn,state in turns.items():
+    assert timeline.stateAt(turn = turn) == state
+  assert timeline.stateAt() == states[-1]
+  with pytest.raises(IndexError):
+    timeline.stateAt(event = len(states))
+
+
+def test_logRoundTrip():
+  timeline, states, _, text = record(15, 4)
+  (rec, loaded), = ftimeline.loadTimelines(io.StringIO(text))
+  assert rec['opponent'] is not None
+  assert loaded.todict() == timeline.todict()
+  assert loaded.turns == timeline.turns
+  for n in range(0, len(states), 7):
+    assert loaded.stateAt(event = n) == states[n]
+
+
+def test_restoreStateAt():
+  gen = StreamGenerator(seed = 14, games = 1)
+  timeline, states, turns, _ = record(14, 4)
+  turn = sorted(turns)[len(turns) // 2]
+  tracker = faeriatrack.Tracker(gen.cards(), io.StringIO(), sink = lambda msg: None)
+  tracker.restore(timeline.stateAt(turn = turn))
+  assert tracker.game.turn == turn
+  state = tracker.checkpoint()
+  state['decks'] = []
+  assert state == turns[turn]